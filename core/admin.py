@@ -1,7 +1,8 @@
 from django.contrib import admin
-from .models import Note, Exam, Profile
+from .models import Note, Exam, Profile, IngestionJob
 
 # This makes your models visible in the Admin Panel
 admin.site.register(Note)
 admin.site.register(Exam)
-admin.site.register(Profile)
\ No newline at end of file
+admin.site.register(Profile)
+admin.site.register(IngestionJob)
\ No newline at end of file
@@ -0,0 +1,124 @@
+# core/answer_cache.py
+# Two-level cache in front of the vault chat, per process:
+#   QuestionCache - LRU of exact (normalised) question text -> query embedding
+#   AnswerCache   - per-vault-scope answers, found by cosine similarity between
+#                   question embeddings, tagged with the vaults' on-disk version
+#                   and the chunks retrieved for the question
+# A scope is the tuple of vault owners a question searched (just the asker, or
+# a squad's sharing members). Answers only match while every one of those
+# vaults is unchanged, so uploads, deletes and renames invalidate them. Similar
+# wording isn't enough on its own: "flashcards for chapter 4" and "... chapter 5"
+# embed almost alike but retrieve different chunks, so they never share answers.
+
+import threading
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+# Where a freshly generated answer should be stored once it's complete
+AnswerSlot = namedtuple('AnswerSlot', ['scope', 'version', 'vector', 'context'])
+
+
+def normalise_question(question):
+    return " ".join(question.lower().split())
+
+
+def _unit(vector):
+    vector = np.asarray(vector, dtype='float32').ravel()
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class QuestionCache:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # (model, question) -> vector
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, model, question):
+        key = (model, normalise_question(question))
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return vector
+
+    def put(self, model, question, vector):
+        key = (model, normalise_question(question))
+        with self._lock:
+            self._entries[key] = np.asarray(vector, dtype='float32')
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+class AnswerCache:
+    """Reuses an answer when a new question retrieved the same context and its
+    embedding is within `threshold` cosine similarity of the earlier one."""
+
+    def __init__(self, max_scopes, max_per_scope, threshold):
+        self.max_scopes = max_scopes
+        self.max_per_scope = max_per_scope
+        self.threshold = threshold
+        self._scopes = OrderedDict()  # scope -> (version, vectors (n, dim), [answers], [contexts])
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, scope, version, vector, context=()):
+        """Returns (answer or None, slot to put() a fresh answer into).
+
+        `context` identifies the retrieved chunks (e.g. sorted (owner, chunk id) pairs).
+        """
+        vector = _unit(vector)
+        context = tuple(context)
+        slot = AnswerSlot(scope, version, vector, context)
+        with self._lock:
+            entry = self._scopes.get(scope)
+            if entry and entry[0] != version:
+                del self._scopes[scope]  # The vault changed under these answers
+                self.invalidations += 1
+                entry = None
+            if entry:
+                _, vectors, answers, contexts = entry
+                same_context = np.array([c == context for c in contexts])
+                sims = np.where(same_context, vectors @ vector, -np.inf)
+                best = int(np.argmax(sims))
+                if sims[best] >= self.threshold:
+                    self._scopes.move_to_end(scope)
+                    self.hits += 1
+                    return answers[best], slot
+            self.misses += 1
+            return None, slot
+
+    def put(self, slot, answer):
+        with self._lock:
+            entry = self._scopes.get(slot.scope)
+            if entry and entry[0] == slot.version:
+                _, vectors, answers, contexts = entry
+                vectors = np.vstack([vectors, slot.vector])[-self.max_per_scope:]
+                answers = (answers + [answer])[-self.max_per_scope:]
+                contexts = (contexts + [slot.context])[-self.max_per_scope:]
+            else:
+                vectors, answers, contexts = slot.vector.reshape(1, -1), [answer], [slot.context]
+            self._scopes[slot.scope] = (slot.version, vectors, answers, contexts)
+            self._scopes.move_to_end(slot.scope)
+            while len(self._scopes) > self.max_scopes:
+                self._scopes.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            answers = sum(len(entry[2]) for entry in self._scopes.values())
+        return {
+            'scopes': len(self._scopes), 'answers': answers, 'threshold': self.threshold,
+            'hits': self.hits, 'misses': self.misses, 'invalidations': self.invalidations,
+        }
@@ -0,0 +1,242 @@
+# core/chunk_store.py
+# Append-only on-disk chunk store for a user's vault:
+#   user_<id>.chunks  - every chunk's UTF-8 text, back to back
+#   user_<id>.offsets - int64 end offset of each chunk inside .chunks
+#   user_<id>.notes   - int64 id of the Note each chunk came from
+#   user_<id>.vectors - exact float32 embedding of each chunk (optional column)
+# Chunk i lives at chunks[offsets[i-1]:offsets[i]] and its id is the id of its
+# vector in the FAISS index. The exact vectors let a compressed index re-rank
+# its candidates and be rebuilt without loss. Writes only touch the new chunks; reads map the
+# files and decode just the hits. Deleting a note tombstones its rows
+# (DEAD_NOTE) in a new copy of the note-id column (.notes.v<n>), which the
+# vault's next commit publishes, until the vault is compacted.
+
+import mmap
+import os
+
+import numpy as np
+
+OFFSET_DTYPE = np.dtype('<i8')
+NOTE_DTYPE = np.dtype('<i8')
+VECTOR_DTYPE = np.dtype('<f4')
+
+UNKNOWN_NOTE = 0  # Chunks from vaults built before chunks were linked to notes
+DEAD_NOTE = -1    # Chunks of a deleted note awaiting compaction
+
+
+class ChunkStore:
+    def __init__(self, base_path, dim=None, notes_suffix='.notes'):
+        self.base_path = base_path
+        self.data_path = base_path + '.chunks'
+        self.offsets_path = base_path + '.offsets'
+        self.notes_suffix = notes_suffix  # Which copy of the note-id column is current
+        self.notes_path = base_path + notes_suffix
+        self.vectors_path = base_path + '.vectors'
+        self.dim = dim  # Width of the exact-vector column; None = no vector column
+
+    def exists(self):
+        return os.path.exists(self.offsets_path) and os.path.exists(self.data_path)
+
+    def __len__(self):
+        try:
+            return os.path.getsize(self.offsets_path) // OFFSET_DTYPE.itemsize
+        except FileNotFoundError:
+            return 0
+
+    def _committed_end(self, count):
+        """Byte length of .chunks covered by the first `count` offsets."""
+        if count == 0:
+            return 0
+        with open(self.offsets_path, 'rb') as f:
+            f.seek((count - 1) * OFFSET_DTYPE.itemsize)
+            return int(np.frombuffer(f.read(OFFSET_DTYPE.itemsize), dtype=OFFSET_DTYPE)[0])
+
+    def ensure_notes_column(self):
+        """Back-fills .notes for stores written before chunks carried a note id."""
+        count = len(self)
+        have = os.path.getsize(self.notes_path) // NOTE_DTYPE.itemsize if os.path.exists(self.notes_path) else 0
+        if have < count:
+            with open(self.notes_path, 'ab') as f:
+                f.write(np.full(count - have, UNKNOWN_NOTE, dtype=NOTE_DTYPE).tobytes())
+
+    def _row_bytes(self):
+        return self.dim * VECTOR_DTYPE.itemsize
+
+    def vector_count(self):
+        """Rows in the exact-vector column (may lag behind len() for vaults that predate it)."""
+        if not self.dim or not os.path.exists(self.vectors_path):
+            return 0
+        return min(len(self), os.path.getsize(self.vectors_path) // self._row_bytes())
+
+    def has_vectors(self):
+        return bool(self.dim) and self.vector_count() == len(self)
+
+    def vectors(self, chunk_ids=None):
+        """Exact vectors for `chunk_ids` (all chunks if None), read from the memory-mapped column."""
+        count = len(self)
+        if not count:
+            return np.zeros((0, self.dim), dtype=VECTOR_DTYPE)
+        column = np.memmap(self.vectors_path, dtype=VECTOR_DTYPE, mode='r', shape=(count, self.dim))
+        return np.array(column if chunk_ids is None else column[np.asarray(chunk_ids, dtype='int64')])
+
+    def set_vectors(self, vectors):
+        """Rewrites the whole vector column (back-fill for vaults written before it existed)."""
+        vectors = np.ascontiguousarray(vectors, dtype=VECTOR_DTYPE)
+        tmp_path = self.vectors_path + '.tmp'
+        vectors.tofile(tmp_path)
+        os.replace(tmp_path, self.vectors_path)
+
+    def append(self, texts, note_id=UNKNOWN_NOTE, vectors=None):
+        """Appends chunks and returns the id of the first one.
+
+        `note_id` is either one Note id for every chunk or a per-chunk array.
+        `vectors` go to the exact-vector column when it's complete up to here.
+        """
+        first_id = len(self)
+        start = self._committed_end(first_id)
+        encoded = [t.encode('utf-8') for t in texts]
+        ends = start + np.cumsum([len(b) for b in encoded], dtype=OFFSET_DTYPE)
+
+        # Data and note ids first, offsets last: the offsets file is what commits
+        # the new chunks. Truncating to the committed length drops anything left
+        # behind by a crashed write.
+        mode = 'r+b' if os.path.exists(self.data_path) else 'wb'
+        with open(self.data_path, mode) as f:
+            f.truncate(start)
+            f.seek(start)
+            f.write(b''.join(encoded))
+        mode = 'r+b' if os.path.exists(self.notes_path) else 'wb'
+        with open(self.notes_path, mode) as f:
+            f.truncate(first_id * NOTE_DTYPE.itemsize)
+            f.seek(first_id * NOTE_DTYPE.itemsize)
+            f.write(np.broadcast_to(np.asarray(note_id, dtype=NOTE_DTYPE), (len(texts),)).tobytes())
+        if vectors is not None and self.dim and self.vector_count() == first_id:
+            mode = 'r+b' if os.path.exists(self.vectors_path) else 'wb'
+            with open(self.vectors_path, mode) as f:
+                f.truncate(first_id * self._row_bytes())
+                f.seek(first_id * self._row_bytes())
+                f.write(np.ascontiguousarray(vectors, dtype=VECTOR_DTYPE).tobytes())
+        with open(self.offsets_path, 'ab') as f:
+            f.write(ends.astype(OFFSET_DTYPE).tobytes())
+        return first_id
+
+    def truncate(self, count):
+        """Drops every chunk from `count` onwards (what a crashed write appended but never committed)."""
+        count = max(0, min(count, len(self)))
+        end = self._committed_end(count)
+        with open(self.offsets_path, 'r+b') as f:
+            f.truncate(count * OFFSET_DTYPE.itemsize)
+        with open(self.data_path, 'r+b') as f:
+            f.truncate(end)
+        if os.path.exists(self.notes_path):
+            with open(self.notes_path, 'r+b') as f:
+                f.truncate(count * NOTE_DTYPE.itemsize)
+        if self.dim and self.vector_count() > count:
+            with open(self.vectors_path, 'r+b') as f:
+                f.truncate(count * self._row_bytes())
+
+    def note_ids(self):
+        count = len(self)
+        if not count:
+            return np.zeros(0, dtype=NOTE_DTYPE)
+        return np.fromfile(self.notes_path, dtype=NOTE_DTYPE, count=count)
+
+    def chunk_ids_for_note(self, note_id):
+        return np.flatnonzero(self.note_ids() == note_id).astype('int64')
+
+    def mark_dead(self, chunk_ids):
+        """Tombstones chunks in place. Only for stores no reader can see yet (a staged rebuild);
+        a published store gets its tombstones through with_tombstones()."""
+        if len(chunk_ids) == 0:
+            return
+        notes = np.memmap(self.notes_path, dtype=NOTE_DTYPE, mode='r+', shape=(len(self),))
+        notes[np.asarray(chunk_ids)] = DEAD_NOTE
+        notes.flush()
+        del notes
+
+    def with_tombstones(self, chunk_ids, notes_suffix):
+        """This store with `chunk_ids` tombstoned in a new note-id column at `notes_suffix`.
+
+        The current column is left alone, so readers (and a crash) keep the
+        committed state until a manifest names the new one.
+        """
+        staged = ChunkStore(self.base_path, dim=self.dim, notes_suffix=notes_suffix)
+        notes = self.note_ids().copy()
+        notes[np.asarray(chunk_ids, dtype='int64')] = DEAD_NOTE
+        tmp_path = staged.notes_path + '.tmp'
+        notes.tofile(tmp_path)
+        os.replace(tmp_path, staged.notes_path)
+        return staged
+
+    def dead_count(self):
+        return int(np.count_nonzero(self.note_ids() == DEAD_NOTE))
+
+    def paths(self):
+        # Offsets last: replacing them is what commits a swapped-in store
+        return (self.data_path, self.notes_path, self.vectors_path, self.offsets_path)
+
+    def reset(self):
+        for path in self.paths():
+            if os.path.exists(path):
+                os.remove(path)
+
+    def move_to(self, base_path):
+        """Renames the store's files to another base path and returns the store there."""
+        moved = ChunkStore(base_path, dim=self.dim, notes_suffix=self.notes_suffix)
+        for path, new_path in zip(self.paths(), moved.paths()):
+            if os.path.exists(path):
+                os.replace(path, new_path)
+        return moved
+
+    def sync(self):
+        """Flushes the store's files to disk before a manifest commits them."""
+        for path in self.paths():
+            if os.path.exists(path):
+                with open(path, 'rb+') as f:
+                    os.fsync(f.fileno())
+
+    def reader(self, count=None):
+        return ChunkReader(self, count)
+
+
+class ChunkReader:
+    """Read-only memory-mapped view of a ChunkStore, frozen at `count` chunks (default: its length when opened)."""
+
+    def __init__(self, store, count=None):
+        count = len(store) if count is None else min(count, len(store))
+        self.offsets = (
+            np.memmap(store.offsets_path, dtype=OFFSET_DTYPE, mode='r', shape=(count,))
+            if count else np.zeros(0, dtype=OFFSET_DTYPE)
+        )
+        self.note_ids = (
+            np.memmap(store.notes_path, dtype=NOTE_DTYPE, mode='r', shape=(count,))
+            if count else np.zeros(0, dtype=NOTE_DTYPE)
+        )
+        # Exact vectors for re-ranking; None while the column is incomplete
+        self.vectors = (
+            np.memmap(store.vectors_path, dtype=VECTOR_DTYPE, mode='r', shape=(count, store.dim))
+            if count and store.vector_count() >= count else None
+        )
+        self.data = b''
+        if count and os.path.getsize(store.data_path):
+            with open(store.data_path, 'rb') as f:
+                self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def get(self, chunk_id):
+        start = int(self.offsets[chunk_id - 1]) if chunk_id > 0 else 0
+        end = int(self.offsets[chunk_id])
+        return self.data[start:end].decode('utf-8', errors='replace')
+
+    def is_live(self, chunk_id):
+        return 0 <= chunk_id < len(self) and self.note_ids[chunk_id] != DEAD_NOTE
+
+    def get_many(self, chunk_ids):
+        return [self.get(i) for i in chunk_ids if self.is_live(i)]
+
+    @property
+    def nbytes(self):
+        # Only the id columns count against the cache budget; text pages are left to the OS
+        return self.offsets.nbytes + self.note_ids.nbytes
@@ -0,0 +1,101 @@
+# core/chunking.py
+# Splits extracted note text into vault chunks along its structure: headings
+# start a new section, paragraphs are packed whole up to the chunk size, long
+# paragraphs break at sentence ends, and each chunk repeats the last sentences
+# of the one before it (within a section) so an idea cut at a boundary still
+# reads whole. Chunks after the first in a section are prefixed with its
+# heading, so "Chapter 4" questions find every part of chapter 4.
+
+import re
+
+_MARKDOWN_HEADING = re.compile(r"^#{1,6}\s+\S")
+_KEYWORD_HEADING = re.compile(r"^(chapter|unit|section|module|lecture|part|topic)\s+[\dIVXivx]+\b", re.IGNORECASE)
+_NUMBERED_HEADING = re.compile(r"^\d+(\.\d+){0,3}\.?\s+[A-Z][^.!?]*$")
+_CAPS_HEADING = re.compile(r"^[A-Z][A-Z0-9 ,:&()/'\-]*$")
+_PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+MAX_HEADING_CHARS = 90
+
+
+def is_heading(line):
+    line = line.strip()
+    if not line or len(line) > MAX_HEADING_CHARS:
+        return False
+    if _MARKDOWN_HEADING.match(line) or _KEYWORD_HEADING.match(line) or _NUMBERED_HEADING.match(line):
+        return True
+    # ALL-CAPS titles, but not stray acronyms or page numbers
+    return bool(_CAPS_HEADING.match(line)) and sum(c.isalpha() for c in line) >= 4
+
+
+def split_sections(text):
+    """[(heading or '', [paragraph, ...]), ...] in document order."""
+    sections = [('', [])]
+    for block in _PARAGRAPH_BREAK.split(text):
+        paragraph = []
+        for line in block.splitlines():
+            if is_heading(line):
+                if paragraph:
+                    sections[-1][1].append(" ".join(paragraph))
+                    paragraph = []
+                sections.append((line.strip().lstrip('#').strip(), []))
+            elif line.strip():
+                paragraph.append(line.strip())
+        if paragraph:
+            sections[-1][1].append(" ".join(paragraph))
+    return [(heading, paragraphs) for heading, paragraphs in sections if heading or paragraphs]
+
+
+def _pieces(paragraph, size):
+    """Sentence-sized pieces of a paragraph, none longer than `size`."""
+    if len(paragraph) <= size:
+        return [paragraph]
+    pieces = []
+    for sentence in _SENTENCE_END.split(paragraph):
+        while len(sentence) > size:  # A run-on "sentence" (tables, OCR noise): cut it hard
+            pieces.append(sentence[:size])
+            sentence = sentence[size:]
+        if sentence:
+            pieces.append(sentence)
+    return pieces
+
+
+def _render(heading, pieces):
+    # pieces are (separator, text): " " inside a paragraph, "\n" between paragraphs
+    body = "".join(sep + text for sep, text in pieces).lstrip()
+    return f"{heading}\n{body}".rstrip() if heading else body
+
+
+def _tail(pieces, overlap):
+    """The last whole pieces of a chunk that fit in `overlap` characters."""
+    tail, length = [], 0
+    for piece in reversed(pieces):
+        length += len(piece[1]) + 1
+        if length > overlap:
+            break
+        tail.insert(0, piece)
+    return tail
+
+
+def chunk_text(text, chunk_size=1000, overlap=150):
+    """Structure-aware chunks of `text`, each at most `chunk_size` characters including its heading."""
+    chunks = []
+    for heading, paragraphs in split_sections(text):
+        base = len(heading) + 1 if heading else 0
+        current, length, fresh = [], base, 0  # fresh = pieces not carried over as overlap
+
+        for paragraph in paragraphs:
+            for i, piece in enumerate(_pieces(paragraph, max(1, chunk_size - base))):
+                if fresh and length + len(piece) + 1 > chunk_size:
+                    chunks.append(_render(heading, current))
+                    # Carry only what still leaves room for this piece. The chunk just
+                    # emitted didn't fit it, so the carry is never the whole of it.
+                    current = _tail(current, min(overlap, chunk_size - base - len(piece) - 1))
+                    length = base + sum(len(p) + 1 for _, p in current)
+                    fresh = 0
+                current.append((" " if i else "\n", piece))
+                length += len(piece) + 1
+                fresh += 1
+        if fresh or not paragraphs:
+            chunks.append(_render(heading, current))
+    return [c for c in chunks if c.strip()]
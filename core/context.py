@@ -0,0 +1,75 @@
+# core/context.py
+# Chooses which retrieved chunks go into the chat prompt. Search over-fetches
+# candidates; MMR (maximal marginal relevance) re-ranks them so each pick is
+# relevant to the question but unlike the picks before it, near-duplicates
+# (overlapping chunks, the same handout in two squadmates' vaults) are dropped,
+# and chunks are added until a fixed token budget is full.
+
+import numpy as np
+
+CHARS_PER_TOKEN = 4  # Close enough for English prose; no tokenizer round trip
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def _unit_rows(vectors):
+    vectors = np.asarray(vectors, dtype='float32')
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def relevance(query, vectors):
+    return _unit_rows(vectors) @ _unit_rows(query).ravel()
+
+
+def mmr(query, vectors, k, relevance_weight=0.7):
+    """Row indices of up to `k` vectors in MMR order.
+
+    Each step takes the row maximising
+    relevance_weight * sim(query, row) - (1 - relevance_weight) * max sim(row, already picked).
+    """
+    vectors = _unit_rows(vectors)
+    query = _unit_rows(query).ravel()
+    relevance = vectors @ query
+    redundancy = np.zeros(len(vectors), dtype='float32')  # Max similarity to anything picked so far
+    available = np.ones(len(vectors), dtype=bool)
+    order = []
+    for _ in range(min(k, len(vectors))):
+        scores = relevance_weight * relevance - (1 - relevance_weight) * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        order.append(best)
+        available[best] = False
+        redundancy = np.maximum(redundancy, vectors @ vectors[best])
+    return order
+
+
+def assemble(query, vectors, texts, token_budget, relevance_weight=0.7, duplicate_threshold=0.95, min_relevance=0.5):
+    """Positions into `texts` to put in the prompt, best first.
+
+    Candidates are visited in MMR order. One is skipped when it's nearly
+    identical to a chunk already taken, when it's less than `min_relevance`
+    times as similar to the query as the best candidate (MMR alone would happily
+    fill the budget with unrelated text), or when it would overflow
+    `token_budget` (a shorter one further down may still fit).
+    """
+    if not len(texts):
+        return []
+    unit = _unit_rows(vectors)
+    scores = relevance(query, vectors)
+    best = float(scores.max())
+    floor = best * min_relevance if best > 0 else -np.inf
+    chosen, used = [], 0
+    for i in mmr(query, vectors, len(texts), relevance_weight):
+        if scores[i] < floor:
+            continue
+        if chosen and float(np.max(unit[chosen] @ unit[i])) >= duplicate_threshold:
+            continue
+        cost = estimate_tokens(texts[i])
+        if used + cost > token_budget:
+            continue
+        chosen.append(i)
+        used += cost
+    return chosen
@@ -0,0 +1,199 @@
+# core/datesheet.py
+# Turns the OCR text of a university datesheet into Exam rows. Every line goes
+# through one classifier: OCR look-alikes are fixed in a single translate, the
+# date pattern rejects most lines straight away, and only lines with a date pay
+# for the subject clean-up. Parsing is pure (no database), so it can be tested
+# and benchmarked on plain text; import_exams() writes the results in one
+# bulk insert, skipping exams the user already has.
+#
+# read_pages() gets the text: the PDF text layer where a page has one, otherwise
+# OCR that starts at a low dpi on the table area and re-reads only the lines
+# Tesseract is unsure of at higher resolution (see ocr.ocr_page_adaptive).
+
+import json
+import os
+import re
+import time
+from collections import namedtuple
+from datetime import datetime
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import extraction, ocr
+from .models import Exam
+from .ocr_cache import file_digest
+
+ParsedExam = namedtuple('ParsedExam', ['subject', 'date', 'semester'])
+
+MIN_LINE_CHARS = 10
+EXAM_HOUR = 9  # Datesheets give the day; exams default to 9 AM
+
+# Tesseract's usual confusions on table scans, applied after upper-casing
+_OCR_FIXES = str.maketrans({'|': ' ', '!': ' ', ']': '1', 'O': '0', 'L': '1', 'I': '1'})
+_DATE = re.compile(r'(\d{1,2})[-/\s.]([A-Z]{3}|\d{1,2})[-/\s.](\d{4})')
+_SEMESTER = re.compile(r'(\d+)\s*SEM')
+_COURSE_CODE = re.compile(r'\b[A-Z0-9]{5,10}\b')
+_NOISE_WORDS = re.compile(r'MORNING|EVENING|CSE|BRANCH|SESSION')
+
+
+def clean_line(line):
+    return line.upper().translate(_OCR_FIXES)
+
+
+@lru_cache(maxsize=1024)
+def parse_date(date_str):
+    """Aware datetime at EXAM_HOUR for '12-MAR-2026' style dates, or None."""
+    normalised = date_str.replace('.', '-').replace('/', '-')
+    for fmt in ("%d-%b-%Y", "%d-%B-%Y"):
+        try:
+            day = datetime.strptime(normalised, fmt)
+            break
+        except ValueError:
+            continue
+    else:
+        return None
+    return timezone.make_aware(datetime(day.year, day.month, day.day, EXAM_HOUR, 0))
+
+
+def parse_line(line):
+    """The ParsedExam on one line of OCR text, or None if it doesn't hold one."""
+    line = line.strip()
+    if len(line) < MIN_LINE_CHARS:
+        return None
+    clean = clean_line(line)
+    date_match = _DATE.search(clean)
+    if not date_match:
+        return None
+
+    date_str = date_match.group(0)
+    sem_match = _SEMESTER.search(clean)
+    semester = f"Sem {sem_match.group(1)}" if sem_match else "Unknown"
+
+    subject = clean.replace(date_str, '')
+    subject = _SEMESTER.sub('', subject)
+    subject = _COURSE_CODE.sub('', subject)
+    subject = _NOISE_WORDS.sub('', subject).strip()
+    if len(subject) <= 3 or subject.isdigit():
+        return None
+
+    date = parse_date(date_str)
+    if date is None:
+        return None
+    return ParsedExam(subject.title(), date, semester)
+
+
+def parse_text(text):
+    """Yields a ParsedExam for every line of `text` that holds one."""
+    for line in text.split('\n'):
+        entry = parse_line(line)
+        if entry:
+            yield entry
+
+
+def ocr_options():
+    """The settings that shape datesheet OCR output; part of its cache key."""
+    return {
+        'mode': 'adaptive',
+        'dpis': list(getattr(settings, 'DATESHEET_OCR_DPIS', (150, 300, 600))),
+        'min_confidence': getattr(settings, 'DATESHEET_OCR_MIN_CONFIDENCE', 75),
+        'contrast': 2.0,
+        'config': '--psm 6',
+        'min_chars': extraction.MIN_PAGE_CHARS,
+    }
+
+
+def read_pages(pdf_path, poppler_path=None, cache=None, digest=None):
+    """A dict per page: its 'text' plus how it was read ('method', 'dpi', 'confidence', ...).
+
+    Pages with a text layer skip OCR entirely. With a `cache` (ocr_cache.PageCache)
+    a datesheet read before with the same settings comes straight from it.
+    `digest` is the file's SHA-256 if already known (Note.content_hash).
+    """
+    options = ocr_options()
+    digest = digest or file_digest(pdf_path)
+    key = None
+    if cache is not None:
+        key = cache.make_key(digest, 'datesheet', options)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    layer = extraction.read_text_layer(pdf_path)
+    if layer is None:
+        layer = [extraction.PageText(n, "", 'text', 0.0) for n in range(1, ocr.count_pages(pdf_path, poppler_path) + 1)]
+
+    pages = []
+    for page in layer:
+        if len(page.text.strip()) >= options['min_chars']:
+            pages.append({'page': page.number, 'text': page.text, 'method': 'text', 'seconds': round(page.seconds, 2)})
+            continue
+        try:
+            text, stats = ocr.ocr_page_adaptive(
+                pdf_path, page.number, dpis=options['dpis'], min_confidence=options['min_confidence'],
+                contrast=options['contrast'], config=options['config'], poppler_path=poppler_path,
+                timeout=getattr(settings, 'OCR_PAGE_TIMEOUT', None),
+            )
+        except Exception as e:
+            print(f"   ⚠️ Datesheet page {page.number} failed: {e}")
+            text, stats = "", {'page': page.number, 'method': 'ocr', 'error': str(e), 'timed_out': ocr.is_timeout(e)}
+        pages.append({**stats, 'text': text})
+
+    record_stats(digest, pages)
+    # A page that timed out or failed is left uncached so it's retried next time; blank pages are kept
+    if key and not any('error' in p for p in pages):
+        cache.put(key, 'datesheet', pages)
+    return pages
+
+
+def record_stats(digest, pages):
+    """Appends one JSON line per page (dpi reached, confidence before/after, time) for tuning the OCR settings."""
+    path = getattr(settings, 'DATESHEET_OCR_STATS_PATH', None) or os.path.join(
+        settings.MEDIA_ROOT, 'vectors', 'datesheet_ocr_stats.jsonl'
+    )
+    now = time.time()
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'a', encoding='utf-8') as f:
+            for page in pages:
+                stats = {k: v for k, v in page.items() if k != 'text'}
+                f.write(json.dumps({'time': now, 'file': digest[:16], 'chars': len(page['text']), **stats}) + "\n")
+    except OSError as e:
+        print(f"   ⚠️ Could not record datesheet OCR stats: {e}")
+    for page in pages:
+        if page['method'] == 'ocr' and 'dpi' in page:
+            print(f"     · p{page['page']}: ocr @{page['dpi']}dpi conf {page['confidence']:.0f}->{page['final_confidence']:.0f} "
+                  f"({page['retried_lines']}/{page['lines']} lines re-read, crop {page['crop']:.0%}) {page['seconds']:.2f}s")
+        elif 'error' in page:
+            print(f"     · p{page['page']}: ocr  {'timed out' if page['timed_out'] else 'failed'}")
+        else:
+            print(f"     · p{page['page']}: {page['method']:<4} {len(page['text']):>6} chars")
+
+
+def import_exams(user, entries):
+    """Creates datesheet Exams for `entries` the user doesn't have yet. Returns how many were created."""
+    entries = list(entries)
+    if not entries:
+        return 0
+    existing = set(
+        Exam.objects.filter(user=user, subject__in={e.subject for e in entries})
+        .values_list('subject', 'date')
+    )
+    new_exams = []
+    for entry in entries:
+        key = (entry.subject, entry.date)
+        if key in existing:
+            continue
+        existing.add(key)  # The same exam printed twice in one datesheet
+        new_exams.append(Exam(
+            user=user,
+            subject=entry.subject,
+            date=entry.date,
+            is_datesheet_entry=True,
+            details=f"{entry.semester} [Extracted]",
+        ))
+    with transaction.atomic():
+        Exam.objects.bulk_create(new_exams)
+    return len(new_exams)
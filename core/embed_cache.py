@@ -0,0 +1,80 @@
+# core/embed_cache.py
+# Content-addressed embedding store. Vectors are keyed by a hash of the model
+# name and the exact chunk text, so re-uploads and class-wide handouts reuse
+# embeddings across users instead of spending API quota again.
+
+import hashlib
+import sqlite3
+import threading
+
+import numpy as np
+
+# SQLite caps the number of bound parameters per statement
+_LOOKUP_BATCH = 500
+
+
+class EmbeddingCache:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " key TEXT PRIMARY KEY,"
+                " model TEXT NOT NULL,"
+                " dim INTEGER NOT NULL,"
+                " vector BLOB NOT NULL)"
+            )
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def make_key(model, text):
+        h = hashlib.sha256()
+        h.update(model.encode('utf-8'))
+        h.update(b'\0')
+        h.update(text.encode('utf-8'))
+        return h.hexdigest()
+
+    def get_many(self, model, texts):
+        """Returns {position: float32 vector} for every text already in the store."""
+        keys = [self.make_key(model, t) for t in texts]
+        positions = {}
+        for i, k in enumerate(keys):
+            positions.setdefault(k, []).append(i)
+
+        found = {}
+        unique = list(positions)
+        conn = self._conn()
+        for start in range(0, len(unique), _LOOKUP_BATCH):
+            batch = unique[start:start + _LOOKUP_BATCH]
+            marks = ",".join("?" * len(batch))
+            rows = conn.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({marks})", batch)
+            for key, blob in rows:
+                vector = np.frombuffer(blob, dtype='float32')
+                for i in positions[key]:
+                    found[i] = vector
+
+        self.hits += len(found)
+        self.misses += len(texts) - len(found)
+        return found
+
+    def put_many(self, model, texts, vectors):
+        vectors = np.asarray(vectors, dtype='float32')
+        rows = [
+            (self.make_key(model, t), model, int(v.shape[0]), v.tobytes())
+            for t, v in zip(texts, vectors)
+        ]
+        conn = self._conn()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, model, dim, vector) VALUES (?, ?, ?, ?)",
+                rows,
+            )
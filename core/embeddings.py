@@ -0,0 +1,228 @@
+# core/embeddings.py
+# Pluggable embedding backends. Ingestion and retrieval only talk to
+# get_embedding_backend(), so the vault can run on Google's API in production
+# and on a deterministic offline embedder in staging, CI and benchmarks.
+# VAULT_EMBEDDING_BACKEND selects one: 'gemini' (default) or 'local'.
+
+import asyncio
+import os
+import re
+import time
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import numpy as np
+import google.generativeai as genai
+from django.conf import settings
+
+from .rate_limit import get_limiter
+
+EMBED_DIM = 768
+
+
+def get_gemini_client():
+    api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        print("ERROR: GEMINI_API_KEY not found in .env")
+        return None
+    genai.configure(api_key=api_key)
+    return genai
+
+
+class EmbeddingBackend:
+    """Turns text into float32 vectors of size `dim`.
+
+    Both methods return None when the backend can't produce an embedding right
+    now (no key, quota exhausted...), mirroring how callers already handle it.
+    `model` namespaces the content-hash embedding cache, so vectors from
+    different backends never mix.
+    """
+    model = ''
+    dim = EMBED_DIM
+    max_batch = 256  # Most chunks per embed_documents() call
+    min_batch = 1
+    target_seconds = 3.0  # Batch size adapts to keep each call around this long
+
+    def available(self):
+        return True
+
+    def embed_documents(self, texts):
+        """(len(texts), dim) array for a batch of chunks, or None."""
+        raise NotImplementedError
+
+    def embed_query(self, text):
+        """(dim,) array for a question, or None."""
+        raise NotImplementedError
+
+    async def aembed_query(self, text):
+        """embed_query() for async views; runs it on a worker thread unless overridden."""
+        return await asyncio.to_thread(self.embed_query, text)
+
+
+class GeminiEmbeddingBackend(EmbeddingBackend):
+    model = "models/text-embedding-004"
+    max_batch = 100  # API cap on texts per embed_content request
+    min_batch = 5
+
+    def __init__(self, query_timeout=20):
+        self.query_timeout = query_timeout  # A chat shouldn't queue for quota forever
+
+    def available(self):
+        return bool(os.getenv("GEMINI_API_KEY"))
+
+    def _embed(self, content, task_type, timeout=None):
+        """Embeds within the shared quota; 429s back off as the API asks and retry.
+
+        Every text in a batch counts against the quota, so a batch costs its length.
+        """
+        client = get_gemini_client()
+        if client is None:
+            return None
+        try:
+            result = get_limiter('gemini-embed').call(
+                lambda: client.embed_content(model=self.model, content=content, task_type=task_type),
+                cost=len(content) if isinstance(content, list) else 1,
+                timeout=timeout,
+            )
+        except Exception as e:
+            print(f"   ❌ Error: {e}")
+            return None
+        return np.array(result['embedding'], dtype='float32')
+
+    def embed_documents(self, texts):
+        return self._embed(list(texts), "retrieval_document")
+
+    def embed_query(self, text):
+        return self._embed(text, "retrieval_query", timeout=self.query_timeout)
+
+    async def aembed_query(self, text):
+        client = get_gemini_client()
+        if client is None:
+            return None
+        try:
+            result = await get_limiter('gemini-embed').acall(
+                lambda: client.embed_content_async(model=self.model, content=text, task_type="retrieval_query"),
+                timeout=self.query_timeout,
+            )
+        except Exception as e:
+            print(f"   ❌ Error: {e}")
+            return None
+        return np.array(result['embedding'], dtype='float32')
+
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+class HashingEmbeddingBackend(EmbeddingBackend):
+    """Deterministic offline embedder: signed feature hashing of words and word bigrams.
+
+    No network, no model weights, no randomness - the same text always gives
+    the same unit vector, so ingestion and retrieval can be exercised and
+    load-tested at disk speed. Retrieval quality is lexical, not semantic.
+    """
+    model = "local/hashing-768-v1"
+
+    def _features(self, text):
+        words = _TOKEN_RE.findall(text.lower())
+        return words + [a + " " + b for a, b in zip(words, words[1:])]
+
+    def embed_documents(self, texts):
+        texts = list(texts)
+        rows, cols, signs = [], [], []
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                h = zlib.crc32(feature.encode('utf-8'))
+                rows.append(row)
+                cols.append(h % self.dim)
+                signs.append(1.0 if (h >> 31) & 1 else -1.0)
+
+        counts = np.zeros((len(texts), self.dim), dtype='float32')
+        if rows:
+            np.add.at(counts, (np.asarray(rows), np.asarray(cols)), np.asarray(signs, dtype='float32'))
+        # Sublinear term frequency, then unit length so L2 distance tracks cosine similarity
+        vectors = np.sign(counts) * np.log1p(np.abs(counts))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        np.divide(vectors, norms, out=vectors, where=norms > 0)
+        return vectors
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    async def aembed_query(self, text):
+        return self.embed_query(text)  # Pure NumPy on one string: cheaper than a thread hop
+
+
+BACKENDS = {
+    'gemini': GeminiEmbeddingBackend,
+    'local': HashingEmbeddingBackend,
+}
+
+_backend = None
+
+
+def get_embedding_backend():
+    global _backend
+    if _backend is None:
+        name = getattr(settings, 'VAULT_EMBEDDING_BACKEND', 'gemini')
+        if name not in BACKENDS:
+            raise ValueError(f"Unknown VAULT_EMBEDDING_BACKEND '{name}' (choose from {', '.join(BACKENDS)})")
+        _backend = BACKENDS[name]()
+    return _backend
+
+
+class AdaptiveBatchSize:
+    """Doubles the batch while calls come back quickly, halves it when they drag."""
+
+    def __init__(self, embedder):
+        self.embedder = embedder
+        self.size = embedder.max_batch
+
+    def record(self, count, seconds):
+        target = self.embedder.target_seconds
+        if seconds > target:
+            # Several batches of one size may land slow together: halve once, not per batch
+            self.size = max(self.embedder.min_batch, min(self.size, count // 2))
+        elif seconds < target / 2 and count >= self.size:
+            self.size = min(self.embedder.max_batch, self.size * 2)
+
+
+def _timed(fn, batch):
+    started = time.perf_counter()
+    return fn(batch), time.perf_counter() - started
+
+
+def embed_all(embedder, texts, on_batch=None, max_workers=None):
+    """Embeds `texts` with up to `max_workers` batches in flight at once.
+
+    Vectors are written straight into one preallocated array, in input order.
+    `on_batch(start, end, vectors)` fires as each batch lands (for caching and
+    progress). Returns the array, or None as soon as any batch fails.
+    """
+    texts = list(texts)
+    out = np.empty((len(texts), embedder.dim), dtype='float32')
+    max_workers = max_workers or getattr(settings, 'VAULT_EMBED_CONCURRENCY', 4)
+    batch_size = AdaptiveBatchSize(embedder)
+    pending = {}
+    next_start = 0
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='embed') as pool:
+        while next_start < len(texts) or pending:
+            while next_start < len(texts) and len(pending) < max_workers:
+                end = min(len(texts), next_start + batch_size.size)
+                future = pool.submit(_timed, embedder.embed_documents, texts[next_start:end])
+                pending[future] = (next_start, end)
+                next_start = end
+
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                start, end = pending.pop(future)
+                vectors, seconds = future.result()
+                if vectors is None:
+                    for other in pending:
+                        other.cancel()
+                    return None
+                out[start:end] = vectors
+                batch_size.record(end - start, seconds)
+                if on_batch:
+                    on_batch(start, end, out[start:end])
+    return out
@@ -0,0 +1,94 @@
+# core/extraction.py
+# Per-page hybrid text extraction: use the PDF text layer where a page has one
+# and send only the remaining (scanned) pages to OCR.
+
+import time
+from dataclasses import dataclass
+
+import pdfplumber
+
+from . import ocr
+from .ocr_cache import file_digest
+
+# A page with less text than this is treated as a scan and OCR'd
+MIN_PAGE_CHARS = 25
+
+
+@dataclass
+class PageText:
+    number: int     # 1-based page number
+    text: str
+    method: str     # 'text' (PDF text layer) or 'ocr'
+    seconds: float  # time spent extracting this page
+
+
+def read_text_layer(pdf_path):
+    """A PageText per page from the PDF text layer, or None if the file can't be parsed."""
+    pages = []
+    try:
+        with pdfplumber.open(pdf_path) as pdf:
+            for number, page in enumerate(pdf.pages, start=1):
+                started = time.perf_counter()
+                try:
+                    text = page.extract_text() or ""
+                except Exception:
+                    text = ""
+                page.flush_cache()  # Don't keep every parsed page alive
+                pages.append(PageText(number, text, 'text', time.perf_counter() - started))
+    except Exception as e:
+        print(f"   ⚠️ Text layer unreadable ({e}), falling back to OCR for every page.")
+        return None
+    return pages
+
+
+def ocr_cache_options(ocr_options, min_chars=MIN_PAGE_CHARS):
+    """The OCR settings that change extracted text (paths, workers and timeouts don't)."""
+    options = {k: v for k, v in (ocr_options or {}).items() if k in ('dpi', 'contrast', 'config')}
+    options['min_chars'] = min_chars
+    return options
+
+
+def extract_pages(pdf_path, ocr_options=None, min_chars=MIN_PAGE_CHARS, progress=None, cache=None, digest=None):
+    """Returns a PageText for every page, OCR-ing only pages without a usable text layer.
+
+    `ocr_options` are passed straight to ocr.ocr_pages_timed(). With a `cache`
+    (ocr_cache.PageCache) a file whose bytes were extracted before with the
+    same settings comes straight from it; pass the file's SHA-256 as `digest`
+    (Note.content_hash) to skip hashing it again.
+    """
+    ocr_options = ocr_options or {}
+    key = None
+    if cache is not None:
+        key = cache.make_key(digest or file_digest(pdf_path), 'pages', ocr_cache_options(ocr_options, min_chars))
+        cached = cache.get(key)
+        if cached is not None:
+            return [PageText(number, text, method, 0.0) for number, text, method in cached]
+
+    pages = read_text_layer(pdf_path)
+    if pages is None:
+        poppler_path = ocr_options.get('poppler_path')
+        pages = [PageText(n, "", 'text', 0.0) for n in range(1, ocr.count_pages(pdf_path, poppler_path) + 1)]
+
+    scanned = [p for p in pages if len(p.text.strip()) < min_chars]
+    failed = False
+    if scanned:
+        if progress:
+            progress('ocr', 10)
+        results = ocr.ocr_pages_timed(pdf_path, [p.number for p in scanned], **ocr_options)
+        for page, result in zip(scanned, results):
+            page.text = result.text
+            page.method = 'ocr'
+            page.seconds += result.seconds
+            failed = failed or bool(result.error)
+    # A page that timed out or failed is left uncached so it's retried next time; blank pages are kept
+    if key and not failed:
+        cache.put(key, 'pages', [(p.number, p.text, p.method) for p in pages])
+    return pages
+
+
+def print_page_report(pages):
+    ocr_count = sum(1 for p in pages if p.method == 'ocr')
+    total = sum(p.seconds for p in pages)
+    print(f"   - Extracted {len(pages)} pages ({len(pages) - ocr_count} text layer, {ocr_count} OCR) in {total:.2f}s")
+    for p in pages:
+        print(f"     · p{p.number}: {p.method:<4} {len(p.text):>6} chars {p.seconds:6.2f}s")
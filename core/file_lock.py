@@ -0,0 +1,88 @@
+# core/file_lock.py
+# Exclusive lock on a path, held across processes (flock on POSIX, msvcrt on
+# Windows) and across the threads of this process. Re-entrant for the thread
+# that holds it, so a locked write can call another locked write.
+
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+class _PathLock:
+    def __init__(self):
+        self.rlock = threading.RLock()
+        self.depth = 0
+        self.fd = None
+
+
+_path_locks = {}
+_path_locks_guard = threading.Lock()
+
+
+def _lock_fd(fd):
+    if fcntl:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        return
+    while True:
+        try:
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_LOCK, 1)  # Itself retries for ~10s before raising
+            return
+        except OSError:
+            time.sleep(0.05)
+
+
+def _unlock_fd(fd):
+    if fcntl:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+class FileLock:
+    def __init__(self, path):
+        self.path = path
+        with _path_locks_guard:
+            self._state = _path_locks.setdefault(os.path.abspath(path), _PathLock())
+
+    def acquire(self):
+        state = self._state
+        state.rlock.acquire()
+        if state.depth == 0:
+            try:
+                fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                try:
+                    _lock_fd(fd)
+                except BaseException:
+                    os.close(fd)
+                    raise
+            except BaseException:
+                state.rlock.release()
+                raise
+            state.fd = fd
+        state.depth += 1
+
+    def release(self):
+        state = self._state
+        state.depth -= 1
+        if state.depth == 0:
+            fd, state.fd = state.fd, None
+            try:
+                _unlock_fd(fd)
+            finally:
+                os.close(fd)
+        state.rlock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
@@ -0,0 +1,123 @@
+# core/generation.py
+# Chat models that write the vault's answers. VAULT_CHAT_MODEL selects one:
+# 'gemini' (default) or 'local', a deterministic stand-in that needs no key or
+# network so the chat endpoint and its streaming can be tested offline.
+
+import asyncio
+import os
+import re
+import time
+
+from django.conf import settings
+
+from .embeddings import get_gemini_client
+from .rate_limit import get_limiter
+
+GEMINI_CHAT_MODEL = 'gemini-2.5-flash'  # 2.5 Flash is the stable model for 2026
+
+
+class ChatModel:
+    def available(self):
+        return True
+
+    def generate(self, prompt):
+        """The whole answer as one string."""
+        raise NotImplementedError
+
+    def stream(self, prompt):
+        """Yields the answer in pieces as the model produces them."""
+        yield self.generate(prompt)
+
+    # Async views use these; by default the sync calls run on a worker thread
+    async def agenerate(self, prompt):
+        return await asyncio.to_thread(self.generate, prompt)
+
+    async def astream(self, prompt):
+        yield await self.agenerate(prompt)
+
+
+class GeminiChatModel(ChatModel):
+    def __init__(self, name=GEMINI_CHAT_MODEL, timeout=30):
+        self.name = name
+        self.timeout = timeout  # Longest a chat waits for generation quota
+
+    def available(self):
+        return bool(os.getenv("GEMINI_API_KEY"))
+
+    def _model(self):
+        client = get_gemini_client()
+        if client is None:
+            raise RuntimeError("AI Key missing.")
+        return client.GenerativeModel(self.name)
+
+    def generate(self, prompt):
+        model = self._model()
+        response = get_limiter('gemini-generate').call(lambda: model.generate_content(prompt), timeout=self.timeout)
+        return response.text
+
+    def stream(self, prompt):
+        model = self._model()
+        response = get_limiter('gemini-generate').call(
+            lambda: model.generate_content(prompt, stream=True), timeout=self.timeout
+        )
+        for chunk in response:
+            if chunk.parts:  # The final chunk may carry only the finish reason
+                yield chunk.text
+
+    async def agenerate(self, prompt):
+        model = self._model()
+        response = await get_limiter('gemini-generate').acall(
+            lambda: model.generate_content_async(prompt), timeout=self.timeout
+        )
+        return response.text
+
+    async def astream(self, prompt):
+        model = self._model()
+        response = await get_limiter('gemini-generate').acall(
+            lambda: model.generate_content_async(prompt, stream=True), timeout=self.timeout
+        )
+        async for chunk in response:
+            if chunk.parts:
+                yield chunk.text
+
+
+class LocalChatModel(ChatModel):
+    """Answers by quoting the start of the retrieved context back, word by word."""
+
+    def __init__(self, delay=0.0, max_words=80):
+        self.delay = delay  # Seconds per streamed word, to mimic a real model's pace
+        self.max_words = max_words
+
+    def _words(self, prompt):
+        match = re.search(r"CONTEXT:(.*)QUESTION:", prompt, re.DOTALL)
+        context = match.group(1) if match else prompt
+        context = re.sub(r"\[Source:[^\]]*\]", " ", context)
+        words = context.split()[:self.max_words]
+        return ["From your notes:"] + words if words else ["Nothing", "relevant", "in", "your", "notes."]
+
+    def generate(self, prompt):
+        return " ".join(self._words(prompt))
+
+    def stream(self, prompt):
+        for i, word in enumerate(self._words(prompt)):
+            if self.delay:
+                time.sleep(self.delay)
+            yield word if i == 0 else " " + word
+
+    async def agenerate(self, prompt):
+        return self.generate(prompt)
+
+    async def astream(self, prompt):
+        for i, word in enumerate(self._words(prompt)):
+            if self.delay:
+                await asyncio.sleep(self.delay)
+            yield word if i == 0 else " " + word
+
+
+def get_chat_model():
+    name = getattr(settings, 'VAULT_CHAT_MODEL', 'gemini')
+    if name == 'local':
+        return LocalChatModel(delay=getattr(settings, 'VAULT_LOCAL_CHAT_DELAY', 0.0))
+    if name == 'gemini':
+        return GeminiChatModel()
+    raise ValueError(f"Unknown VAULT_CHAT_MODEL '{name}' (choose from gemini, local)")
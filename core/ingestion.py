@@ -0,0 +1,145 @@
+# core/ingestion.py
+# Durable background queue that feeds uploaded notes into the AI vault.
+# The web request only enqueues a job; `manage.py ingest_worker` does the heavy
+# lifting (PDF extraction, OCR, embedding) in a separately sized worker pool.
+
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import IngestionJob
+
+MAX_ATTEMPTS = getattr(settings, 'INGESTION_MAX_ATTEMPTS', 3)
+# A running job that hasn't reported progress for this long is assumed dead
+STALE_AFTER = timedelta(seconds=getattr(settings, 'INGESTION_STALE_SECONDS', 1800))
+RETRY_SECONDS = getattr(settings, 'INGESTION_RETRY_SECONDS', 60)
+
+
+def enqueue_note(note):
+    """Queues (or re-queues) a note for indexing and returns its job."""
+    job, created = IngestionJob.objects.get_or_create(note=note)
+    if not created:
+        job.status = IngestionJob.STATUS_QUEUED
+        job.stage = ''
+        job.progress = 0
+        job.attempts = 0
+        job.error = ''
+        job.started_at = None
+        job.finished_at = None
+        job.retry_after = None
+        job.save()
+    return job
+
+
+def _claimable():
+    now = timezone.now()
+    due = Q(retry_after__isnull=True) | Q(retry_after__lte=now)
+    stale = Q(status=IngestionJob.STATUS_RUNNING, updated_at__lt=now - STALE_AFTER)
+    return (Q(status=IngestionJob.STATUS_QUEUED) & due) | (stale & Q(attempts__lt=MAX_ATTEMPTS))
+
+
+def fail_exhausted_jobs():
+    """Fails jobs whose worker died on their last attempt (e.g. a note that crashes it) instead of retrying forever."""
+    now = timezone.now()
+    return IngestionJob.objects.filter(
+        status=IngestionJob.STATUS_RUNNING, updated_at__lt=now - STALE_AFTER, attempts__gte=MAX_ATTEMPTS
+    ).update(
+        status=IngestionJob.STATUS_FAILED,
+        stage='error',
+        error='The worker stopped responding on every attempt.',
+        finished_at=now,
+    )
+
+
+def claim_next_job():
+    """Atomically moves the oldest claimable job to RUNNING. Returns it or None."""
+    fail_exhausted_jobs()
+    candidates = IngestionJob.objects.filter(_claimable()).order_by('created_at').values_list('id', flat=True)[:10]
+    for job_id in candidates:
+        now = timezone.now()
+        # The conditional UPDATE is the lock: only one worker can win the row
+        claimed = IngestionJob.objects.filter(_claimable(), id=job_id).update(
+            status=IngestionJob.STATUS_RUNNING,
+            stage='starting',
+            attempts=F('attempts') + 1,
+            started_at=now,
+            updated_at=now,
+        )
+        if claimed:
+            return IngestionJob.objects.select_related('note', 'note__user').get(id=job_id)
+    return None
+
+
+def make_progress_reporter(job):
+    """Returns a callback(stage, percent) that persists progress and heartbeats the job."""
+    def report(stage, percent):
+        IngestionJob.objects.filter(id=job.id).update(
+            stage=stage[:50],
+            progress=max(0, min(100, int(percent))),
+            updated_at=timezone.now(),
+        )
+    return report
+
+
+def run_job(job):
+    """Indexes the job's note. Errors (including temporary embedding failures) are
+    retried with a growing delay up to MAX_ATTEMPTS; an unreadable file fails at once."""
+    from . import rag  # Heavy imports (faiss, genai, OCR) only live in the worker
+
+    try:
+        success = rag.add_note_to_vault(job.note, progress=make_progress_reporter(job))
+    except Exception as e:
+        if isinstance(e, rag.IndexingDeferred):
+            print(f"   ⏳ {e}")
+        else:
+            traceback.print_exc()
+        retry = job.attempts < MAX_ATTEMPTS
+        IngestionJob.objects.filter(id=job.id).update(
+            status=IngestionJob.STATUS_QUEUED if retry else IngestionJob.STATUS_FAILED,
+            stage='retrying' if retry else 'error',
+            error=str(e)[:2000],
+            retry_after=timezone.now() + timedelta(seconds=RETRY_SECONDS * 2 ** (job.attempts - 1)) if retry else None,
+            finished_at=None if retry else timezone.now(),
+        )
+        return False
+
+    IngestionJob.objects.filter(id=job.id).update(
+        status=IngestionJob.STATUS_DONE if success else IngestionJob.STATUS_FAILED,
+        stage='indexed' if success else 'unreadable',
+        progress=100 if success else F('progress'),
+        error='' if success else 'File might be too short or unreadable.',
+        finished_at=timezone.now(),
+    )
+    return success
+
+
+def compact_flagged_vaults():
+    """Compacts the vaults that note deletes left mostly dead (see vault.remove_note)."""
+    from . import vault
+
+    for user_id in vault.user_ids_flagged_for_compaction():
+        try:
+            vault.compact_if_flagged(user_id)
+        except Exception:
+            traceback.print_exc()
+
+
+def work(stop_event, poll_interval=2.0, once=False):
+    """Worker loop: claim, run, repeat; compacts flagged vaults whenever the queue is empty.
+    Exits when stop_event is set (or the queue drains with once=True)."""
+    while not stop_event.is_set():
+        close_old_connections()
+        job = claim_next_job()
+        if job is None:
+            compact_flagged_vaults()
+            if once:
+                return
+            stop_event.wait(poll_interval)
+            continue
+        print(f"⚙️ WORKER: Indexing note #{job.note_id} (attempt {job.attempts})...")
+        run_job(job)
+    close_old_connections()
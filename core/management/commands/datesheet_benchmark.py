@@ -0,0 +1,88 @@
+import random
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core import datesheet
+from core.models import Exam
+
+SAMPLE_SUBJECTS = ["DATA BASE", "MATHS III", "COMPUTER NETWORKS", "OPERATING SYSTEMS", "DISCRETE MATHS", "WEB TECH"]
+SAMPLE_MONTHS = ["JAN", "FEB", "MAR", "APR", "MAY", "JUN", "AUG", "SEP", "DEC"]
+
+
+def sample_ocr_text(lines, seed=0):
+    """OCR-like datesheet text: exam rows mixed with headers, blank lines and Tesseract noise."""
+    rng = random.Random(seed)
+    out = []
+    for i in range(lines):
+        kind = rng.random()
+        if kind < 0.6:
+            out.append(
+                f"| {rng.randint(1, 8)} SEM | CSE{rng.randint(100, 999)}{rng.choice('ABC')} | "
+                f"{rng.choice(SAMPLE_SUBJECTS)} | {rng.randint(1, 28):02d}-{rng.choice(SAMPLE_MONTHS)}-2026 | "
+                f"{rng.choice(['MORNING', 'EVENING'])} SESSION"
+            )
+        elif kind < 0.8:
+            out.append(rng.choice(["UNIVERSITY EXAMINATION DATESHEET", "Page %d of 12" % (i % 12 + 1), "", "—— —— ——"]))
+        else:
+            out.append("Sr. No. Semester Course Code Course Title Date Session")
+    return "\n".join(out)
+
+
+class Command(BaseCommand):
+    help = "Times datesheet parsing and the Exam import on sample (or saved) OCR text."
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='*', help="Text files of OCR output (default: generated sample).")
+        parser.add_argument('--lines', type=int, default=5000, help="Lines of generated sample text.")
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--skip-db', action='store_true', help="Only time parsing.")
+
+    def handle(self, *args, **options):
+        if options['files']:
+            texts = []
+            for path in options['files']:
+                with open(path, encoding='utf-8', errors='replace') as f:
+                    texts.append(f.read())
+            text = "\n".join(texts)
+        else:
+            text = sample_ocr_text(options['lines'])
+        line_count = text.count("\n") + 1
+
+        best = float('inf')
+        for _ in range(options['repeat']):
+            datesheet.parse_date.cache_clear()
+            start = time.perf_counter()
+            entries = list(datesheet.parse_text(text))
+            best = min(best, time.perf_counter() - start)
+        self.stdout.write(
+            f"Parse: {line_count} lines -> {len(entries)} exams in {best * 1000:.1f} ms "
+            f"({line_count / best:,.0f} lines/s, best of {options['repeat']})"
+        )
+        if options['skip_db'] or not entries:
+            return
+
+        # Both inserts run inside a transaction that is rolled back, so nothing is kept
+        for label, insert in (("per-row", self._insert_per_row), ("bulk", datesheet.import_exams)):
+            with transaction.atomic():
+                user = User.objects.create(username=f"datesheet-benchmark-{time.time_ns()}")
+                start = time.perf_counter()
+                created = insert(user, entries)
+                elapsed = time.perf_counter() - start
+                transaction.set_rollback(True)
+            self.stdout.write(f"Import ({label}): {created} exams in {elapsed * 1000:.1f} ms")
+
+    @staticmethod
+    def _insert_per_row(user, entries):
+        """The old one-query-per-line import, for comparison."""
+        created = 0
+        for entry in entries:
+            if not Exam.objects.filter(user=user, subject=entry.subject, date=entry.date).exists():
+                Exam.objects.create(
+                    user=user, subject=entry.subject, date=entry.date,
+                    is_datesheet_entry=True, details=f"{entry.semester} [Extracted]",
+                )
+                created += 1
+        return created
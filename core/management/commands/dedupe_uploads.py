@@ -0,0 +1,68 @@
+import os
+
+from django.core.files import File
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from core.models import Blob, Note
+from core.storage import digest_from_name, note_storage
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves note files uploaded before content-addressed storage into it (one file per distinct "
+        "content), then recounts blob references and removes blobs no note uses."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Only report what would change.")
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        moved = missing = legacy_bytes = 0
+        blob_bytes = sum(Blob.objects.values_list('size', flat=True))
+
+        for note in Note.objects.exclude(file='').iterator():
+            if digest_from_name(note.file.name):
+                continue
+            old_name = note.file.name
+            if not note_storage.exists(old_name):
+                missing += 1
+                continue
+            legacy_bytes += note_storage.size(old_name)
+            moved += 1
+            if dry_run:
+                continue
+            with note_storage.open(old_name, 'rb') as f:
+                note.file.save(os.path.basename(old_name), File(f), save=False)
+            note.original_name = note.original_name or os.path.basename(old_name)
+            note.content_hash = digest_from_name(note.file.name)
+            note.save(update_fields=['file', 'original_name', 'content_hash'])
+            note_storage.delete(old_name)  # Not a blob: removes the old copy
+        self.stdout.write(f"📦 {'Would move' if dry_run else 'Moved'} {moved} legacy uploads ({missing} files missing).")
+
+        # Counts drift if a note row is deleted without its file (e.g. a user is deleted)
+        refs = dict(Note.objects.filter(file__in=Blob.objects.values('name')).values_list('file').annotate(n=Count('id')))
+        fixed = orphaned = 0
+        for blob in Blob.objects.all().iterator():
+            count = refs.get(blob.name, 0)
+            if count == blob.ref_count:
+                continue
+            fixed += 1
+            if dry_run:
+                continue
+            if count:
+                Blob.objects.filter(pk=blob.pk).update(ref_count=count)
+            else:
+                orphaned += 1
+                Blob.objects.filter(pk=blob.pk).update(ref_count=1)
+                note_storage.delete(blob.name)  # Last reference: removes the row and the file
+        self.stdout.write(f"🔢 {'Would fix' if dry_run else 'Fixed'} {fixed} reference counts ({orphaned} unused blobs removed).")
+
+        blobs = Blob.objects.count()
+        notes = Note.objects.exclude(file='').count()
+        stored = sum(Blob.objects.values_list('size', flat=True))
+        line = f"✅ {notes} notes share {blobs} stored files ({stored / 1024 / 1024:.1f} MB)"
+        if not dry_run:
+            line += f"; freed {(legacy_bytes + blob_bytes - stored) / 1024 / 1024:.1f} MB"
+        self.stdout.write(line + ".")
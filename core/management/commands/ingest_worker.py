@@ -0,0 +1,44 @@
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core import ingestion
+
+
+class Command(BaseCommand):
+    help = "Runs the background pool that indexes uploaded notes into the AI vault and compacts vaults after deletes."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=getattr(settings, 'INGESTION_WORKERS', 2),
+            help="Concurrent ingestion jobs (independent of the web worker count).",
+        )
+        parser.add_argument('--poll', type=float, default=2.0, help="Seconds to wait when the queue is empty.")
+        parser.add_argument('--once', action='store_true', help="Drain the queue and exit instead of polling forever.")
+
+    def handle(self, *args, **options):
+        workers = max(1, options['workers'])
+        stop = threading.Event()
+        threads = [
+            threading.Thread(
+                target=ingestion.work,
+                args=(stop, options['poll'], options['once']),
+                name=f"ingest-{i}",
+                daemon=True,
+            )
+            for i in range(workers)
+        ]
+        self.stdout.write(f"⚙️ Ingestion worker online with {workers} slot(s).")
+        for t in threads:
+            t.start()
+        try:
+            for t in threads:
+                while t.is_alive():
+                    t.join(timeout=1.0)
+        except KeyboardInterrupt:
+            self.stdout.write("Shutting down after current jobs...")
+            stop.set()
+            for t in threads:
+                t.join()
+        self.stdout.write(self.style.SUCCESS("Ingestion worker stopped."))
@@ -0,0 +1,160 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, time as day_start
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.db.models import Q
+from django.utils import timezone
+
+from core import rag, vault
+from core.embeddings import get_embedding_backend
+from core.models import IngestionJob, Note
+
+
+class Throughput:
+    """Running totals shared by the user workers, printed as they go."""
+
+    def __init__(self, total_notes, write):
+        self.total_notes = total_notes
+        self.write = write
+        self.notes = self.chunks = self.copied = self.failed = 0
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def expect(self, notes):
+        with self._lock:
+            self.total_notes += notes
+
+    def record(self, notes=0, chunks=0, copied=0, failed=0):
+        with self._lock:
+            self.notes += notes
+            self.chunks += chunks
+            self.copied += copied
+            self.failed += failed
+            self.write(f"📈 {self.line()}")
+
+    def line(self):
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        rate = self.notes / elapsed
+        eta = (self.total_notes - self.notes) / rate if rate else 0
+        return (
+            f"{self.notes}/{self.total_notes} notes, {self.chunks} chunks embedded, {self.copied} copied, "
+            f"{self.failed} failed | {rate:.2f} notes/s, {self.chunks / elapsed:.1f} chunks/s, ETA {eta:.0f}s"
+        )
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-embeds every note into freshly built vaults (after changing the chunking or embedding model). "
+        "Each user's vault is rebuilt next to the live one and swapped in when complete; an interrupted "
+        "run resumes from its checkpoint."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, nargs='+', help="Only these user ids (default: everyone with notes).")
+        parser.add_argument(
+            '--since', help="Only re-embed notes uploaded on or after this date (YYYY-MM-DD); the user's "
+                            "other notes are carried over from the live vault as they are.",
+        )
+        parser.add_argument('--workers', type=int, default=getattr(settings, 'VAULT_REINDEX_WORKERS', 2),
+                            help="Users rebuilt in parallel.")
+        parser.add_argument('--dry-run', action='store_true', help="Show what would be re-indexed and exit.")
+
+    def _since(self, value):
+        if not value:
+            return None
+        try:
+            day = datetime.strptime(value, '%Y-%m-%d').date()
+        except ValueError:
+            raise CommandError("--since must look like YYYY-MM-DD")
+        return timezone.make_aware(datetime.combine(day, day_start.min))
+
+    def _notes(self, user_id):
+        # Notes still queued for ingestion are left to the worker; commit() picks them up from the live vault.
+        # Datesheets and CHO syllabi never go to the vault.
+        settled = Q(ingestion__isnull=True) | Q(ingestion__status__in=[IngestionJob.STATUS_DONE, IngestionJob.STATUS_FAILED])
+        notes = Note.objects.filter(settled, user_id=user_id).order_by('id')
+        return [n for n in notes if n.kind == Note.KIND_VAULT]
+
+    def _plan(self, user_id, config, since):
+        """(staged vault, notes to embed, note ids to carry over)."""
+        staged = vault.StagedVault(user_id, config)
+        done = staged.done_note_ids()
+        notes = [n for n in self._notes(user_id) if n.id not in done]
+        to_embed = [n for n in notes if since is None or n.uploaded_at >= since]
+        to_copy = {n.id for n in notes} - {n.id for n in to_embed}
+        return staged, to_embed, to_copy
+
+    def _reindex_user(self, user_id, config, since, stats):
+        try:
+            staged, to_embed, to_copy = self._plan(user_id, config, since)
+            staged.begin()
+            missing = staged.copy_from_live(to_copy)
+            if to_copy:
+                stats.record(copied=len(to_copy) - len(missing))
+            if missing:
+                # Notes the live vault never held (or held without exact vectors) are embedded after all
+                to_embed += [n for n in self._notes(user_id) if n.id in missing]
+                stats.expect(len(missing))
+
+            for note in to_embed:
+                embedded = rag.embed_note(note)
+                if embedded is None:
+                    staged.skip(note.id)
+                    stats.record(notes=1, failed=1)
+                    continue
+                chunks, embeddings = embedded
+                staged.add(note.id, chunks, embeddings)
+                stats.record(notes=1, chunks=len(chunks))
+
+            titles = {n.id: n.title for n in Note.objects.filter(user_id=user_id) if n.kind == Note.KIND_VAULT}
+            staged.commit(titles)
+            return user_id, None
+        except Exception as e:
+            return user_id, e
+        finally:
+            close_old_connections()
+
+    def handle(self, *args, **options):
+        since = self._since(options['since'])
+        embedder = get_embedding_backend()
+        if not options['dry_run'] and not embedder.available():
+            raise CommandError(f"Embedding backend '{embedder.model}' is not configured.")
+        config = {
+            'model': embedder.model,
+            'chunk_size': getattr(settings, 'VAULT_CHUNK_SIZE', 1000),
+            'chunk_overlap': getattr(settings, 'VAULT_CHUNK_OVERLAP', 150),
+            'since': options['since'],
+        }
+
+        user_ids = options['users'] or sorted(set(Note.objects.values_list('user_id', flat=True)))
+        if not user_ids:
+            raise CommandError("No notes to re-index.")
+
+        plans = {user_id: self._plan(user_id, config, since) for user_id in user_ids}
+        total = sum(len(to_embed) for _, to_embed, _ in plans.values())
+        self.stdout.write(f"{'user':>6}{'embed':>8}{'carry':>8}{'resumed':>9}")
+        for user_id, (staged, to_embed, to_copy) in plans.items():
+            self.stdout.write(f"{user_id:>6}{len(to_embed):>8}{len(to_copy):>8}{len(staged.done_note_ids()):>9}")
+        self.stdout.write(f"{total} notes to embed with '{embedder.model}' across {len(user_ids)} users.")
+        if options['dry_run']:
+            return
+
+        stats = Throughput(total, self.stdout.write)
+        failures = {}
+        with ThreadPoolExecutor(max_workers=max(1, options['workers'])) as pool:
+            futures = [pool.submit(self._reindex_user, user_id, config, since, stats) for user_id in user_ids]
+            for future in as_completed(futures):
+                user_id, error = future.result()
+                if error:
+                    failures[user_id] = error
+                    self.stderr.write(f"❌ user {user_id}: {error} (checkpoint kept, run again to resume)")
+                else:
+                    self.stdout.write(f"✅ user {user_id}: vault swapped in")
+
+        self.stdout.write(f"Done: {stats.line()}")
+        if failures:
+            raise CommandError(f"{len(failures)} vault(s) not re-indexed: {sorted(failures)}")
@@ -0,0 +1,75 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from core import syllabus
+from core.models import Exam, Note, Topic
+
+
+class Command(BaseCommand):
+    help = "Times CHO syllabus extraction and the Topic import on a batch of PDFs (nothing is kept)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='+', help="CHO syllabus PDFs.")
+        parser.add_argument('--skip-db', action='store_true', help="Only time table extraction and parsing.")
+
+    def handle(self, *args, **options):
+        total_pages = total_rows = 0
+        total_read = total_per_row = total_bulk = 0.0
+        for path in options['files']:
+            pages = 0
+            start = time.perf_counter()
+            entries = []
+            try:
+                for tables in syllabus.read_page_tables(path):
+                    pages += 1
+                    entries.extend(syllabus.parse_tables([tables]))
+            except Exception as e:
+                self.stderr.write(f"{path}: unreadable ({e})")
+                continue
+            read = time.perf_counter() - start
+            total_pages += pages
+            total_rows += len(entries)
+            total_read += read
+            line = f"{path}: {pages} pages -> {len(entries)} topics, read in {read * 1000:.0f} ms"
+
+            if not options['skip_db'] and entries:
+                per_row = self._time_import(self._insert_per_row, entries)
+                bulk = self._time_import(syllabus.import_topics, entries)
+                total_per_row += per_row
+                total_bulk += bulk
+                line += f"; import {per_row * 1000:.1f} ms per-row vs {bulk * 1000:.1f} ms bulk"
+            self.stdout.write(line)
+
+        if not total_pages:
+            raise CommandError("No readable PDFs.")
+        summary = (
+            f"Total: {total_pages} pages, {total_rows} topics, read {total_read:.2f}s "
+            f"({total_pages / total_read:,.1f} pages/s)"
+        )
+        if not options['skip_db'] and total_rows:
+            summary += f"; import {total_per_row * 1000:.1f} ms per-row vs {total_bulk * 1000:.1f} ms bulk"
+        self.stdout.write(summary)
+
+    @staticmethod
+    def _time_import(insert, entries):
+        # Runs inside a transaction that is rolled back, so nothing is kept
+        with transaction.atomic():
+            user = User.objects.create(username=f"syllabus-benchmark-{time.time_ns()}")
+            exam = Exam.objects.create(user=user, subject="CHO BENCHMARK", date=timezone.now())
+            note = Note.objects.create(user=user, title="CHO BENCHMARK", file="notes/benchmark.pdf")
+            start = time.perf_counter()
+            insert(exam, note, entries)
+            elapsed = time.perf_counter() - start
+            transaction.set_rollback(True)
+        return elapsed
+
+    @staticmethod
+    def _insert_per_row(exam, note, entries):
+        """The old one-query-per-row import, for comparison."""
+        for entry in entries:
+            Topic.objects.create(exam=exam, name=f"[Lec {entry.lecture}] {entry.topic}", source_note=note, is_cho=True)
+        return len(entries)
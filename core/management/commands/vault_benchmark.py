@@ -0,0 +1,79 @@
+import time
+
+import faiss
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from core import vault
+
+
+class Command(BaseCommand):
+    help = "Reports recall@k vs. latency of IVF/HNSW settings against exact (flat) search."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, help="Benchmark this user's vault vectors.")
+        parser.add_argument('--synthetic', type=int, default=50000, help="Random vectors to use when --user is not given.")
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--k', type=int, default=5)
+        parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 4, 8, 16, 32, 64])
+        parser.add_argument('--ef-search', type=int, nargs='+', default=[16, 32, 64, 128, 256])
+        parser.add_argument('--kinds', nargs='+', default=['ivf', 'hnsw'], choices=['ivf', 'hnsw'])
+        parser.add_argument('--storage', default='float32', choices=['float32', 'fp16', 'int8', 'pq'],
+                            help="Vector storage of the IVF/HNSW indexes (see vault_compress for re-ranked recall).")
+
+    def _load_vectors(self, options):
+        if options['user'] is None:
+            rng = np.random.default_rng(0)
+            # Clustered data behaves more like real embeddings than uniform noise
+            centers = rng.normal(size=(64, vault.EMBED_DIM)).astype('float32')
+            labels = rng.integers(0, len(centers), options['synthetic'])
+            noise = rng.normal(scale=0.3, size=(options['synthetic'], vault.EMBED_DIM))
+            return (centers[labels] + noise).astype('float32')
+
+        user_vault = vault.vault_cache.get(options['user'])
+        if user_vault is None:
+            raise CommandError(f"User {options['user']} has no vault.")
+        ids = np.flatnonzero(user_vault.chunks.note_ids != vault.DEAD_NOTE).astype('int64')
+        return vault.exact_vectors(user_vault, ids)
+
+    def _measure(self, index, queries, k, truth):
+        start = time.perf_counter()
+        _, found = index.search(queries, k)
+        per_query_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        recall = np.mean([len(np.intersect1d(f, t)) / k for f, t in zip(found, truth)])
+        return recall, per_query_ms
+
+    def handle(self, *args, **options):
+        vectors = self._load_vectors(options)
+        n, k = len(vectors), options['k']
+        if n <= k:
+            raise CommandError("Not enough vectors to benchmark.")
+        rng = np.random.default_rng(1)
+        queries = vectors[rng.choice(n, min(options['queries'], n), replace=False)]
+        queries = queries + rng.normal(scale=0.05, size=queries.shape).astype('float32')
+        ids = np.arange(n, dtype='int64')
+
+        faiss.omp_set_num_threads(1)  # Per-query latency, as seen by a single chat request
+        flat = vault.build_index(vectors, ids, 'flat', storage='float32')
+        _, truth = flat.search(queries, k)
+        _, flat_ms = self._measure(flat, queries, k, truth)
+
+        self.stdout.write(f"{n} vectors, {len(queries)} queries, k={k}")
+        self.stdout.write(f"{'index':<8}{'param':<14}{'recall@k':>10}{'ms/query':>10}{'speedup':>9}")
+        self.stdout.write(f"{'flat':<8}{'-':<14}{1.0:>10.3f}{flat_ms:>10.3f}{1.0:>8.1f}x")
+
+        for kind in options['kinds']:
+            start = time.perf_counter()
+            index = vault.build_index(vectors, ids, kind, storage=options['storage'])
+            build_s = time.perf_counter() - start
+            params = options['nprobe'] if kind == 'ivf' else options['ef_search']
+            for p in params:
+                if kind == 'ivf':
+                    vault.configure_search(index, nprobe=p)
+                    label = f"nprobe={p}"
+                else:
+                    vault.configure_search(index, ef_search=p)
+                    label = f"ef={p}"
+                recall, ms = self._measure(index, queries, k, truth)
+                self.stdout.write(f"{kind:<8}{label:<14}{recall:>10.3f}{ms:>10.3f}{flat_ms / ms:>8.1f}x")
+            self.stdout.write(f"   ({kind}/{vault.index_storage(index)} build: {build_s:.1f}s, {vault.index_nbytes(index) / 2**20:.1f} MB)")
@@ -0,0 +1,78 @@
+import time
+
+import faiss
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core import vault
+
+
+class Command(BaseCommand):
+    help = "Rebuilds user vault indexes with fp16/int8/pq vector storage and reports memory and recall."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--storage', choices=['float32', 'fp16', 'int8', 'pq'],
+                            default=getattr(settings, 'VAULT_VECTOR_STORAGE', 'float32'))
+        parser.add_argument('--users', type=int, nargs='+', help="Only these user ids (default: every vault on disk).")
+        parser.add_argument('--queries', type=int, default=100, help="Sample queries per vault for the recall report.")
+        parser.add_argument('--k', type=int, default=5)
+        parser.add_argument('--dry-run', action='store_true', help="Report only; leave the indexes as they are.")
+
+    def _recall(self, user_vault, vectors, ids, k, n_queries):
+        """recall@k of the index alone and after exact re-ranking, against brute force."""
+        k = min(k, len(ids))  # FAISS pads missing hits with -1, which would index the last id
+        rng = np.random.default_rng(0)
+        queries = vectors[rng.choice(len(ids), min(n_queries, len(ids)), replace=False)]
+        queries = queries + rng.normal(scale=0.01, size=queries.shape).astype('float32')
+        exact = faiss.IndexFlatL2(vault.EMBED_DIM)
+        exact.add(vectors)
+        _, truth = exact.search(queries, k)
+        truth = ids[truth]
+
+        _, raw = user_vault.index.search(queries, k)
+        start = time.perf_counter()
+        reranked = [[chunk_id for _, chunk_id in hits] for hits in vault.search(user_vault, queries, k)]
+        ms = (time.perf_counter() - start) * 1000 / len(queries)
+        score = lambda found: np.mean([len(np.intersect1d(f, t)) / k for f, t in zip(found, truth)])
+        return score(raw), score(reranked), ms
+
+    def handle(self, *args, **options):
+        storage, k = options['storage'], options['k']
+        user_ids = options['users'] or vault.user_ids_on_disk()
+        if not user_ids:
+            raise CommandError("No vaults found.")
+
+        self.stdout.write(f"{'user':>6}{'chunks':>9}{'index':>14}{'before MB':>11}{'after MB':>10}{'recall@k':>10}{'reranked':>10}{'ms/query':>10}")
+        before_total = after_total = 0
+        for user_id in user_ids:
+            loaded = vault.load_for_rebuild(user_id)
+            if loaded is None or not len(loaded[3]):
+                continue
+            index, store, vectors, ids, version = loaded
+            if not store.has_vectors() and storage != 'float32':
+                self.stderr.write(f"   user {user_id}: no exact vectors on disk to re-rank with, skipped")
+                continue
+
+            kind = vault.index_kind(index)
+            rebuilt = vault.build_index(vectors, ids, kind if kind != 'flat' else None, storage)
+            candidate = vault.Vault(rebuilt, store.reader(), {}, 0)
+            raw, reranked, ms = self._recall(candidate, vectors, ids, k, options['queries'])
+
+            before, after = vault.index_nbytes(index), vault.index_nbytes(rebuilt)
+            before_total += before
+            after_total += after
+            self.stdout.write(
+                f"{user_id:>6}{len(ids):>9}{vault.index_kind(rebuilt) + '/' + vault.index_storage(rebuilt):>14}"
+                f"{before / 2**20:>11.2f}{after / 2**20:>10.2f}{raw:>10.3f}{reranked:>10.3f}{ms:>10.3f}"
+            )
+            if not options['dry_run']:
+                try:
+                    vault.replace_index(user_id, rebuilt, version)
+                except vault.VaultChanged as e:
+                    self.stderr.write(f"   {e}; left as it was, run again")
+
+        if before_total:
+            action = "would shrink" if options['dry_run'] else "shrank"
+            self.stdout.write(f"Indexes {action} from {before_total / 2**20:.1f} MB to {after_total / 2**20:.1f} MB "
+                              f"({before_total / max(after_total, 1):.1f}x).")
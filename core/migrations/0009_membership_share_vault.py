@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_ingestionjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='membership',
+            name='share_vault',
+            field=models.BooleanField(default=False),
+        ),
+    ]
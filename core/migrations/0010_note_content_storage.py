@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:15
+
+import os
+
+import core.storage
+from django.db import migrations, models
+
+
+def backfill_notes(apps, schema_editor):
+    # Existing uploads keep their files; record their names and hashes so the caches can use them
+    from core.ocr_cache import file_digest
+
+    Note = apps.get_model('core', 'Note')
+    for note in Note.objects.exclude(file=''):
+        note.original_name = os.path.basename(note.file.name)
+        try:
+            note.content_hash = file_digest(note.file.path)
+        except OSError:
+            pass
+        note.save(update_fields=['original_name', 'content_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_membership_share_vault'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('digest', models.CharField(db_index=True, max_length=64)),
+                ('size', models.BigIntegerField()),
+                ('ref_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='note',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='note',
+            name='original_name',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='note',
+            name='file',
+            field=models.FileField(storage=core.storage.get_note_storage, upload_to='notes/'),
+        ),
+        migrations.RunPython(backfill_notes, migrations.RunPython.noop),
+    ]
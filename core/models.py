@@ -1,18 +1,67 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.utils import timezone
+import os
 import random
 import string
+from .storage import digest_from_name, get_note_storage
 
 class Note(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     title = models.CharField(max_length=200)
-    file = models.FileField(upload_to='notes/') 
+    # Stored once per distinct content (core/storage.py), so the stored name is a hash
+    file = models.FileField(upload_to='notes/', storage=get_note_storage) 
+    original_name = models.CharField(max_length=255, blank=True)
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True) # SHA-256 of the file; keys the OCR/extraction caches
     uploaded_at = models.DateTimeField(auto_now_add=True)
 
+    # How notes_hub routes an upload: datesheet import, CHO syllabus import, or the AI vault
+    KIND_DATESHEET = 'datesheet'
+    KIND_CHO = 'cho'
+    KIND_VAULT = 'vault'
+
     def __str__(self):
         return self.title
 
+    @property
+    def kind(self):
+        title = self.title.upper()
+        filename = (self.original_name or self.file.name or '').lower()
+        if "DATESHEET" in title or "DATESHEET" in filename.upper():
+            return self.KIND_DATESHEET
+        if title.startswith('CHO') and filename.endswith('.pdf'):
+            return self.KIND_CHO
+        return self.KIND_VAULT
+
+    def save(self, *args, **kwargs):
+        # Store the upload first so its content hash is saved with the row
+        stored = None
+        if self.file and not self.file._committed:
+            self.original_name = self.original_name or os.path.basename(self.file.name)
+            self.file.save(self.file.name, self.file.file, save=False)
+            stored = self.file.name
+        if self.file:
+            self.content_hash = digest_from_name(self.file.name) or self.content_hash
+        try:
+            # A savepoint, so a failed insert leaves the caller's transaction usable for the cleanup
+            with transaction.atomic():
+                super().save(*args, **kwargs)
+        except Exception:
+            if stored:
+                self.file.storage.delete(stored)  # Give back the blob reference this save took
+            raise
+
+class Blob(models.Model):
+    # One stored upload shared by every Note with the same content (core/storage.py)
+    name = models.CharField(max_length=255, unique=True)
+    digest = models.CharField(max_length=64, db_index=True)
+    size = models.BigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.ref_count} refs)"
+
 class Exam(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     subject = models.CharField(max_length=200)
@@ -91,6 +140,7 @@ class Membership(models.Model):
     squad = models.ForeignKey(Squad, on_delete=models.CASCADE, related_name='members')
     joined_at = models.DateTimeField(auto_now_add=True)
     is_leader = models.BooleanField(default=False)
+    share_vault = models.BooleanField(default=False) # Opt-in: squadmates may query this member's AI vault
 
     class Meta:
         unique_together = ('user', 'squad') # Prevents double joining
@@ -102,4 +152,46 @@ class Transmission(models.Model): # Chat Messages
     timestamp = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
-        return f"{self.sender}: {self.content[:20]}"
\ No newline at end of file
+        return f"{self.sender}: {self.content[:20]}"
+
+class IngestionJob(models.Model): # Background AI indexing of an uploaded note
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    note = models.OneToOneField(Note, on_delete=models.CASCADE, related_name='ingestion')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_QUEUED, db_index=True)
+    stage = models.CharField(max_length=50, blank=True)
+    progress = models.PositiveSmallIntegerField(default=0) # 0-100
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True) # Doubles as the worker heartbeat
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    retry_after = models.DateTimeField(null=True, blank=True) # A requeued job waits until then
+
+    @property
+    def is_finished(self):
+        return self.status in (self.STATUS_DONE, self.STATUS_FAILED)
+
+    def as_dict(self):
+        return {
+            'note_id': self.note_id,
+            'status': self.status,
+            'stage': self.stage,
+            'progress': self.progress,
+            'attempts': self.attempts,
+            'error': self.error,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+        }
+
+    def __str__(self):
+        return f"{self.note} [{self.status} {self.progress}%]"
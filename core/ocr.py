@@ -0,0 +1,296 @@
+# core/ocr.py
+# Page-parallel OCR engine. Every page is rendered and recognised on its own
+# inside a worker process, so a scanned note uses all cores instead of one.
+# NOTE: Keep this module free of Django imports - worker processes re-import
+# it on platforms that spawn (Windows) rather than fork.
+
+import multiprocessing
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+import pytesseract
+from pdf2image import convert_from_path, pdfinfo_from_path
+from pdf2image.exceptions import PDFPopplerTimeoutError
+from PIL import ImageEnhance
+
+
+# One OCR'd page; `error` is '' when it was read (even if it came back blank) and
+# says why otherwise ('timed out', 'hung' or the exception), so callers can retry it
+OcrPage = namedtuple('OcrPage', ['text', 'seconds', 'error'])
+
+
+def count_pages(pdf_path, poppler_path=None):
+    info = pdfinfo_from_path(pdf_path, poppler_path=poppler_path)
+    return int(info.get('Pages', 0))
+
+
+def default_workers():
+    return max(1, min(4, os.cpu_count() or 1))
+
+
+def is_timeout(error):
+    """Whether `error` is Poppler or Tesseract giving up on a page at its timeout."""
+    # pytesseract kills tesseract and raises a bare RuntimeError when the timeout expires
+    return isinstance(error, PDFPopplerTimeoutError) or (isinstance(error, RuntimeError) and 'timeout' in str(error).lower())
+
+
+def render_pages(pdf_path, first_page, last_page, dpi=150, poppler_path=None, timeout=None):
+    """Rasterizes only pages first_page..last_page (1-based, inclusive)."""
+    return convert_from_path(
+        pdf_path, poppler_path=poppler_path, dpi=dpi,
+        first_page=first_page, last_page=last_page,
+        timeout=timeout,
+    )
+
+
+def _ocr_page(pdf_path, page_number, dpi, poppler_path, tesseract_cmd, contrast, config, timeout):
+    """Renders exactly one page, recognises it and releases the image. Runs in a worker.
+
+    Returns an OcrPage so callers can see where the OCR time went and which pages failed.
+    """
+    started = time.perf_counter()
+    if tesseract_cmd:
+        pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+    try:
+        images = render_pages(pdf_path, page_number, page_number, dpi, poppler_path, timeout)
+    except PDFPopplerTimeoutError:
+        print(f"   ⚠️ Rendering timed out on page {page_number}, skipping it.")
+        return OcrPage("", time.perf_counter() - started, 'timed out')
+    if not images:
+        return OcrPage("", time.perf_counter() - started, 'not rendered')
+    img = images[0].convert('L')
+    images[0].close()
+    error = ''
+    try:
+        img = ImageEnhance.Contrast(img).enhance(contrast)
+        text = pytesseract.image_to_string(img, config=config, timeout=timeout or 0)
+    except RuntimeError as e:
+        if not is_timeout(e):
+            raise
+        print(f"   ⚠️ OCR timed out on page {page_number}, skipping it.")
+        text, error = "", 'timed out'
+    finally:
+        img.close()
+    return OcrPage(text, time.perf_counter() - started, error)
+
+
+# Per-pool shared array: when each page's worker picked it up (0 = still queued)
+_page_starts = None
+
+
+def _init_worker(page_starts):
+    global _page_starts
+    _page_starts = page_starts
+
+
+def _ocr_page_in_pool(slot, pdf_path, page_number, *args):
+    _page_starts[slot] = time.time()
+    return _ocr_page(pdf_path, page_number, *args)
+
+
+def _kill_pool(pool):
+    # A running task can't be cancelled, so a hung page takes its pool's processes with it
+    processes = list((getattr(pool, '_processes', None) or {}).values())
+    for process in processes:
+        process.kill()
+    pool.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        process.join(timeout=5)
+
+
+def ocr_pages_timed(pdf_path, page_numbers=None, dpi=150, poppler_path=None, tesseract_cmd=None,
+                    contrast=1.5, config='', max_workers=None, page_timeout=None):
+    """OCRs the given 1-based pages (default: all) concurrently.
+
+    Returns one OcrPage per page, in page order. `max_workers` caps the
+    process pool; `page_timeout` (seconds) bounds the render and the
+    recognition of each page so one bad page can't stall the note - it just
+    comes back empty, with its `error` set.
+    """
+    if page_numbers is None:
+        page_numbers = range(1, count_pages(pdf_path, poppler_path) + 1)
+    page_numbers = list(page_numbers)
+    if not page_numbers:
+        return []
+
+    workers = min(max_workers or default_workers(), len(page_numbers))
+    args = (dpi, poppler_path, tesseract_cmd, contrast, config, page_timeout)
+    results = [OcrPage("", 0.0, 'not run')] * len(page_numbers)
+
+    if workers == 1:
+        for i, n in enumerate(page_numbers):
+            try:
+                results[i] = _ocr_page(pdf_path, n, *args)
+            except Exception as e:
+                print(f"   ⚠️ OCR failed on page {n}: {e}")
+                results[i] = OcrPage("", 0.0, str(e) or type(e).__name__)
+        return results
+
+    # Render + recognise can each take up to page_timeout; a page running longer than
+    # that (timed from when its worker started it, not from when we began waiting) is hung
+    wait_limit = page_timeout * 3 if page_timeout else None
+    pending = list(range(len(page_numbers)))
+    while pending:
+        page_starts = multiprocessing.RawArray('d', len(page_numbers))
+        pool = ProcessPoolExecutor(max_workers=min(workers, len(pending)), initializer=_init_worker, initargs=(page_starts,))
+        futures = {pool.submit(_ocr_page_in_pool, i, pdf_path, page_numbers[i], *args): i for i in pending}
+        pending = []
+        hung = False
+        try:
+            running = set(futures)
+            while running:
+                done, running = wait(running, timeout=1.0 if wait_limit else None, return_when=FIRST_COMPLETED)
+                for future in done:
+                    i = futures[future]
+                    try:
+                        results[i] = future.result()
+                    except Exception as e:
+                        print(f"   ⚠️ OCR failed on page {page_numbers[i]}: {e}")
+                        results[i] = OcrPage("", 0.0, str(e) or type(e).__name__)
+                now = time.time()
+                stuck = {f for f in running if wait_limit and page_starts[futures[f]] and now - page_starts[futures[f]] > wait_limit}
+                if stuck:
+                    for future in stuck:
+                        i = futures[future]
+                        print(f"   ⚠️ OCR worker hung on page {page_numbers[i]}, skipping it.")
+                        results[i] = OcrPage("", now - page_starts[i], 'hung')
+                    # Killing the pool loses the other pages in flight; they start over in a fresh one
+                    pending = sorted(futures[f] for f in running - stuck)
+                    hung = True
+                    break
+        finally:
+            if hung:
+                _kill_pool(pool)
+            else:
+                pool.shutdown(wait=True)
+    return results
+
+
+# --- ADAPTIVE OCR (datesheets): few pixels first, more only where Tesseract is unsure ---
+OcrLine = namedtuple('OcrLine', ['text', 'confidence', 'box'])  # box = (left, top, right, bottom)
+
+INK_THRESHOLD = 160  # Grey levels below this count as ink
+
+
+def find_table_box(gray, rule_fill=0.5, margin=0.01):
+    """(left, top, right, bottom) of the ruled table on a page, or of all its ink when
+    there are no ruling lines; None for a blank page."""
+    ink = np.asarray(gray) < INK_THRESHOLD
+    if not ink.any():
+        return None
+    height, width = ink.shape
+    rules = np.flatnonzero(ink.mean(axis=1) >= rule_fill)  # Rows that are mostly ink: horizontal rules
+    if len(rules) >= 2 and rules[-1] - rules[0] > height * 0.05:
+        top, bottom = rules[0], rules[-1]
+        band = ink[top:bottom + 1]
+        columns = np.flatnonzero(band.mean(axis=0) >= rule_fill)
+        if len(columns) < 2:
+            columns = np.flatnonzero(band.any(axis=0))
+        left, right = columns[0], columns[-1]
+    else:
+        rows, columns = np.flatnonzero(ink.any(axis=1)), np.flatnonzero(ink.any(axis=0))
+        top, bottom, left, right = rows[0], rows[-1], columns[0], columns[-1]
+    pad = int(margin * max(height, width))
+    return (
+        max(0, int(left) - pad), max(0, int(top) - pad),
+        min(width, int(right) + pad + 1), min(height, int(bottom) + pad + 1),
+    )
+
+
+def read_lines(image, config='', timeout=0):
+    """[OcrLine] in reading order, with each line's mean word confidence (0-100)."""
+    data = pytesseract.image_to_data(image, config=config, timeout=timeout, output_type=pytesseract.Output.DICT)
+    lines = {}
+    for i, word in enumerate(data['text']):
+        confidence = float(data['conf'][i])
+        if confidence < 0 or not word.strip():
+            continue
+        left, top = data['left'][i], data['top'][i]
+        right, bottom = left + data['width'][i], top + data['height'][i]
+        words, confidences, box = lines.setdefault(
+            (data['block_num'][i], data['par_num'][i], data['line_num'][i]), ([], [], [left, top, right, bottom])
+        )
+        words.append(word)
+        confidences.append(confidence)
+        box[:] = [min(box[0], left), min(box[1], top), max(box[2], right), max(box[3], bottom)]
+    return [OcrLine(" ".join(w), sum(c) / len(c), tuple(b)) for w, c, b in lines.values()]
+
+
+def _mean_confidence(lines):
+    return round(sum(line.confidence for line in lines) / len(lines), 1) if lines else 0.0
+
+
+def ocr_page_adaptive(pdf_path, page_number, dpis=(150, 300, 600), min_confidence=75, contrast=2.0,
+                      config='--psm 6', poppler_path=None, tesseract_cmd=None, timeout=None):
+    """OCRs one page cropped to its table, starting at the lowest of `dpis`.
+
+    Lines read with less than `min_confidence` are read again from a render at
+    the next dpi up (the whole table if most lines are weak), keeping whichever
+    reading Tesseract is surer of. Returns (text, stats) where stats record the
+    dpi reached and the confidence before and after.
+    """
+    started = time.perf_counter()
+    if tesseract_cmd:
+        pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+    stats = {'page': page_number, 'method': 'ocr', 'dpi': dpis[0], 'crop': 1.0,
+             'confidence': 0.0, 'final_confidence': 0.0, 'lines': 0, 'retried_lines': 0}
+
+    def render(dpi):
+        images = render_pages(pdf_path, page_number, page_number, dpi, poppler_path, timeout)
+        if not images:
+            return None
+        gray = ImageEnhance.Contrast(images[0].convert('L')).enhance(contrast)
+        images[0].close()
+        return gray
+
+    low = render(dpis[0])
+    box = find_table_box(low) if low is not None else None
+    if box is None:
+        stats['seconds'] = round(time.perf_counter() - started, 2)
+        return "", stats
+    stats['crop'] = round((box[2] - box[0]) * (box[3] - box[1]) / (low.width * low.height), 3)
+    with low.crop(box) as table:
+        lines = read_lines(table, config, timeout or 0)
+    low.close()
+    stats['confidence'] = _mean_confidence(lines)
+
+    for dpi in dpis[1:]:
+        weak = [i for i, line in enumerate(lines) if line.confidence < min_confidence]
+        if lines and not weak:
+            break
+        high = render(dpi)
+        if high is None:
+            break
+        scale = dpi / dpis[0]
+        stats['dpi'] = dpi
+        if not lines or len(weak) > len(lines) / 2:
+            # Mostly unreadable: read the whole table again at this resolution
+            scaled = tuple(int(v * scale) for v in box)
+            with high.crop(scaled) as table:
+                reread = read_lines(table, config, timeout or 0)
+            if _mean_confidence(reread) > _mean_confidence(lines):
+                lines = [OcrLine(l.text, l.confidence, tuple(int(v / scale) for v in l.box)) for l in reread]
+            stats['retried_lines'] += len(lines)
+        else:
+            pad = int(4 * scale)
+            for i in weak:
+                left, top, right, bottom = lines[i].box
+                region = (
+                    max(0, int((box[0] + left) * scale) - pad), max(0, int((box[1] + top) * scale) - pad),
+                    min(high.width, int((box[0] + right) * scale) + pad), min(high.height, int((box[1] + bottom) * scale) + pad),
+                )
+                with high.crop(region) as line_image:
+                    reread = read_lines(line_image, '--psm 7', timeout or 0)
+                confidence = _mean_confidence(reread)
+                if reread and confidence > lines[i].confidence:
+                    lines[i] = OcrLine(" ".join(l.text for l in reread), confidence, lines[i].box)
+                stats['retried_lines'] += 1
+        high.close()
+
+    stats['lines'] = len(lines)
+    stats['final_confidence'] = _mean_confidence(lines)
+    stats['seconds'] = round(time.perf_counter() - started, 2)
+    return "\n".join(line.text for line in lines), stats
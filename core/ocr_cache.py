@@ -0,0 +1,124 @@
+# core/ocr_cache.py
+# Content-addressed cache of per-page extraction results (OCR text, parsed
+# tables). Entries are keyed by the SHA-256 of the uploaded file's bytes plus
+# the extraction kind and settings, so when a whole class uploads the same
+# datesheet only the first upload pays for rendering and Tesseract. Shared by
+# every process through one SQLite file; least recently used entries are
+# evicted once the stored payloads pass the size budget.
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from django.conf import settings
+
+CACHE_VERSION = 1  # Bump when extraction changes in a way the settings don't capture
+_READ_BLOCK = 1024 * 1024
+
+
+def file_digest(path):
+    """SHA-256 hex digest of a file, read in blocks."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(_READ_BLOCK), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+class PageCache:
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS pages ("
+                " key TEXT PRIMARY KEY,"
+                " kind TEXT NOT NULL,"
+                " payload BLOB NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " last_used REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS pages_last_used ON pages (last_used)")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def make_key(digest, kind, options=None):
+        """Key for one file's extraction result; `options` are the settings that change the output."""
+        h = hashlib.sha256()
+        h.update(f"{CACHE_VERSION}\0{kind}\0{digest}\0".encode('utf-8'))
+        h.update(json.dumps(options or {}, sort_keys=True).encode('utf-8'))
+        return h.hexdigest()
+
+    def get(self, key):
+        """The cached list of per-page results, or None."""
+        conn = self._conn()
+        row = conn.execute("SELECT payload FROM pages WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        with conn:
+            conn.execute("UPDATE pages SET last_used = ? WHERE key = ?", (time.time(), key))
+        self.hits += 1
+        return json.loads(zlib.decompress(row[0]))
+
+    def put(self, key, kind, pages):
+        """Stores per-page results (anything JSON can hold) and evicts down to the size budget."""
+        payload = zlib.compress(json.dumps(pages).encode('utf-8'))
+        if len(payload) > self.max_bytes:
+            return
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO pages (key, kind, payload, size, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, kind, payload, len(payload), time.time()),
+            )
+            self._evict(conn)
+
+    def _evict(self, conn):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in conn.execute("SELECT key, size FROM pages ORDER BY last_used").fetchall():
+            conn.execute("DELETE FROM pages WHERE key = ?", (key,))
+            self.evictions += 1
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def stats(self):
+        entries, size = self._conn().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM pages").fetchone()
+        return {
+            'entries': entries, 'bytes': size, 'max_bytes': self.max_bytes,
+            'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+        }
+
+
+_page_cache = None
+_page_cache_lock = threading.Lock()
+
+
+def get_page_cache():
+    """The process-wide cache at OCR_CACHE_PATH (default MEDIA_ROOT/vectors/ocr_cache.sqlite3)."""
+    global _page_cache
+    with _page_cache_lock:
+        if _page_cache is None:
+            path = getattr(settings, 'OCR_CACHE_PATH', None) or os.path.join(
+                settings.MEDIA_ROOT, 'vectors', 'ocr_cache.sqlite3'
+            )
+            _page_cache = PageCache(path, getattr(settings, 'OCR_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+        return _page_cache
@@ -1,186 +1,256 @@
+import asyncio
 import os
-import pickle
 import time
 import numpy as np
-import faiss
-import google.generativeai as genai
 from django.conf import settings
-from .models import Note
-import pdfplumber
+from django.contrib.auth.models import User
+from .models import Note, Membership
 
 # --- OCR IMPORTS ---
 import pytesseract
-from pdf2image import convert_from_path
-from PIL import Image, ImageEnhance
+from . import extraction
+from . import ocr_cache
+from . import context
+from .chunking import chunk_text
+from .embed_cache import EmbeddingCache
+from .answer_cache import AnswerCache, QuestionCache
+from .embeddings import embed_all, get_embedding_backend
+from .generation import get_chat_model
+from . import vault
 
 # ⚠️ CONFIGURATION (Ensure these match your actual installation paths)
 POPPLER_PATH = r"C:\Users\hs264\Downloads\Release-24.02.0-0\poppler-24.02.0\Library\bin" 
 pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
 
-# 1. SETUP: Create a folder to store the "brain memory"
-INDEX_DIR = os.path.join(settings.MEDIA_ROOT, 'vectors')
-if not os.path.exists(INDEX_DIR):
-    os.makedirs(INDEX_DIR)
+# 1. SETUP: The per-user "brain memory" lives in core/vault.py,
+# the embedder (Gemini or local) in core/embeddings.py
+EMBED_DIM = vault.EMBED_DIM
 
-def get_user_index_path(user_id):
-    return os.path.join(INDEX_DIR, f"user_{user_id}.index")
+# Shared across users: identical chunk text -> identical vector, no API call
+embedding_cache = EmbeddingCache(
+    getattr(settings, 'VAULT_EMBED_CACHE_PATH', None) or os.path.join(vault.INDEX_DIR, 'embeddings.sqlite3')
+)
 
-def get_user_chunks_path(user_id):
-    return os.path.join(INDEX_DIR, f"user_{user_id}.pkl")
+# Repeated questions: exact text -> query vector, similar question on an unchanged vault -> answer
+question_cache = QuestionCache(getattr(settings, 'VAULT_QUESTION_CACHE_SIZE', 2048))
+answer_cache = AnswerCache(
+    getattr(settings, 'VAULT_ANSWER_CACHE_SCOPES', 1024),
+    getattr(settings, 'VAULT_ANSWER_CACHE_PER_SCOPE', 64),
+    getattr(settings, 'VAULT_ANSWER_CACHE_THRESHOLD', 0.95),
+)
 
-# 2. CONNECT: Wake up Gemini
-def get_gemini_model():
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        print("ERROR: GEMINI_API_KEY not found in .env")
-        return None
-    genai.configure(api_key=api_key)
-    return genai
+# 2. CONNECT: Gemini (or the local stand-ins) is wired up in core/embeddings.py and core/generation.py
 
-# 3. HELPER: OCR Function (Reads Images)
-def extract_text_with_ocr(pdf_path):
-    print("👁️ AI: Switching to Vision Mode (OCR)...")
-    text = ""
-    try:
-        images = convert_from_path(pdf_path, poppler_path=POPPLER_PATH, dpi=150)
-        for i, img in enumerate(images):
-            img = img.convert('L')
-            enhancer = ImageEnhance.Contrast(img)
-            img = enhancer.enhance(1.5)
-            page_text = pytesseract.image_to_string(img)
-            text += page_text + "\n"
-    except Exception as e:
-        print(f"❌ OCR Failed: {e}")
-    return text
-
-# 4. HELPER: Safe Embedding with Retry
-def safe_embed_batch(client, batch, title, retries=3):
-    """Tries to embed. If blocked (429), waits and retries."""
-    for attempt in range(retries):
-        try:
-            # Using the modern embedding model
-            result = client.embed_content(
-                model="models/text-embedding-004",
-                content=batch,
-                task_type="retrieval_document",
-                title=title
-            )
-            return np.array(result['embedding'], dtype='float32')
-        except Exception as e:
-            if "429" in str(e) or "quota" in str(e).lower():
-                wait_time = 60 # Wait 1 minute if blocked
-                print(f"   ⚠️ Quota Hit! Waiting {wait_time}s before retry ({attempt+1}/{retries})...")
-                time.sleep(wait_time)
-            else:
-                print(f"   ❌ Error: {e}")
-                return None
-    return None
+class IndexingDeferred(Exception):
+    """The note is readable but can't be embedded right now (no API key, quota, network): try again later."""
+
+# 3. HELPER: OCR settings for scanned pages (one page per CPU core, see core/ocr.py)
+def get_ocr_options():
+    return {
+        'dpi': 150,
+        'poppler_path': POPPLER_PATH,
+        'tesseract_cmd': pytesseract.pytesseract.tesseract_cmd,
+        'contrast': 1.5,
+        'max_workers': getattr(settings, 'OCR_MAX_WORKERS', None),
+        'page_timeout': getattr(settings, 'OCR_PAGE_TIMEOUT', None),
+    }
 
 # 5. LEARN: Read a PDF and memorize it
-def add_note_to_vault(note):
+def embed_note(note, progress=None):
+    """Extracts, chunks and embeds a note. Returns (chunks, embeddings), or None if it can't be read.
+
+    Raises IndexingDeferred when the text is fine but the embedder isn't available.
+    """
+    progress = progress or (lambda stage, percent: None)
     print(f"🧠 AI: Reading note '{note.title}'...")
-    genai_client = get_gemini_model()
-    if not genai_client or not note.file:
-        return False
+    embedder = get_embedding_backend()
+    if not note.file:
+        return None
+    if not embedder.available():
+        raise IndexingDeferred(f"Embedding backend '{embedder.model}' is not configured.")
 
-    # A. Extract Text
+    # A. Extract Text (text layer per page, OCR only for scanned pages)
+    progress('extracting', 5)
     text = ""
     try:
-        with pdfplumber.open(note.file.path) as pdf:
-            for page in pdf.pages:
-                t = page.extract_text()
-                if t: text += t + "\n"
-    except: pass
-
-    # B. Fallback to OCR
-    if len(text) < 100:
-        text = extract_text_with_ocr(note.file.path)
+        pages = extraction.extract_pages(
+            note.file.path, ocr_options=get_ocr_options(), progress=progress,
+            cache=ocr_cache.get_page_cache(), digest=note.content_hash or None,
+        )
+        extraction.print_page_report(pages)
+        text = "".join(p.text + "\n" for p in pages if p.text)
+    except Exception as e:
+        print(f"❌ Extraction Failed: {e}")
 
     if len(text) < 50:
         print("❌ Failed: File is unreadable.")
-        return False
+        return None
 
-    # C. Chunk Text
-    chunk_size = 1000
-    chunks = [text[i:i+chunk_size] for i in range(0, len(text), chunk_size)]
-    
-    # D. Embed with Smart Batching
-    all_embeddings = []
-    batch_size = 5
+    # C. Chunk Text (along paragraphs and headings, overlapping a little)
+    chunks = chunk_text(
+        text,
+        chunk_size=getattr(settings, 'VAULT_CHUNK_SIZE', 1000),
+        overlap=getattr(settings, 'VAULT_CHUNK_OVERLAP', 150),
+    )
     
-    print(f"   - Processing {len(chunks)} chunks in batches of {batch_size}...")
-
-    for i in range(0, len(chunks), batch_size):
-        batch = chunks[i:i+batch_size]
-        
-        batch_embeddings = safe_embed_batch(genai_client, batch, note.title)
-        
-        if batch_embeddings is None:
-            print("❌ Failed to embed batch after retries. Aborting.")
-            return False
-            
-        if len(all_embeddings) == 0:
-            all_embeddings = batch_embeddings
-        else:
-            all_embeddings = np.vstack([all_embeddings, batch_embeddings])
-        
-        time.sleep(2)
-
-    # E. Save to FAISS
-    index_path = get_user_index_path(note.user.id)
-    chunks_path = get_user_chunks_path(note.user.id)
-
-    if os.path.exists(index_path) and os.path.exists(chunks_path):
-        index = faiss.read_index(index_path)
-        with open(chunks_path, 'rb') as f:
-            stored_chunks = pickle.load(f)
-    else:
-        index = faiss.IndexFlatL2(768)
-        stored_chunks = []
+    # D. Embed with Smart Batching (chunks seen before come straight from the cache)
+    all_embeddings = np.empty((len(chunks), EMBED_DIM), dtype='float32')
+    cached = embedding_cache.get_many(embedder.model, chunks)
+    for i, vector in cached.items():
+        all_embeddings[i] = vector
+    missing = [i for i in range(len(chunks)) if i not in cached]
+    missing_texts = [chunks[i] for i in missing]
+
+    print(f"   - {len(cached)} chunks cached, embedding {len(missing)} (up to {embedder.max_batch} per request, several at once)...")
+    embedded = [0]
 
-    index.add(all_embeddings)
-    stored_chunks.extend(chunks)
+    def on_batch(start, end, vectors):
+        # No per-note title: the vector must depend on the text alone to be shareable
+        embedding_cache.put_many(embedder.model, missing_texts[start:end], vectors)
+        embedded[0] += end - start
+        progress('embedding', 20 + 70 * embedded[0] // len(missing))
 
-    faiss.write_index(index, index_path)
-    with open(chunks_path, 'wb') as f:
-        pickle.dump(stored_chunks, f)
+    if missing:
+        started = time.perf_counter()
+        vectors = embed_all(embedder, missing_texts, on_batch=on_batch)
+        if vectors is None:
+            raise IndexingDeferred("Embedding failed after retries (quota or network); will retry.")
+        all_embeddings[missing] = vectors
+        print(f"   - Embedded {len(missing)} chunks in {time.perf_counter() - started:.1f}s")
+    return chunks, all_embeddings
+
+def add_note_to_vault(note, progress=None):
+    """Embeds a note into its owner's vault. `progress(stage, percent)` is called as work advances."""
+    progress = progress or (lambda stage, percent: None)
+    embedded_note = embed_note(note, progress)
+    if embedded_note is None:
+        return False
+    chunks, all_embeddings = embedded_note
+
+    # E. Save to FAISS (skip if the note was deleted while we were embedding it)
+    progress('saving', 95)
+    if not Note.objects.filter(id=note.id).exists():
+        print("⚠️ AI: Note was deleted during indexing, discarding.")
+        return False
+    vault.append_note(note.user.id, note.id, note.title, chunks, all_embeddings)
 
     print("✅ AI: Note memorized successfully.")
     return True
 
+# 5b. FORGET / RENAME: Keep the vault in step with the Note table
+def remove_note_from_vault(note):
+    try:
+        removed = vault.remove_note(note.user_id, note.id)
+        if removed:
+            print(f"🗑️ AI: Forgot {removed} chunks of '{note.title}'.")
+    except Exception as e:
+        print(f"❌ Vault cleanup failed: {e}")
+
+def rename_note_in_vault(note):
+    try:
+        vault.rename_note(note.user_id, note.id, note.title)
+    except Exception as e:
+        print(f"❌ Vault rename failed: {e}")
+
 # 6. THINK: Answer a question
-def ask_vault(user, question):
-    genai_client = get_gemini_model()
-    if not genai_client: return "System Error: AI Key missing."
+def get_squad_shards(squad, user):
+    """The asker's own vault plus every squadmate who opted in to sharing theirs."""
+    owner_ids = Membership.objects.filter(squad=squad, share_vault=True).values_list('user_id', flat=True)
+    return vault.squad_shard_cache.get(squad.id, sorted(owner_ids), user.id)
 
-    index_path = get_user_index_path(user.id)
-    chunks_path = get_user_chunks_path(user.id)
+def embed_question(question):
+    """Query vector for `question`, from the question cache when it was asked before."""
+    embedder = get_embedding_backend()
+    q_embedding = question_cache.get(embedder.model, question)
+    if q_embedding is None:
+        q_embedding = embedder.embed_query(question)
+        if q_embedding is not None:
+            question_cache.put(embedder.model, question, q_embedding)
+    return q_embedding
 
-    if not os.path.exists(index_path):
-        return "Vault is empty. Upload a PDF first!"
+async def aembed_question(question):
+    embedder = get_embedding_backend()
+    q_embedding = question_cache.get(embedder.model, question)
+    if q_embedding is None:
+        q_embedding = await embedder.aembed_query(question)
+        if q_embedding is not None:
+            question_cache.put(embedder.model, question, q_embedding)
+    return q_embedding
 
-    # Get embedding for the question
-    q_embedding = safe_embed_batch(genai_client, question, "User Query")
+def lookup_answer(shards, q_embedding, hits, squad=None):
+    """(cached answer or None, slot for the fresh one). Answers are tied to the searched
+    vaults' versions and to the chunks retrieved for the question."""
+    scope = ('squad' if squad is not None else 'user',) + tuple(owner_id for owner_id, _ in shards)
+    version = tuple(vault.vault_cache.stamp(owner_id) for owner_id, _ in shards)
+    context = sorted((int(owner_id), int(idx)) for owner_id, idx, _ in hits)
+    return answer_cache.get(scope, version, q_embedding, context)
+
+def build_prompt(user, question, squad=None):
+    """Retrieves context for `question`.
+
+    Returns (prompt, None, slot) to generate an answer and answer_cache.put() it
+    into `slot`, or (None, reply, None) when the reply is already known: an
+    error message or a cached answer.
+    """
+    chat_model = get_chat_model()
+    if not chat_model.available(): return None, "System Error: AI Key missing.", None
+
+    if squad is None:
+        user_vault = vault.vault_cache.get(user.id)
+        shards = [(user.id, user_vault)] if user_vault is not None else []
+    else:
+        shards = get_squad_shards(squad, user)
+    if not shards:
+        return None, "Vault is empty. Upload a PDF first!", None
+
+    # Get embedding for the question (same backend the vault was built with)
+    q_embedding = embed_question(question)
     
     if q_embedding is None:
-        return "System Overload: AI is taking a break. Try again in 1 minute."
-        
+        return None, "System Overload: AI is taking a break. Try again in 1 minute.", None
+
     # Reshape for FAISS
     q_vector = q_embedding.reshape(1, -1)
-
-    index = faiss.read_index(index_path)
-    with open(chunks_path, 'rb') as f:
-        stored_chunks = pickle.load(f)
-    
-    k = 5 
-    distances, indices = index.search(q_vector, k)
     
+    hits = retrieve_context(shards, q_vector)
+    cached, slot = lookup_answer(shards, q_embedding, hits, squad)
+    if cached is not None:
+        return None, cached, None
+    vaults = dict(shards)
+    owners = {}
+    if squad is not None:
+        owners = dict(User.objects.filter(id__in=vaults).values_list('id', 'username'))
+    return format_prompt(question, hits, vaults, owners), None, slot
+
+def retrieve_context(shards, q_vector):
+    """[(owner_id, chunk_id, text)] for the prompt: diverse, deduplicated, within the token budget."""
+    candidates = vault.search_shards(shards, q_vector, getattr(settings, 'VAULT_CONTEXT_CANDIDATES', 20))
+    if not candidates:
+        return []
+    vaults = dict(shards)
+    # Only the candidate chunks are read from the memory-mapped stores
+    texts = [vaults[owner_id].chunks.get(idx) for _, owner_id, idx in candidates]
+    vectors = np.vstack([vault.exact_vectors(vaults[owner_id], [idx]) for _, owner_id, idx in candidates])
+    chosen = context.assemble(
+        q_vector, vectors, texts,
+        token_budget=getattr(settings, 'VAULT_CONTEXT_TOKEN_BUDGET', 1200),
+        relevance_weight=getattr(settings, 'VAULT_MMR_RELEVANCE_WEIGHT', 0.7),
+        min_relevance=getattr(settings, 'VAULT_CONTEXT_MIN_RELEVANCE', 0.5),
+    )
+    return [(candidates[i][1], candidates[i][2], texts[i]) for i in chosen]
+
+def format_prompt(question, hits, vaults, owners):
+    """`owners` maps vault owner id -> username, and is only filled in squad mode."""
     relevant_context = ""
-    for idx in indices[0]:
-        if idx < len(stored_chunks):
-            relevant_context += stored_chunks[idx] + "\n\n"
+    for owner_id, idx, text in hits:
+        hit_vault = vaults[owner_id]
+        title = hit_vault.titles.get(str(int(hit_vault.chunks.note_ids[idx])))
+        if title and owner_id in owners:
+            relevant_context += f"[Source: {title} // {owners[owner_id]}]\n"
+        elif title:
+            relevant_context += f"[Source: {title}]\n"
+        relevant_context += text + "\n\n"
 
-    # --- UPGRADE: Use Gemini 2.5 Flash ---
     prompt = f"""
     You are StudyVault AI. Answer using ONLY the context below.
     CONTEXT:
@@ -188,11 +258,80 @@ def ask_vault(user, question):
     QUESTION:
     {question}
     """
-    
-    # 2.5 Flash is the stable model for 2026
-    model = genai_client.GenerativeModel('gemini-2.5-flash')
+    return prompt
+
+def ask_vault(user, question, squad=None):
+    """Answers from the user's vault, or from the shared vaults of `squad` when given."""
+    prompt, reply, slot = build_prompt(user, question, squad)
+    if prompt is None:
+        return reply
     try:
-        response = model.generate_content(prompt)
-        return response.text
+        answer = get_chat_model().generate(prompt)
     except Exception as e:
-        return f"I'm having trouble thinking right now. Error: {str(e)}"
\ No newline at end of file
+        return f"I'm having trouble thinking right now. Error: {str(e)}"
+    answer_cache.put(slot, answer)
+    return answer
+
+async def aget_squad_shards(squad, user):
+    owner_ids = [user_id async for user_id in Membership.objects.filter(squad=squad, share_vault=True).values_list('user_id', flat=True)]
+    return await asyncio.to_thread(vault.squad_shard_cache.get, squad.id, sorted(owner_ids), user.id)
+
+async def abuild_prompt(user, question, squad=None):
+    """build_prompt() for async views: disk loads and FAISS run on worker threads, model calls don't block."""
+    chat_model = get_chat_model()
+    if not chat_model.available(): return None, "System Error: AI Key missing.", None
+
+    if squad is None:
+        user_vault = await asyncio.to_thread(vault.vault_cache.get, user.id)
+        shards = [(user.id, user_vault)] if user_vault is not None else []
+    else:
+        shards = await aget_squad_shards(squad, user)
+    if not shards:
+        return None, "Vault is empty. Upload a PDF first!", None
+
+    q_embedding = await aembed_question(question)
+    if q_embedding is None:
+        return None, "System Overload: AI is taking a break. Try again in 1 minute.", None
+
+    hits = await asyncio.to_thread(retrieve_context, shards, q_embedding.reshape(1, -1))
+    cached, slot = await asyncio.to_thread(lookup_answer, shards, q_embedding, hits, squad)
+    if cached is not None:
+        return None, cached, None
+    vaults = dict(shards)
+    owners = {}
+    if squad is not None:
+        owners = {user_id: name async for user_id, name in User.objects.filter(id__in=vaults).values_list('id', 'username')}
+    return format_prompt(question, hits, vaults, owners), None, slot
+
+async def aask_vault(user, question, squad=None):
+    prompt, reply, slot = await abuild_prompt(user, question, squad)
+    if prompt is None:
+        return reply
+    try:
+        answer = await get_chat_model().agenerate(prompt)
+    except Exception as e:
+        return f"I'm having trouble thinking right now. Error: {str(e)}"
+    answer_cache.put(slot, answer)
+    return answer
+
+async def astream_vault_answer(user, question, squad=None):
+    prompt, reply, slot = await abuild_prompt(user, question, squad)
+    if prompt is None:
+        yield reply
+        return
+    answer = ""
+    try:
+        async for piece in get_chat_model().astream(prompt):
+            answer += piece
+            yield piece
+    except Exception as e:
+        yield f"I'm having trouble thinking right now. Error: {str(e)}"
+        return
+    answer_cache.put(slot, answer)
+
+def cache_stats():
+    return {
+        'questions': question_cache.stats(),
+        'answers': answer_cache.stats(),
+        'embeddings': {'hits': embedding_cache.hits, 'misses': embedding_cache.misses},
+    }
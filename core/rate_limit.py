@@ -0,0 +1,226 @@
+# core/rate_limit.py
+# Token buckets shared by every web and ingestion process through one SQLite
+# file, so concurrent uploads and chats draw from the same Gemini quota instead
+# of each sleeping blindly. The refill rate adapts (AIMD): it creeps back up
+# after successful calls and halves on every 429, and a Retry-After hint from
+# the API blocks the whole bucket until it has passed.
+
+import asyncio
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+
+
+class RateLimited(Exception):
+    """No quota became available within the caller's timeout."""
+
+
+_RETRY_PATTERNS = [
+    re.compile(r"retry in ([\d.]+)\s*s", re.IGNORECASE),
+    re.compile(r"retry_delay\s*\{\s*seconds:\s*(\d+)", re.IGNORECASE),
+    re.compile(r"retry-after:?\s*([\d.]+)", re.IGNORECASE),
+]
+
+
+def is_rate_limit_error(error):
+    text = str(error).lower()
+    return "429" in text or "quota" in text or "resource exhausted" in text or "rate limit" in text
+
+
+def parse_retry_after(error):
+    """Seconds the API asked us to wait, if the error carries a hint."""
+    response = getattr(error, 'response', None)
+    header = getattr(response, 'headers', {}).get('Retry-After') if response is not None else None
+    if header:
+        try:
+            return float(header)
+        except ValueError:
+            pass
+    for pattern in _RETRY_PATTERNS:
+        match = pattern.search(str(error))
+        if match:
+            return float(match.group(1))
+    return None
+
+
+class RateLimiter:
+    """Cross-process token bucket for one API quota.
+
+    `per_minute` is the quota ceiling in tokens; the live rate starts there and
+    adapts. A call costs one token unless the quota counts it as several (a
+    batch of texts). `burst` is how many tokens may go out back to back after
+    an idle period.
+    """
+
+    def __init__(self, name, per_minute, burst=None, path=None, min_per_minute=1, backoff=60):
+        self.name = name
+        self.max_rate = per_minute / 60.0
+        self.min_rate = min(min_per_minute, per_minute) / 60.0
+        self.burst = float(burst or max(1, per_minute // 6))
+        self.backoff = backoff  # Block this long on a 429 without a hint
+        self.path = path or getattr(settings, 'RATE_LIMIT_DB_PATH', None) or os.path.join(
+            settings.MEDIA_ROOT, 'vectors', 'rate_limits.sqlite3'
+        )
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                " name TEXT PRIMARY KEY,"
+                " tokens REAL NOT NULL,"
+                " rate REAL NOT NULL,"
+                " updated REAL NOT NULL,"
+                " blocked_until REAL NOT NULL)"
+            )
+            self._local.conn = conn
+        return conn
+
+    def _update(self, fn):
+        """Runs fn(state) -> result under an exclusive lock on this bucket's row."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            row = conn.execute(
+                "SELECT tokens, rate, updated, blocked_until FROM buckets WHERE name = ?", (self.name,)
+            ).fetchone()
+            if row is None:
+                state = {'tokens': self.burst, 'rate': self.max_rate, 'updated': now, 'blocked_until': 0.0}
+            else:
+                state = dict(zip(('tokens', 'rate', 'updated', 'blocked_until'), row))
+                # The quota ceiling may have been lowered in settings since the row was written
+                state['rate'] = min(max(state['rate'], self.min_rate), self.max_rate)
+                state['tokens'] = min(self.burst, state['tokens'] + max(0.0, now - state['updated']) * state['rate'])
+                state['updated'] = now
+            result = fn(state, now)
+            conn.execute(
+                "INSERT OR REPLACE INTO buckets (name, tokens, rate, updated, blocked_until) VALUES (?, ?, ?, ?, ?)",
+                (self.name, state['tokens'], state['rate'], now, state['blocked_until']),
+            )
+            conn.execute("COMMIT")
+            return result
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _try_take(self, cost):
+        """Takes `cost` tokens if they're there; otherwise returns how long to wait first."""
+        cost = min(cost, self.burst)  # A call bigger than the bucket waits for a full one
+
+        def take(state, now):
+            if now < state['blocked_until']:
+                return state['blocked_until'] - now
+            if state['tokens'] >= cost:
+                state['tokens'] -= cost
+                return 0.0
+            return (cost - state['tokens']) / state['rate']
+        return self._update(take)
+
+    def acquire(self, cost=1.0, timeout=None):
+        """Blocks until `cost` tokens are available and takes them. Returns False on timeout."""
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            wait = self._try_take(cost)
+            if wait <= 0:
+                return True
+            if deadline is not None and time.time() + wait > deadline:
+                return False
+            time.sleep(min(wait, 5.0))  # Re-check: the rate may recover or another worker may refund
+
+    async def aacquire(self, cost=1.0, timeout=None):
+        """acquire() for async views: waits on the event loop instead of holding a thread."""
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            wait = await asyncio.to_thread(self._try_take, cost)
+            if wait <= 0:
+                return True
+            if deadline is not None and time.time() + wait > deadline:
+                return False
+            await asyncio.sleep(min(wait, 5.0))
+
+    def success(self):
+        """Additive increase: win back a little of the quota after every accepted call."""
+        step = self.max_rate / 20
+
+        def grow(state, now):
+            state['rate'] = min(self.max_rate, state['rate'] + step)
+        self._update(grow)
+
+    def throttled(self, retry_after=None):
+        """Multiplicative decrease on a 429, and hold everyone off until the hint passes."""
+        wait = retry_after if retry_after is not None else self.backoff
+
+        def shrink(state, now):
+            state['rate'] = max(self.min_rate, state['rate'] / 2)
+            state['tokens'] = 0.0
+            state['blocked_until'] = max(state['blocked_until'], now + wait)
+        self._update(shrink)
+        return wait
+
+    def status(self):
+        def read(state, now):
+            return {
+                'name': self.name,
+                'tokens': round(state['tokens'], 2),
+                'per_minute': round(state['rate'] * 60, 1),
+                'max_per_minute': round(self.max_rate * 60, 1),
+                'blocked_for': round(max(0.0, state['blocked_until'] - now), 1),
+            }
+        return self._update(read)
+
+    def call(self, fn, retries=5, cost=1.0, timeout=None):
+        """Runs fn() within the quota, retrying on rate-limit errors. Other errors propagate.
+
+        Raises RateLimited when the quota doesn't free up within `timeout` seconds.
+        """
+        for attempt in range(retries):
+            if not self.acquire(cost, timeout):
+                raise RateLimited(self.name)
+            try:
+                result = fn()
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt == retries - 1:
+                    raise
+                wait = self.throttled(parse_retry_after(e))
+                print(f"   ⚠️ Quota Hit on {self.name}! Backing off {wait:.0f}s ({attempt+1}/{retries})...")
+                continue
+            self.success()
+            return result
+
+    async def acall(self, afn, retries=5, cost=1.0, timeout=None):
+        """call() for coroutines: `afn()` returns an awaitable."""
+        for attempt in range(retries):
+            if not await self.aacquire(cost, timeout):
+                raise RateLimited(self.name)
+            try:
+                result = await afn()
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt == retries - 1:
+                    raise
+                wait = await asyncio.to_thread(self.throttled, parse_retry_after(e))
+                print(f"   ⚠️ Quota Hit on {self.name}! Backing off {wait:.0f}s ({attempt+1}/{retries})...")
+                continue
+            await asyncio.to_thread(self.success)
+            return result
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(name):
+    """The process-wide limiter for a quota named in settings.GEMINI_RATE_LIMITS."""
+    with _limiters_lock:
+        if name not in _limiters:
+            limits = getattr(settings, 'GEMINI_RATE_LIMITS', {}).get(name, {})
+            _limiters[name] = RateLimiter(name, **{'per_minute': 60, **limits})
+        return _limiters[name]
@@ -0,0 +1,98 @@
+# core/storage.py
+# Content-addressed storage for note uploads. Each upload is hashed (SHA-256)
+# while it streams to a temporary file and then stored once per distinct
+# content at notes/blobs/<ab>/<digest><ext>, so a datesheet uploaded by a whole
+# class takes the disk space of one file. A Blob row counts the notes that
+# reference each file; delete() drops one reference and removes the file with
+# the last. The digest doubles as Note.content_hash for the extraction caches.
+#
+# Files uploaded before this storage keep their names and are deleted as
+# before; `manage.py dedupe_uploads` moves them in and repairs counts.
+
+import hashlib
+import os
+import re
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import F
+
+from .file_lock import FileLock
+
+BLOB_DIR = 'blobs'
+_DIGEST_NAME = re.compile(r'^([0-9a-f]{64})(\.[^./]*)?$')
+
+
+def digest_from_name(name):
+    """The SHA-256 in a content-addressed file name, or '' for any other name."""
+    match = _DIGEST_NAME.match(os.path.basename(name or ''))
+    return match.group(1) if match else ''
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    def _lock(self):
+        # One lock for every reference-count change, so a delete of the last
+        # reference can't remove a file that a concurrent upload just counted on
+        return FileLock(self.path('.blobs.lock'))
+
+    def get_available_name(self, name, max_length=None):
+        return name  # _save() names the file by its content
+
+    def blob_name(self, name, digest):
+        directory = os.path.dirname(name)
+        extension = os.path.splitext(name)[1].lower()
+        return '/'.join(p for p in (directory, BLOB_DIR, digest[:2], digest + extension) if p)
+
+    def _save(self, name, content):
+        from .models import Blob
+
+        staging_dir = self.path(os.path.join(os.path.dirname(name), BLOB_DIR))
+        os.makedirs(staging_dir, exist_ok=True)
+        fd, staged = tempfile.mkstemp(dir=staging_dir, suffix='.part')
+        h = hashlib.sha256()
+        size = 0
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for chunk in content.chunks():
+                    h.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+            blob_name = self.blob_name(name, h.hexdigest())
+            full_path = self.path(blob_name)
+            with self._lock(), transaction.atomic():
+                blob, _ = Blob.objects.get_or_create(name=blob_name, defaults={'digest': h.hexdigest(), 'size': size})
+                if not os.path.exists(full_path):
+                    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                    os.replace(staged, full_path)
+                    staged = None
+                Blob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1)
+        finally:
+            if staged and os.path.exists(staged):
+                os.remove(staged)
+        return blob_name
+
+    def delete(self, name):
+        """Drops one reference to `name`, removing the file once nothing references it."""
+        from .models import Blob
+
+        with self._lock():
+            with transaction.atomic():
+                blob = Blob.objects.filter(name=name).first()
+                if blob is not None:
+                    if blob.ref_count > 1:
+                        Blob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') - 1)
+                        return
+                    blob.delete()
+            super().delete(name)
+
+
+def get_note_storage():
+    return note_storage
+
+
+note_storage = ContentAddressedStorage()
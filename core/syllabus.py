@@ -0,0 +1,89 @@
+# core/syllabus.py
+# Turns a CHO (course handout) PDF into Topic rows. Tables are pulled one page
+# at a time so a long handout never holds every parsed page in memory, rows are
+# classified by a generator as they arrive, and import_topics() writes them in
+# one bulk insert. Nothing here needs a request, so the same code runs offline
+# (see `manage.py syllabus_benchmark`).
+
+import re
+from collections import namedtuple
+
+import pdfplumber
+from django.db import transaction
+
+from .models import Topic
+from .ocr_cache import file_digest
+
+ParsedTopic = namedtuple('ParsedTopic', ['lecture', 'topic'])
+
+MIN_TOPIC_CHARS = 4
+# Settings that shape the extracted tables; part of their cache key
+TABLE_OPTIONS = {'extractor': 'pdfplumber.extract_tables'}
+
+_LECTURE = re.compile(r'^[\d\s\-]+$')  # "7", "7-8", "7 - 9"
+
+
+def iter_page_tables(pdf_path):
+    """Yields the tables (lists of rows) of each page in turn."""
+    with pdfplumber.open(pdf_path) as pdf:
+        for page in pdf.pages:
+            tables = page.extract_tables()
+            page.flush_cache()  # Don't keep every parsed page alive
+            yield tables
+
+
+def read_page_tables(pdf_path, cache=None, digest=None):
+    """Yields each page's tables, from `cache` (ocr_cache.PageCache) when this file was read before.
+
+    A file is only cached once every page has been read, so a consumer that
+    stops early (or an error part-way) leaves it to be read again next time.
+    `digest` is the file's SHA-256 if already known (Note.content_hash).
+    """
+    key = None
+    if cache is not None:
+        key = cache.make_key(digest or file_digest(pdf_path), 'cho', TABLE_OPTIONS)
+        cached = cache.get(key)
+        if cached is not None:
+            yield from cached
+            return
+    pages = []
+    for tables in iter_page_tables(pdf_path):
+        pages.append(tables)
+        yield tables
+    if key:
+        cache.put(key, 'cho', pages)
+
+
+def parse_row(row):
+    """The ParsedTopic in one table row, or None if it isn't a lecture row."""
+    if not row or len(row) < 2:
+        return None
+    lecture = str(row[0]).strip()
+    if not _LECTURE.match(lecture):
+        return None
+    cell = row[1] if row[1] else max(row, key=lambda x: len(str(x)))
+    topic = str(cell).replace('\n', ' ').strip()
+    if len(topic) < MIN_TOPIC_CHARS:
+        return None
+    return ParsedTopic(lecture, topic)
+
+
+def parse_tables(page_tables):
+    """Yields a ParsedTopic for every lecture row in an iterable of per-page table lists."""
+    for tables in page_tables:
+        for table in tables:
+            for row in table:
+                entry = parse_row(row)
+                if entry:
+                    yield entry
+
+
+def import_topics(exam, note, entries):
+    """Creates a CHO Topic under `exam` for each entry in one transaction. Returns how many were created."""
+    topics = [
+        Topic(exam=exam, name=f"[Lec {entry.lecture}] {entry.topic}", source_note=note, is_cho=True)
+        for entry in entries
+    ]
+    with transaction.atomic():
+        Topic.objects.bulk_create(topics)
+    return len(topics)
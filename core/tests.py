@@ -1,3 +1,649 @@
-from django.test import TestCase
+import json
+import shutil
+import tempfile
+import threading
+from datetime import datetime
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.db import IntegrityError, connection, models
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import chunking, datesheet, embeddings, extraction, ingestion, ocr, rag, vault
+from .answer_cache import AnswerCache, QuestionCache
+from .embed_cache import EmbeddingCache
+from .management.commands.vault_compress import Command as VaultCompressCommand
+from .models import Blob, Exam, IngestionJob, Note
+from .ocr_cache import PageCache
+from .rate_limit import RateLimited, RateLimiter
+
+
+class TempDirMixin:
+    """A fresh directory per test (`self.tmp`) holding the user vaults, so nothing touches MEDIA_ROOT."""
+
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+        self.patch(vault, 'INDEX_DIR', self.tmp)
+        vault.vault_cache.clear()
+        self.addCleanup(vault.vault_cache.clear)
+
+    def patch(self, target, name, value):
+        """mock.patch.object() for the rest of the test."""
+        patcher = mock.patch.object(target, name, value)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return value
+
+    def use_settings(self, **options):
+        """override_settings() for the rest of the test."""
+        override = override_settings(**options)
+        override.enable()
+        self.addCleanup(override.disable)
+
+
+@override_settings(VAULT_EMBEDDING_BACKEND='local', VAULT_CHAT_MODEL='local', VAULT_LOCAL_CHAT_DELAY=0.0)
+class VaultChatTests(TempDirMixin, TestCase):
+    """/api/vault-chat/ end to end on the offline embedder and LocalChatModel."""
+
+    CHUNKS = [
+        "Mitochondria are the powerhouse of the cell and produce ATP for the cell.",
+        "The nucleus of the cell stores DNA and controls cell division.",
+    ]
+
+    def setUp(self):
+        super().setUp()
+        self.patch(embeddings, '_backend', None)
+        self.patch(rag, 'question_cache', QuestionCache(16))
+        self.patch(rag, 'answer_cache', AnswerCache(16, 16, 0.95))
+
+        self.user = User.objects.create_user('ada', password='pw')
+        note = Note.objects.create(user=self.user, title='Cell Biology', file='notes/cells.pdf')
+        vectors = embeddings.get_embedding_backend().embed_documents(self.CHUNKS)
+        vault.append_note(self.user.id, note.id, note.title, self.CHUNKS, vectors)
+        self.client.force_login(self.user)
+        self.async_client.force_login(self.user)
+
+    def post(self, **data):
+        return self.client.post('/api/vault-chat/', json.dumps(data), content_type='application/json')
+
+    def test_json_answer_quotes_the_retrieved_context(self):
+        response = self.post(message="What is the powerhouse of the cell?")
+        self.assertEqual(response.status_code, 200)
+        answer = response.json()['answer']
+        self.assertTrue(answer.startswith("From your notes:"), answer)
+        self.assertIn("Mitochondria", answer)
+
+    def test_empty_message(self):
+        self.assertEqual(self.post(message="").json(), {'answer': 'Empty transmission.'})
+
+    def test_empty_vault(self):
+        other = User.objects.create_user('bob', password='pw')
+        self.client.force_login(other)
+        self.assertEqual(self.post(message="Anything?").json()['answer'], "Vault is empty. Upload a PDF first!")
+
+    def test_get_is_rejected(self):
+        self.assertEqual(self.client.get('/api/vault-chat/').status_code, 405)
+
+    async def test_stream_sends_deltas_then_the_full_answer(self):
+        response = await self.async_client.post(
+            '/api/vault-chat/', json.dumps({'message': "What is the powerhouse of the cell?", 'stream': True}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = b"".join([chunk async for chunk in response.streaming_content]).decode('utf-8')
+
+        events = [e for e in body.split("\n\n") if e]
+        deltas = [json.loads(e[len("data: "):])['delta'] for e in events[:-1]]
+        self.assertTrue(all(e.startswith("data: ") for e in events[:-1]))
+        self.assertTrue(events[-1].startswith("event: done\ndata: "))
+        done = json.loads(events[-1].split("data: ", 1)[1])
+        self.assertGreater(len(deltas), 1)
+        self.assertEqual("".join(deltas), done['answer'])
+        self.assertIn("Mitochondria", done['answer'])
+
+    def test_repeated_question_is_answered_from_the_cache(self):
+        first = self.post(message="What is the powerhouse of the cell?").json()['answer']
+        second = self.post(message="what is the powerhouse of the cell?").json()['answer']
+        self.assertEqual(first, second)
+        self.assertEqual(rag.answer_cache.hits, 1)
+
+    def test_near_duplicate_question_with_other_context_is_not_reused(self):
+        note = Note.objects.create(user=self.user, title='Chapters', file='notes/chapters.pdf')
+        chunks = ["Chapter 4 flashcards: osmosis moves water across a membrane.",
+                  "Chapter 5 flashcards: photosynthesis turns light into glucose."]
+        vectors = embeddings.get_embedding_backend().embed_documents(chunks)
+        vault.append_note(self.user.id, note.id, note.title, chunks, vectors)
+        # Threshold low enough that the two wordings alone would match
+        with mock.patch.object(rag, 'answer_cache', AnswerCache(16, 16, 0.7)):
+            four = self.post(message="Make flashcards for chapter 4").json()['answer']
+            five = self.post(message="Make flashcards for chapter 5").json()['answer']
+            self.assertEqual(rag.answer_cache.hits, 0)
+        self.assertIn("osmosis", four)
+        self.assertIn("photosynthesis", five)
+
+
+class VaultCompactionTests(TempDirMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        rng = np.random.default_rng(0)
+        for note_id in (1, 2, 3):
+            vectors = rng.standard_normal((4, vault.EMBED_DIM)).astype('float32')
+            vault.append_note(7, note_id, f"Note {note_id}", [f"note {note_id} chunk {i}" for i in range(4)], vectors)
+
+    def test_delete_leaves_compaction_to_the_worker(self):
+        with mock.patch.object(vault, 'compact', wraps=vault.compact) as compact:
+            vault.remove_note(7, 1)
+            compact.assert_not_called()
+            self.assertEqual(vault.user_ids_flagged_for_compaction(), [7])
+            self.assertEqual(vault.get_user_store(7).dead_count(), 4)
+
+            ingestion.compact_flagged_vaults()
+            compact.assert_called_once_with(7)
+        store = vault.get_user_store(7)
+        self.assertEqual((len(store), store.dead_count()), (8, 0))
+        self.assertEqual(vault.user_ids_flagged_for_compaction(), [])
+        self.assertEqual(vault.load_meta(7)['notes'], {'2': "Note 2", '3': "Note 3"})
+
+    def test_deleting_an_unindexed_note_writes_nothing(self):
+        version = vault.load_manifest(7)['version']
+        self.assertEqual(vault.remove_note(7, 99), 0)
+        self.assertEqual(vault.load_manifest(7)['version'], version)
+
+    def test_small_deletes_are_not_flagged(self):
+        with mock.patch.object(vault, 'COMPACT_DEAD_RATIO', 0.5):
+            vault.remove_note(7, 1)
+        self.assertEqual(vault.user_ids_flagged_for_compaction(), [])
+
+
+def random_vectors(n, seed=0):
+    return np.random.default_rng(seed).standard_normal((n, vault.EMBED_DIM)).astype('float32')
+
+
+class VaultIndexTests(TempDirMixin, TestCase):
+    def add_notes(self, sizes, first_note=1):
+        vectors = []
+        for note_id, size in enumerate(sizes, start=first_note):
+            note_vectors = random_vectors(size, seed=note_id)
+            vault.append_note(7, note_id, f"Note {note_id}", [f"{note_id}:{i}" for i in range(size)], note_vectors)
+            vectors.append(note_vectors)
+        return np.vstack(vectors)
+
+    def assert_finds_itself(self, vectors):
+        user_vault = vault.vault_cache.get(7)
+        sample = np.arange(0, len(vectors), 7)
+        for chunk_id, hits in zip(sample, vault.search(user_vault, vectors[sample] + 0.01, 1)):
+            self.assertEqual(hits[0][1], chunk_id)
+
+    def test_flat_vault_upgrades_to_ivf_past_the_threshold(self):
+        self.patch(vault, 'ANN_THRESHOLD', 100)
+        self.patch(vault, 'ANN_KIND', 'ivf')
+        vectors = self.add_notes([40, 40])
+        self.assertEqual(vault.index_kind(vault.vault_cache.get(7).index), 'flat')
+        vectors = np.vstack([vectors, self.add_notes([40, 40, 40], first_note=3)])
+        user_vault = vault.vault_cache.get(7)
+        self.assertEqual((vault.index_kind(user_vault.index), user_vault.index.ntotal), ('ivf', 200))
+        self.assert_finds_itself(vectors)
+
+    def test_compressed_vault_reranks_to_exact_hits(self):
+        self.patch(vault, 'VECTOR_STORAGE', 'int8')
+        vectors = self.add_notes([30, 30])
+        self.assertEqual(vault.index_storage(vault.vault_cache.get(7).index), 'int8')
+        self.assert_finds_itself(vectors)
+
+    def test_compressed_codes_are_retrained_as_the_vault_grows(self):
+        self.patch(vault, 'VECTOR_STORAGE', 'int8')
+        narrow = random_vectors(10) * 0.1  # Codes fitted to this alone would clip later notes
+        vault.append_note(7, 1, "Narrow", [str(i) for i in range(10)], narrow)
+        wide = self.add_notes([30, 30], first_note=2)
+        index = vault.vault_cache.get(7).index
+        restored = vault.reconstruct_ids(index, np.arange(10, 70, dtype='int64'))
+        self.assertLess(float(np.abs(restored - wide).mean()), 0.05)
+
+
+class VaultCommitTests(TempDirMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        vault.append_note(7, 1, "Bio", ["cells", "atp"], random_vectors(2))
+
+    def test_failed_commit_leaves_the_last_vault_intact(self):
+        version = vault.load_manifest(7)['version']
+        with mock.patch.object(vault, '_commit', side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                vault.remove_note(7, 1)
+        vault.vault_cache.clear()
+        user_vault = vault.vault_cache.get(7)
+        self.assertEqual(vault.load_manifest(7)['version'], version)
+        self.assertEqual(user_vault.titles, {'1': "Bio"})
+        self.assertEqual(user_vault.index.ntotal, 2)
+        self.assertTrue(user_vault.chunks.is_live(0))
+
+    def test_concurrent_writers_lose_nothing(self):
+        errors = []
+
+        def write(first_note):
+            try:
+                for note_id in range(first_note, first_note + 5):
+                    vault.append_note(7, note_id, f"Note {note_id}", [f"{note_id}:a", f"{note_id}:b"], random_vectors(2, note_id))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=write, args=(n,)) for n in (10, 20, 30, 40)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+        store = vault.get_user_store(7)
+        self.assertEqual((len(store), vault.load_manifest(7)['chunks']), (42, 42))
+        self.assertEqual(len(vault.load_meta(7)['notes']), 21)
+        self.assertEqual(vault.vault_cache.get(7).index.ntotal, 42)
+        reader = store.reader()
+        for note_id in (10, 24, 33, 44):
+            self.assertEqual(sorted(reader.get(int(i)) for i in store.chunk_ids_for_note(note_id)),
+                             [f"{note_id}:a", f"{note_id}:b"])
+
+
+class ShardSetCacheTests(TempDirMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        rng = np.random.default_rng(0)
+        for user_id in (1, 2, 3):
+            vectors = rng.standard_normal((2, vault.EMBED_DIM)).astype('float32')
+            vault.append_note(user_id, user_id, f"Note {user_id}", ["a", "b"], vectors)
+        self.cache = vault.ShardSetCache(4)
+
+    def test_askers_who_dont_share_reuse_the_squad_entry(self):
+        with mock.patch.object(vault.vault_cache, 'get', wraps=vault.vault_cache.get) as get:
+            for asker in (1, 2, 1, 2):
+                shards = self.cache.get(10, [3], asker)
+                self.assertEqual(sorted(uid for uid, _ in shards), sorted([3, asker]))
+        self.assertEqual([c.args for c in get.call_args_list].count((3,)), 1)
+
+    def test_sharing_asker_isnt_added_twice(self):
+        self.assertEqual([uid for uid, _ in self.cache.get(10, [1, 3], 1)], [1, 3])
+
+
+class VaultCompressTests(TestCase):
+    def test_recall_of_a_vault_smaller_than_k(self):
+        vectors = np.random.default_rng(0).standard_normal((3, vault.EMBED_DIM)).astype('float32')
+        ids = np.arange(3, dtype='int64')
+        chunks = mock.Mock(vectors=vectors)
+        exact = vault.Vault(vault.build_index(vectors, ids, 'flat', 'float32'), chunks, {}, 0)
+        raw, reranked, _ = VaultCompressCommand()._recall(exact, vectors, ids, k=5, n_queries=3)
+        self.assertEqual((raw, reranked), (1.0, 1.0))
+
+
+class IngestionQueueTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user('ada', password='pw')
+        self.job = ingestion.enqueue_note(Note.objects.create(user=user, title="Bio", file='notes/bio.pdf'))
+
+    def refresh(self):
+        self.job.refresh_from_db()
+        return self.job
+
+    def test_claim_takes_each_job_once(self):
+        claimed = ingestion.claim_next_job()
+        self.assertEqual((claimed.id, claimed.status, claimed.attempts), (self.job.id, IngestionJob.STATUS_RUNNING, 1))
+        self.assertIsNone(ingestion.claim_next_job())
+
+    def test_success_marks_the_job_done(self):
+        with mock.patch.object(rag, 'add_note_to_vault', return_value=True):
+            self.assertTrue(ingestion.run_job(ingestion.claim_next_job()))
+        self.assertEqual((self.refresh().status, self.job.progress), (IngestionJob.STATUS_DONE, 100))
+
+    def test_temporary_failure_is_retried_with_a_growing_delay(self):
+        deferred = mock.patch.object(rag, 'add_note_to_vault', side_effect=rag.IndexingDeferred("no key"))
+        delays = []
+        for attempt in (1, 2):
+            with deferred:
+                ingestion.run_job(ingestion.claim_next_job())
+            job = self.refresh()
+            self.assertEqual((job.status, job.attempts), (IngestionJob.STATUS_QUEUED, attempt))
+            delays.append((job.retry_after - timezone.now()).total_seconds())
+            self.assertIsNone(ingestion.claim_next_job())  # Not before retry_after
+            IngestionJob.objects.filter(id=job.id).update(retry_after=timezone.now())
+        self.assertAlmostEqual(delays[1] / delays[0], 2, delta=0.1)
+
+        with deferred:
+            ingestion.run_job(ingestion.claim_next_job())
+        self.assertEqual((self.refresh().status, self.job.error), (IngestionJob.STATUS_FAILED, "no key"))
+
+    def test_stale_job_is_reclaimed_then_failed_when_out_of_attempts(self):
+        stale = timezone.now() - ingestion.STALE_AFTER - timezone.timedelta(seconds=1)
+        ingestion.claim_next_job()
+        IngestionJob.objects.filter(id=self.job.id).update(updated_at=stale)
+        self.assertEqual(ingestion.claim_next_job().attempts, 2)
+
+        IngestionJob.objects.filter(id=self.job.id).update(updated_at=stale, attempts=ingestion.MAX_ATTEMPTS)
+        self.assertIsNone(ingestion.claim_next_job())
+        self.assertEqual(self.refresh().status, IngestionJob.STATUS_FAILED)
+
+
+class RateLimiterTests(TempDirMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.limiter = RateLimiter('test', per_minute=600, path=f"{self.tmp}/limits.sqlite3")  # 10/s, burst 100
+
+    def test_cost_draws_the_bucket_down(self):
+        self.assertTrue(self.limiter.acquire(60, timeout=0))
+        self.assertFalse(self.limiter.acquire(60, timeout=0))
+        self.assertTrue(self.limiter.acquire(30, timeout=0))
+
+    def test_throttling_halves_the_rate_and_success_wins_it_back(self):
+        self.limiter.throttled(retry_after=30)
+        status = self.limiter.status()
+        self.assertEqual(status['per_minute'], 300)
+        self.assertGreater(status['blocked_for'], 29)
+        self.assertFalse(self.limiter.acquire(1, timeout=0))
+        self.limiter.success()
+        self.assertEqual(self.limiter.status()['per_minute'], 330)
+
+    def test_call_retries_rate_limit_errors_only(self):
+        replies = iter([Exception("429 Resource exhausted, retry in 0.05s"), "ok"])
+
+        def flaky():
+            reply = next(replies)
+            if isinstance(reply, Exception):
+                raise reply
+            return reply
+        self.assertEqual(self.limiter.call(flaky), "ok")
+
+        broken = mock.Mock(side_effect=ValueError("bad request"))
+        with self.assertRaises(ValueError):
+            self.limiter.call(broken)
+        self.assertEqual(broken.call_count, 1)
+
+    def test_no_quota_within_the_timeout(self):
+        self.limiter.throttled(retry_after=60)
+        with self.assertRaises(RateLimited):
+            self.limiter.call(lambda: "never", timeout=0.1)
+
+
+class FakeEmbedder(embeddings.EmbeddingBackend):
+    model = 'test/length'
+    dim = 2
+    max_batch = 8
+
+    def __init__(self, fail_on=None):
+        self.batches = []
+        self.fail_on = fail_on
+
+    def embed_documents(self, texts):
+        self.batches.append(len(texts))
+        if self.fail_on in texts:
+            return None
+        return np.array([[len(t), 1.0] for t in texts], dtype='float32')
+
+
+class EmbeddingTests(TempDirMixin, TestCase):
+    def test_cache_returns_stored_vectors_by_position(self):
+        cache = EmbeddingCache(f"{self.tmp}/embeddings.sqlite3")
+        cache.put_many('m', ["a", "b"], np.eye(2, dtype='float32'))
+        found = cache.get_many('m', ["b", "x", "a", "b"])
+        self.assertEqual(sorted(found), [0, 2, 3])
+        np.testing.assert_array_equal(found[0], [0, 1])
+        np.testing.assert_array_equal(found[2], [1, 0])
+        self.assertEqual(cache.get_many('other-model', ["a"]), {})
+        self.assertEqual((cache.hits, cache.misses), (3, 2))
+
+    def test_hashing_embedder_is_deterministic_and_lexical(self):
+        backend = embeddings.HashingEmbeddingBackend()
+        docs = backend.embed_documents(["Mitochondria are the powerhouse of the cell.", "The nucleus stores DNA."])
+        np.testing.assert_allclose(np.linalg.norm(docs, axis=1), 1, rtol=1e-5)
+        query = backend.embed_query("what is the powerhouse of the cell")
+        np.testing.assert_array_equal(query, backend.embed_query("what is the powerhouse of the cell"))
+        self.assertGreater(docs[0] @ query, docs[1] @ query)
+
+    def test_embed_all_keeps_input_order_across_batches(self):
+        texts = ["x" * n for n in range(1, 41)]
+        embedder = FakeEmbedder()
+        landed = []
+        vectors = embeddings.embed_all(embedder, texts, on_batch=lambda start, end, v: landed.append((start, end)), max_workers=3)
+        np.testing.assert_array_equal(vectors[:, 0], np.arange(1, 41))
+        self.assertTrue(all(size <= embedder.max_batch for size in embedder.batches))
+        self.assertEqual(sum(end - start for start, end in landed), 40)
+
+    def test_embed_all_gives_up_when_a_batch_fails(self):
+        self.assertIsNone(embeddings.embed_all(FakeEmbedder(fail_on="x" * 5), ["x" * n for n in range(1, 41)], max_workers=2))
+
+    def test_batch_size_adapts_to_call_time(self):
+        batch_size = embeddings.AdaptiveBatchSize(FakeEmbedder())
+        batch_size.record(8, seconds=10)
+        self.assertEqual(batch_size.size, 4)
+        batch_size.record(4, seconds=0.1)
+        self.assertEqual(batch_size.size, 8)
+
+    @override_settings(VAULT_EMBEDDING_BACKEND='local')
+    def test_identical_chunks_are_embedded_once_across_notes(self):
+        self.patch(embeddings, '_backend', None)
+        self.patch(rag, 'embedding_cache', EmbeddingCache(f"{self.tmp}/embeddings.sqlite3"))
+        self.patch(rag.ocr_cache, 'get_page_cache', lambda: None)
+        text = "Shared handout. " * 20
+        self.patch(extraction, 'extract_pages', lambda *args, **kwargs: [extraction.PageText(1, text, 'text', 0.0)])
+        user = User.objects.create_user('ada', password='pw')
+        first, second = (Note.objects.create(user=user, title=t, file='notes/handout.pdf') for t in ("A", "B"))
+
+        with mock.patch.object(rag, 'embed_all', wraps=rag.embed_all) as embed_all:
+            chunks, vectors = rag.embed_note(first)
+            again_chunks, again = rag.embed_note(second)
+        self.assertEqual(embed_all.call_count, 1)
+        self.assertEqual(chunks, again_chunks)
+        np.testing.assert_array_equal(vectors, again)
+
+
+class ChunkingTests(TestCase):
+    def test_short_paragraph_is_not_repeated_inside_the_next_chunk(self):
+        chunks = chunking.chunk_text("UNIT 2\nShort para.\n\n" + "x" * 990, chunk_size=1000, overlap=150)
+        self.assertEqual(chunks[0], "UNIT 2\nShort para.")
+        for earlier, later in zip(chunks, chunks[1:]):
+            self.assertNotIn(earlier, later)
+
+    def test_chunks_fit_including_the_heading(self):
+        sentences = " ".join(f"Sentence {i} about the citric acid cycle." for i in range(60))
+        text = "CHAPTER 4 CELLULAR RESPIRATION\n" + sentences + "\n\n" + "y" * 400
+        chunks = chunking.chunk_text(text, chunk_size=300, overlap=80)
+        self.assertGreater(len(chunks), 5)
+        for chunk in chunks:
+            self.assertLessEqual(len(chunk), 300)
+            self.assertTrue(chunk.startswith("CHAPTER 4 CELLULAR RESPIRATION\n"))
+        # Neighbouring chunks still share their boundary sentence
+        self.assertIn(chunks[0].rsplit(". ", 1)[-1], chunks[1])
+
+
+class AnswerCacheTests(TestCase):
+    def setUp(self):
+        self.cache = AnswerCache(4, 4, 0.95)
+        self.vector = np.ones(8, dtype='float32')
+        self.near = self.vector.copy()
+        self.near[0] = 1.2  # cosine ~0.998
+
+    def test_similar_question_same_context_hits(self):
+        _, slot = self.cache.get(('user', 1), (1,), self.vector, [(1, 3)])
+        self.cache.put(slot, "answer")
+        self.assertEqual(self.cache.get(('user', 1), (1,), self.near, [(1, 3)])[0], "answer")
+
+    def test_similar_question_other_context_misses(self):
+        _, slot = self.cache.get(('user', 1), (1,), self.vector, [(1, 3)])
+        self.cache.put(slot, "chapter 4 answer")
+        self.assertIsNone(self.cache.get(('user', 1), (1,), self.near, [(1, 4)])[0])
+
+    def test_changed_vault_misses(self):
+        _, slot = self.cache.get(('user', 1), (1,), self.vector, [(1, 3)])
+        self.cache.put(slot, "answer")
+        self.assertIsNone(self.cache.get(('user', 1), (2,), self.vector, [(1, 3)])[0])
+        self.assertEqual(self.cache.invalidations, 1)
+
+
+class DatesheetParsingTests(TestCase):
+    def test_table_row_with_ocr_confusions(self):
+        entry = datesheet.parse_line("| 3 SEM | CSE1O1 | DATA BASE | l2-MAR-2O26 |")
+        self.assertEqual(entry.subject, "Data Base")
+        self.assertEqual(entry.semester, "Sem 3")
+        self.assertEqual(entry.date, timezone.make_aware(datetime(2026, 3, 12, datesheet.EXAM_HOUR)))
+
+    def test_session_words_and_dotted_dates(self):
+        entry = datesheet.parse_line("WEB TECH 5 SEM 03.APR.2026 EVENING SESSION")
+        self.assertEqual((entry.subject, entry.semester), ("Web Tech", "Sem 5"))
+        self.assertEqual(entry.date.date(), datetime(2026, 4, 3).date())
+
+    def test_semester_defaults_to_unknown(self):
+        self.assertEqual(datesheet.parse_line("DATA BASE 12-MAR-2026").semester, "Unknown")
+
+    def test_rejected_lines(self):
+        for line in (
+            "",
+            "12-MAR-2026",                                              # Too short
+            "Sr. No. Semester Course Code Course Title Date Session",  # Header, no date
+            "| 4 SEM | CSE2O2 | 12-MAR-2026 |",                         # Nothing left for a subject
+            "MATHS III 31-FEB-2026",                                    # Not a real day
+            "MATHS 3 SEM 05/06/2026",                                   # Numeric months are ambiguous
+        ):
+            self.assertIsNone(datesheet.parse_line(line), line)
+
+    def test_parse_text_keeps_only_exam_lines(self):
+        text = "UNIVERSITY EXAMINATION DATESHEET\n\nDATA BASE 12-MAR-2026\nPage 1 of 2\nWEB TECH 14-MAR-2026"
+        self.assertEqual([e.subject for e in datesheet.parse_text(text)], ["Data Base", "Web Tech"])
+
+
+class DatesheetReadTests(TempDirMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache = PageCache(f"{self.tmp}/pages.sqlite3", 1024 * 1024)
+        self.use_settings(DATESHEET_OCR_STATS_PATH=f"{self.tmp}/stats.jsonl")
+        scanned = [extraction.PageText(1, "", 'text', 0.0), extraction.PageText(2, "", 'text', 0.0)]
+        self.patch(extraction, 'read_text_layer', mock.Mock(return_value=scanned))
+
+    def read(self, second_page):
+        def fake_ocr(pdf_path, page_number, **kwargs):
+            if page_number == 2:
+                return second_page()
+            return "DATA BASE 12-MAR-2026", {'page': 1, 'method': 'ocr'}
+        with mock.patch.object(ocr, 'ocr_page_adaptive', side_effect=fake_ocr) as ocr_page:
+            pages = datesheet.read_pages('datesheet.pdf', cache=self.cache, digest='ab' * 32)
+        return pages, ocr_page.call_count
+
+    def test_blank_page_is_cached(self):
+        pages, calls = self.read(lambda: ("", {'page': 2, 'method': 'ocr'}))
+        self.assertEqual((pages[1]['text'], calls), ("", 2))
+        self.assertEqual(self.read(lambda: self.fail("read again"))[1], 0)
+
+    def test_timed_out_page_is_read_again(self):
+        def timeout():
+            raise RuntimeError("Tesseract process timeout")
+        pages, _ = self.read(timeout)
+        self.assertTrue(pages[1]['timed_out'])
+        pages, calls = self.read(lambda: ("WEB TECH 14-MAR-2026", {'page': 2, 'method': 'ocr'}))
+        self.assertEqual((pages[1]['text'], calls), ("WEB TECH 14-MAR-2026", 2))
+
+
+class ExtractionCacheTests(TempDirMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache = PageCache(f"{self.tmp}/pages.sqlite3", 1024 * 1024)
+        layer = [extraction.PageText(1, "A typed page with a text layer long enough.", 'text', 0.0),
+                 extraction.PageText(2, "", 'text', 0.0)]
+        self.patch(extraction, 'read_text_layer', lambda path: [
+            extraction.PageText(p.number, p.text, p.method, p.seconds) for p in layer])
+
+    def extract(self, scanned_page):
+        with mock.patch.object(ocr, 'ocr_pages_timed', return_value=[scanned_page]) as ocr_pages:
+            pages = extraction.extract_pages('note.pdf', cache=self.cache, digest='cd' * 32)
+        return pages, ocr_pages.call_count
+
+    def test_blank_scanned_page_is_cached(self):
+        pages, calls = self.extract(ocr.OcrPage("", 0.1, ''))
+        self.assertEqual(([p.method for p in pages], calls), (['text', 'ocr'], 1))
+        self.assertEqual(self.extract(ocr.OcrPage("never read", 0.1, ''))[1], 0)
+
+    def test_timed_out_page_is_read_again(self):
+        self.extract(ocr.OcrPage("", 0.1, 'timed out'))
+        pages, calls = self.extract(ocr.OcrPage("Cover page", 0.1, ''))
+        self.assertEqual((pages[1].text, calls), ("Cover page", 1))
+
+
+class NoteStorageTests(TempDirMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.use_settings(MEDIA_ROOT=self.tmp)
+        self.user = User.objects.create_user('ada', password='pw')
+
+    def test_failed_insert_gives_back_the_blob_reference(self):
+        save_base = models.Model.save_base
+
+        def fail_for_notes(instance, *args, **kwargs):
+            if isinstance(instance, Note):
+                raise IntegrityError("simulated")
+            return save_base(instance, *args, **kwargs)
+
+        note = Note(user=self.user, title="Bio", file=ContentFile(b"%PDF cells", name="bio.pdf"))
+        with mock.patch.object(models.Model, 'save_base', autospec=True, side_effect=fail_for_notes):
+            with self.assertRaises(IntegrityError):
+                note.save()
+        self.assertFalse(Blob.objects.exists())
+        self.assertFalse(note.file.storage.exists(note.file.name))
+
+    def test_identical_uploads_share_one_file(self):
+        first, second = (
+            Note.objects.create(user=self.user, title=t, file=ContentFile(b"%PDF datesheet", name=f"{t}.pdf"))
+            for t in ("mine", "classmate")
+        )
+        self.assertEqual(first.file.name, second.file.name)
+        self.assertEqual((first.original_name, second.original_name), ("mine.pdf", "classmate.pdf"))
+        self.assertEqual(Blob.objects.get().ref_count, 2)
+        name, storage = first.file.name, first.file.storage
+
+        first.file.delete(save=False)
+        self.assertTrue(storage.exists(name))
+        self.assertEqual(Blob.objects.get().ref_count, 1)
+        second.file.delete(save=False)
+        self.assertFalse(storage.exists(name))
+        self.assertFalse(Blob.objects.exists())
+
+
+class DatesheetImportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('ada', password='pw')
+        self.day = timezone.make_aware(datetime(2026, 3, 12, datesheet.EXAM_HOUR))
+
+    def entry(self, subject, day_offset=0):
+        return datesheet.ParsedExam(subject, self.day + timezone.timedelta(days=day_offset), "Sem 3")
+
+    def test_duplicates_are_dropped_in_memory(self):
+        Exam.objects.create(user=self.user, subject="Web Tech", date=self.day, is_datesheet_entry=True)
+        entries = [self.entry("Data Base"), self.entry("Data Base"), self.entry("Web Tech"), self.entry("Data Base", 1)]
+        self.assertEqual(datesheet.import_exams(self.user, entries), 2)
+        self.assertEqual(
+            sorted(Exam.objects.filter(user=self.user).values_list('subject', 'date')),
+            [("Data Base", self.day), ("Data Base", self.day + timezone.timedelta(days=1)), ("Web Tech", self.day)],
+        )
+        exam = Exam.objects.get(subject="Data Base", date=self.day)
+        self.assertTrue(exam.is_datesheet_entry)
+        self.assertEqual(exam.details, "Sem 3 [Extracted]")
+
+    def test_other_users_exams_dont_count(self):
+        other = User.objects.create_user('bob', password='pw')
+        Exam.objects.create(user=other, subject="Data Base", date=self.day)
+        self.assertEqual(datesheet.import_exams(self.user, [self.entry("Data Base")]), 1)
+
+    def test_one_bulk_insert(self):
+        entries = [self.entry(f"Subject {i}", i) for i in range(50)]
+        with mock.patch.object(Exam.objects, 'bulk_create', wraps=Exam.objects.bulk_create) as bulk_create, \
+                CaptureQueriesContext(connection) as queries:
+            self.assertEqual(datesheet.import_exams(self.user, entries), 50)
+        bulk_create.assert_called_once()
+        inserts = [q['sql'] for q in queries if q['sql'].lstrip().upper().startswith('INSERT')]
+        self.assertEqual(len(inserts), 1)
+
+    def test_nothing_to_import(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(datesheet.import_exams(self.user, []), 0)
+        self.assertEqual(len(queries), 0)
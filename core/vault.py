@@ -0,0 +1,859 @@
+# core/vault.py
+# On-disk layout and in-memory cache of each user's vector vault:
+#   user_<id>.manifest.json - the committed state: which index file, which chunk
+#                             store and how many of its chunks, note id -> title
+#   user_<id>.v<n>.index    - FAISS index written by commit n; vector ids are chunk ids
+#   user_<id>[.g<n>].chunks/... - ChunkStore (text, offsets, owning note id, exact
+#                             vector per chunk); compaction starts a new generation,
+#                             and a delete writes a new note-id column (.notes.v<n>)
+#   user_<id>.lock          - held by whichever thread/process is writing the vault
+#   user_<id>.needs_compact - left by a delete for the ingestion worker to compact
+# Writers stage new files, then os.replace the manifest, so readers see either
+# the old vault or the new one and a crash leaves the last commit intact.
+# Vaults from before the manifest (user_<id>.index + .meta.json) are read as is
+# and move to the new layout on their next write.
+# The index may hold compressed codes (VAULT_VECTOR_STORAGE); searches then
+# re-rank its candidates against the exact vectors memory-mapped from disk.
+
+import heapq
+import itertools
+import json
+import os
+import pickle
+import re
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import faiss
+import numpy as np
+from django.conf import settings
+
+from .chunk_store import ChunkStore, DEAD_NOTE
+from .file_lock import FileLock
+
+EMBED_DIM = 768
+
+# Flag a vault for compaction once this share of the chunks belongs to deleted notes
+COMPACT_DEAD_RATIO = getattr(settings, 'VAULT_COMPACT_DEAD_RATIO', 0.25)
+
+# Vaults with at least this many chunks switch from brute force to an ANN index
+ANN_THRESHOLD = getattr(settings, 'VAULT_ANN_THRESHOLD', 20000)
+ANN_KIND = getattr(settings, 'VAULT_ANN_KIND', 'ivf')  # 'ivf', 'hnsw' or 'flat' (never upgrade)
+IVF_NPROBE = getattr(settings, 'VAULT_IVF_NPROBE', 16)
+HNSW_M = getattr(settings, 'VAULT_HNSW_M', 32)
+HNSW_EF_CONSTRUCTION = getattr(settings, 'VAULT_HNSW_EF_CONSTRUCTION', 80)
+HNSW_EF_SEARCH = getattr(settings, 'VAULT_HNSW_EF_SEARCH', 64)
+
+# How vectors are held in the index: 'float32' (exact), 'fp16' / 'int8' (scalar quantizer,
+# 2x / 4x smaller) or 'pq' (product quantizer, PQ_M bytes per vector)
+VECTOR_STORAGE = getattr(settings, 'VAULT_VECTOR_STORAGE', 'float32')
+PQ_M = getattr(settings, 'VAULT_PQ_M', 96)
+PQ_MIN_POINTS = 256 * 39  # PQ codebooks need this many training vectors; smaller vaults use int8
+RERANK_FACTOR = getattr(settings, 'VAULT_RERANK_FACTOR', 4)  # Compressed candidates fetched per hit
+
+INDEX_DIR = os.path.join(settings.MEDIA_ROOT, 'vectors')
+if not os.path.exists(INDEX_DIR):
+    os.makedirs(INDEX_DIR)
+
+
+# --- PATHS ---
+def get_user_base_path(user_id):
+    return os.path.join(INDEX_DIR, f"user_{user_id}")
+
+def get_manifest_path(user_id):
+    return get_user_base_path(user_id) + ".manifest.json"
+
+def get_legacy_index_path(user_id):
+    return get_user_base_path(user_id) + ".index"
+
+def get_legacy_meta_path(user_id):
+    return get_user_base_path(user_id) + ".meta.json"
+
+def get_legacy_chunks_path(user_id):
+    # Pre chunk-store vaults pickled the whole chunk list here
+    return get_user_base_path(user_id) + ".pkl"
+
+def get_user_index_path(user_id, manifest=None):
+    manifest = manifest or load_manifest(user_id)
+    return os.path.join(INDEX_DIR, manifest['index']) if manifest else get_legacy_index_path(user_id)
+
+def get_user_store(user_id, manifest=None):
+    manifest = manifest or load_manifest(user_id)
+    if not manifest:
+        return ChunkStore(get_user_base_path(user_id), dim=EMBED_DIM)
+    return ChunkStore(os.path.join(INDEX_DIR, manifest['store']), dim=EMBED_DIM,
+                      notes_suffix=manifest.get('notes_column', '.notes'))
+
+def get_compaction_flag_path(user_id):
+    # Present while the vault has enough dead chunks to be compacted by the ingestion worker
+    return get_user_base_path(user_id) + ".needs_compact"
+
+def user_write_lock(user_id):
+    """Serialises writes to one user's vault across threads and processes; other users aren't blocked."""
+    return FileLock(get_user_base_path(user_id) + ".lock")
+
+
+def migrate_legacy_chunks(user_id):
+    """Moves an old user_<id>.pkl chunk list into the append-only chunk store."""
+    legacy_path = get_legacy_chunks_path(user_id)
+    if not os.path.exists(legacy_path):
+        return
+    with user_write_lock(user_id):
+        if not os.path.exists(legacy_path):
+            return
+        store = get_user_store(user_id)
+        if not store.exists():
+            with open(legacy_path, 'rb') as f:
+                store.append(pickle.load(f))
+        os.remove(legacy_path)
+
+
+# --- MANIFEST ---
+def _fsync(path):
+    with open(path, 'rb+') as f:
+        os.fsync(f.fileno())
+
+def load_manifest(user_id):
+    """The last committed state of the vault, or None for a legacy or missing vault."""
+    try:
+        with open(get_manifest_path(user_id), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def load_meta(user_id):
+    manifest = load_manifest(user_id)
+    if manifest:
+        return {'notes': manifest['notes']}
+    try:
+        with open(get_legacy_meta_path(user_id), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'notes': {}}
+
+def _commit(user_id, manifest, store, notes, index=None):
+    """Publishes a new version of the vault. Call with the user's write lock held.
+
+    `manifest` is the one the write started from (None for a new or legacy
+    vault), `index` None keeps its index file. Everything the new manifest
+    names is on disk before the manifest replaces the old one.
+    """
+    version = (manifest['version'] if manifest else 0) + 1
+    base = get_user_base_path(user_id)
+    if not store.base_path.startswith(base + '.g') and store.base_path != base:
+        store = store.move_to(f"{base}.g{version}")  # A staged rebuild becomes a new generation
+    store.sync()
+
+    if index is None and manifest:
+        index_name = manifest['index']
+    else:
+        index_name = f"user_{user_id}.v{version}.index"
+        index_path = os.path.join(INDEX_DIR, index_name)
+        if index is None:
+            index = faiss.read_index(get_legacy_index_path(user_id))
+        faiss.write_index(index, index_path + '.tmp')
+        _fsync(index_path + '.tmp')
+        os.replace(index_path + '.tmp', index_path)
+
+    new_manifest = {
+        'version': version,
+        'index': index_name,
+        'store': os.path.basename(store.base_path),
+        'notes_column': store.notes_suffix,
+        'chunks': len(store),
+        'notes': {str(note_id): title for note_id, title in notes.items()},
+    }
+    path = get_manifest_path(user_id)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(new_manifest, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + '.tmp', path)
+    vault_cache.invalidate(user_id)
+    _remove_unreferenced(user_id, new_manifest)
+    return new_manifest
+
+def _remove_unreferenced(user_id, manifest):
+    """Deletes index files and store generations the manifest no longer names (and legacy files)."""
+    pattern = re.compile(rf"^user_{user_id}(\.index|\.meta\.json|\.v\d+\.index(\.tmp)?|(\.g\d+)?\.(chunks|offsets|vectors|notes(\.v\d+)?(\.tmp)?))$")
+    keep = {manifest['index']} | {os.path.basename(p) for p in get_user_store(user_id, manifest).paths()}
+    for name in os.listdir(INDEX_DIR):
+        if pattern.match(name) and name not in keep:
+            try:
+                os.remove(os.path.join(INDEX_DIR, name))
+            except OSError:
+                pass  # Still mapped by a reader (Windows); the next commit retries
+
+
+# --- INDEX ---
+def new_index():
+    return faiss.IndexIDMap2(faiss.IndexFlatL2(EMBED_DIM))
+
+def ivf_nlist(n):
+    # ~4*sqrt(n) lists, but keep >= 39 training points per centroid
+    return max(1, min(int(4 * np.sqrt(n)), n // 39))
+
+def _sq_type(storage):
+    return faiss.ScalarQuantizer.QT_fp16 if storage == 'fp16' else faiss.ScalarQuantizer.QT_8bit
+
+def build_index(vectors, ids, kind=None, storage=None):
+    """Builds an index over `vectors` keyed by chunk `ids`. `kind` defaults to what the size calls for.
+
+    Flat and HNSW indexes sit behind an IndexIDMap2; IVF stores the chunk ids
+    itself, with a hashtable direct map so reconstruct() and removal by id work.
+    `storage` (default VECTOR_STORAGE) picks exact or compressed codes.
+    """
+    n = len(ids)
+    if kind is None:
+        kind = ANN_KIND if n >= ANN_THRESHOLD else 'flat'
+    storage = storage or VECTOR_STORAGE
+    if storage == 'pq' and n < PQ_MIN_POINTS:
+        storage = 'int8'
+    if kind == 'ivf' and n:
+        quantizer = faiss.IndexFlatL2(EMBED_DIM)
+        if storage == 'float32':
+            index = faiss.IndexIVFFlat(quantizer, EMBED_DIM, ivf_nlist(n))
+        elif storage == 'pq':
+            index = faiss.IndexIVFPQ(quantizer, EMBED_DIM, ivf_nlist(n), PQ_M, 8)
+        else:
+            index = faiss.IndexIVFScalarQuantizer(quantizer, EMBED_DIM, ivf_nlist(n), _sq_type(storage))
+        index.train(vectors)
+        index.set_direct_map_type(faiss.DirectMap.Hashtable)
+    elif kind == 'hnsw':
+        if storage == 'float32':
+            inner = faiss.IndexHNSWFlat(EMBED_DIM, HNSW_M)
+        elif storage == 'pq':
+            inner = faiss.IndexHNSWPQ(EMBED_DIM, PQ_M, HNSW_M)
+        else:
+            inner = faiss.IndexHNSWSQ(EMBED_DIM, _sq_type(storage), HNSW_M)
+        inner.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        if n and not inner.is_trained:
+            inner.train(vectors)
+        index = faiss.IndexIDMap2(inner)
+    elif storage == 'float32' or not n:
+        index = new_index()
+    else:
+        if storage == 'pq':
+            inner = faiss.IndexPQ(EMBED_DIM, PQ_M, 8)
+        else:
+            inner = faiss.IndexScalarQuantizer(EMBED_DIM, _sq_type(storage))
+        inner.train(vectors)
+        index = faiss.IndexIDMap2(inner)
+    if n:
+        index.add_with_ids(vectors, ids)
+    configure_search(index)
+    return index
+
+def _inner(index):
+    return faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap2) else index
+
+def index_kind(index):
+    inner = _inner(index)
+    if isinstance(inner, faiss.IndexIVF):
+        return 'ivf'
+    if isinstance(inner, faiss.IndexHNSW):
+        return 'hnsw'
+    return 'flat'
+
+def index_storage(index):
+    """'float32', 'fp16', 'int8' or 'pq': how the index holds its vectors."""
+    inner = _inner(index)
+    if isinstance(inner, faiss.IndexHNSW):
+        inner = faiss.downcast_index(inner.storage)
+    if isinstance(inner, (faiss.IndexScalarQuantizer, faiss.IndexIVFScalarQuantizer)):
+        return 'fp16' if inner.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else 'int8'
+    if isinstance(inner, (faiss.IndexPQ, faiss.IndexIVFPQ)):
+        return 'pq'
+    return 'float32'
+
+def index_nbytes(index):
+    """Approximate resident size of the index: codes, ids and HNSW links."""
+    inner = _inner(index)
+    links = 0
+    if isinstance(inner, faiss.IndexHNSW):
+        links = index.ntotal * HNSW_M * 2 * 4  # Level-0 neighbour lists dominate the graph
+        inner = faiss.downcast_index(inner.storage)
+    try:
+        code_size = inner.sa_code_size()
+    except RuntimeError:
+        code_size = index.d * 4
+    return index.ntotal * (code_size + 8) + links
+
+def configure_search(index, nprobe=None, ef_search=None):
+    """Applies the recall/latency knobs (VAULT_IVF_NPROBE / VAULT_HNSW_EF_SEARCH)."""
+    inner = _inner(index)
+    if isinstance(inner, faiss.IndexIVF):
+        inner.nprobe = min(nprobe or IVF_NPROBE, inner.nlist)
+    elif isinstance(inner, faiss.IndexHNSW):
+        inner.hnsw.efSearch = ef_search or HNSW_EF_SEARCH
+    return index
+
+def as_id_map(index):
+    """Wraps a pre-ID-map flat index so chunk ids become explicit vector ids."""
+    if not isinstance(index, faiss.IndexFlat):
+        return index
+    id_map = new_index()
+    if index.ntotal:
+        # Old vaults never deleted anything, so row number == chunk id
+        id_map.add_with_ids(index.reconstruct_n(0, index.ntotal), np.arange(index.ntotal, dtype='int64'))
+    return id_map
+
+def indexed_ids(index):
+    """Every chunk id that currently has a vector in the index."""
+    if isinstance(index, faiss.IndexIVF):
+        invlists = index.invlists
+        ids = [
+            faiss.rev_swig_ptr(invlists.get_ids(i), invlists.list_size(i)).copy()
+            for i in range(index.nlist) if invlists.list_size(i)
+        ]
+        return np.concatenate(ids).astype('int64') if ids else np.zeros(0, dtype='int64')
+    return faiss.vector_to_array(index.id_map).astype('int64')
+
+def reconstruct_ids(index, ids):
+    """Vectors for the given chunk ids (reconstruct_batch doesn't translate ids through every wrapper)."""
+    out = np.empty((len(ids), EMBED_DIM), dtype='float32')
+    for row, chunk_id in enumerate(ids):
+        out[row] = index.reconstruct(int(chunk_id))
+    return out
+
+def remove_ids(index, ids):
+    ids = np.asarray(ids, dtype='int64')
+    if isinstance(index, faiss.IndexIVF):
+        # The hashtable direct map only accepts an explicit id array
+        index.remove_ids(faiss.IDSelectorArray(len(ids), faiss.swig_ptr(ids)))
+    else:
+        index.remove_ids(ids)
+
+def backfill_vectors(index, store):
+    """Fills the store's exact-vector column from a float32 index (vaults written before it existed)."""
+    if store.has_vectors() or index_storage(index) != 'float32':
+        return False
+    vectors = np.zeros((len(store), EMBED_DIM), dtype='float32')
+    ids = indexed_ids(index)
+    ids = ids[ids < len(store)]
+    vectors[ids] = reconstruct_ids(index, ids)
+    store.set_vectors(vectors)
+    return True
+
+def _open_for_write(user_id):
+    """Loads (manifest, index, store) for modification, dropping anything a crashed write left behind.
+
+    Call with the user's write lock held.
+    """
+    migrate_legacy_chunks(user_id)
+    manifest = load_manifest(user_id)
+    store = get_user_store(user_id, manifest)
+    index_path = get_user_index_path(user_id, manifest)
+    if not (os.path.exists(index_path) and store.exists()):
+        store.reset()
+        return manifest, new_index(), store
+
+    index = as_id_map(faiss.read_index(index_path))
+    store.ensure_notes_column()
+    if manifest:
+        # Chunks past the committed count belong to a write that never committed
+        store.truncate(manifest['chunks'])
+    else:
+        # Legacy layout: chunks appended by a write that died before the index was saved have no vector
+        live = np.flatnonzero(store.note_ids() != DEAD_NOTE)
+        orphans = np.setdiff1d(live, indexed_ids(index))
+        if len(orphans):
+            store = store.with_tombstones(orphans, '.notes.v1')  # Published by the first commit
+    backfill_vectors(index, store)
+    return manifest, index, store
+
+def _live_vectors(index, store):
+    """(vectors, chunk ids) for every live chunk: exact from the store, else read back out of the index."""
+    ids = np.flatnonzero(store.note_ids() != DEAD_NOTE).astype('int64')
+    if store.has_vectors():
+        return store.vectors(ids), ids
+    return reconstruct_ids(index, ids), ids
+
+def _maybe_upgrade(index, store):
+    """Retrains a growing flat vault into the configured ANN index once it passes ANN_THRESHOLD."""
+    if ANN_KIND == 'flat' or index_kind(index) != 'flat' or index.ntotal < ANN_THRESHOLD:
+        return index
+    print(f"⚡ AI: Vault passed {ANN_THRESHOLD} chunks, upgrading to {ANN_KIND.upper()}...")
+    vectors, ids = _live_vectors(index, store)
+    return build_index(vectors, ids, ANN_KIND)
+
+def _maybe_retrain(index, store, before):
+    """Retrains compressed codes each time the vault doubles, so they aren't fitted to the first note alone."""
+    if index_storage(index) == 'float32' or not before or index.ntotal.bit_length() == before.bit_length():
+        return index
+    vectors, ids = _live_vectors(index, store)
+    if not len(ids):
+        return index
+    print(f"⚡ AI: Vault reached {index.ntotal} chunks, retraining its {index_storage(index)} codes...")
+    return build_index(vectors, ids, index_kind(index))
+
+
+# --- CACHE: Keep hot vaults resident in memory between questions ---
+# `dead` counts tombstoned chunks still inside the index (HNSW can't remove vectors)
+Vault = namedtuple('Vault', ['index', 'chunks', 'titles', 'dead'])
+
+class VaultCache:
+    """Process-level LRU of loaded Vault(index, ChunkReader, titles) keyed by user id.
+
+    Entries are stamped with a per-user version counter plus the mtime/size of
+    the files on disk, so writes from this process (``invalidate``) and from
+    other processes (a changed file) both force a reload. Least recently used
+    vaults are evicted once the estimated footprint passes ``max_bytes``.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # user_id -> (stamp, vault, size)
+        self._versions = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def stamp(self, user_id):
+        """Identifies the on-disk state of a vault; None if the user has no vault."""
+        try:
+            manifest_stat = os.stat(get_manifest_path(user_id))
+            return (self._versions.get(user_id, 0), manifest_stat.st_ino, manifest_stat.st_mtime_ns, manifest_stat.st_size)
+        except FileNotFoundError:
+            pass
+        # Legacy layout, written in place
+        try:
+            index_stat = os.stat(get_legacy_index_path(user_id))
+            chunks_stat = os.stat(get_user_store(user_id).offsets_path)
+        except FileNotFoundError:
+            return None
+        try:
+            meta_stat = os.stat(get_legacy_meta_path(user_id))
+            meta = (meta_stat.st_mtime_ns, meta_stat.st_size)
+        except FileNotFoundError:
+            meta = (0, 0)
+        return (
+            self._versions.get(user_id, 0),
+            index_stat.st_mtime_ns, index_stat.st_size,
+            chunks_stat.st_mtime_ns, chunks_stat.st_size,
+        ) + meta
+
+    @staticmethod
+    def _estimate_size(vault):
+        return index_nbytes(vault.index) + vault.chunks.nbytes
+
+    def get(self, user_id):
+        """Returns the user's Vault, or None if it is empty."""
+        migrate_legacy_chunks(user_id)
+        with self._lock:
+            stamp = self.stamp(user_id)
+            if stamp is None:
+                self._drop(user_id)
+                return None
+            entry = self._entries.get(user_id)
+            if entry and entry[0] == stamp:
+                self._entries.move_to_end(user_id)
+                return entry[1]
+
+        # Load outside the lock so one slow read doesn't block other users
+        vault = self._load(user_id)
+
+        size = self._estimate_size(vault)
+        with self._lock:
+            self._drop(user_id)
+            if size <= self.max_bytes:
+                self._entries[user_id] = (stamp, vault, size)
+                self._bytes += size
+                while self._bytes > self.max_bytes:
+                    _, (_, _, old_size) = self._entries.popitem(last=False)
+                    self._bytes -= old_size
+        return vault
+
+    @staticmethod
+    def _load(user_id, attempts=3):
+        """Reads the vault exactly as its manifest describes it, never a write in progress."""
+        for attempt in range(attempts):
+            manifest = load_manifest(user_id)
+            try:
+                if manifest:
+                    store = get_user_store(user_id, manifest)
+                    index = faiss.read_index(get_user_index_path(user_id, manifest))
+                    reader = store.reader(manifest['chunks'])
+                    titles = manifest['notes']
+                else:
+                    store = get_user_store(user_id)
+                    store.ensure_notes_column()
+                    index = faiss.read_index(get_legacy_index_path(user_id))
+                    reader = store.reader()
+                    titles = load_meta(user_id).get('notes', {})
+            except (FileNotFoundError, RuntimeError):
+                # A writer committed and cleaned up between reading the manifest and the files
+                if attempt == attempts - 1 or load_manifest(user_id) == manifest:
+                    raise
+                continue
+            configure_search(index)
+            dead = int(np.count_nonzero(reader.note_ids == DEAD_NOTE)) if index_kind(index) == 'hnsw' else 0
+            return Vault(index, reader, titles, dead)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._versions[user_id] = self._versions.get(user_id, 0) + 1
+            self._drop(user_id)
+
+    def _drop(self, user_id):
+        entry = self._entries.pop(user_id, None)
+        if entry:
+            self._bytes -= entry[2]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+vault_cache = VaultCache(getattr(settings, 'VAULT_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+
+
+# --- WRITES: each runs under the user's write lock and ends in one manifest commit ---
+def append_note(user_id, note_id, title, chunks, embeddings):
+    """Adds one note's chunks and vectors to the user's vault."""
+    with user_write_lock(user_id):
+        manifest, index, store = _open_for_write(user_id)
+
+        # Only the new chunks are written; the rest of the vault is never re-read
+        first_id = store.append(chunks, note_id, embeddings)
+        ids = np.arange(first_id, first_id + len(chunks), dtype='int64')
+        before = index.ntotal
+        if before == 0:
+            # A first note trains any compressed codes on real vectors
+            index = build_index(embeddings, ids)
+        else:
+            index.add_with_ids(embeddings, ids)
+        upgraded = _maybe_upgrade(index, store)
+        index = upgraded if upgraded is not index else _maybe_retrain(index, store, before)
+
+        notes = load_meta(user_id)['notes']
+        notes[str(note_id)] = title
+        _commit(user_id, manifest, store, notes, index)
+
+
+def remove_note(user_id, note_id):
+    """Drops a note's vectors from the index and tombstones its chunks. Returns the chunk count."""
+    with user_write_lock(user_id):
+        manifest = load_manifest(user_id)
+        if not os.path.exists(get_user_index_path(user_id, manifest)):
+            return 0
+        manifest, index, store = _open_for_write(user_id)
+        chunk_ids = store.chunk_ids_for_note(note_id)
+        notes = load_meta(user_id)['notes']
+        if not len(chunk_ids) and str(note_id) not in notes:
+            return 0  # Never indexed (e.g. a datesheet): a commit would only invalidate the caches
+        changed_index = None
+        if len(chunk_ids):
+            if index_kind(index) != 'hnsw':
+                # HNSW graphs can't drop vectors; their tombstones are filtered at search time
+                remove_ids(index, chunk_ids)
+                changed_index = index
+            # Readers keep the old column until the commit below names this one
+            version = (manifest['version'] if manifest else 0) + 1
+            store = store.with_tombstones(chunk_ids, f".notes.v{version}")
+
+        notes.pop(str(note_id), None)
+        _commit(user_id, manifest, store, notes, changed_index)
+
+        if _needs_compaction(store):
+            # Rewriting the vault is too slow for a delete request; the ingestion worker does it
+            open(get_compaction_flag_path(user_id), 'a').close()
+    return len(chunk_ids)
+
+
+def rename_note(user_id, note_id, title):
+    with user_write_lock(user_id):
+        notes = load_meta(user_id)['notes']
+        if str(note_id) in notes:
+            manifest, _, store = _open_for_write(user_id)
+            notes[str(note_id)] = title
+            _commit(user_id, manifest, store, notes)
+
+
+def _needs_compaction(store):
+    total = len(store)
+    return bool(total) and store.dead_count() / total >= COMPACT_DEAD_RATIO
+
+
+def compact_if_flagged(user_id):
+    """Compacts a vault remove_note flagged, if it still needs it. Returns True if it was compacted."""
+    flag = get_compaction_flag_path(user_id)
+    with user_write_lock(user_id):
+        if not os.path.exists(flag):
+            return False  # Another worker got here first
+        compacted = False
+        manifest = load_manifest(user_id)
+        if os.path.exists(get_user_index_path(user_id, manifest)) and _needs_compaction(get_user_store(user_id, manifest)):
+            compact(user_id)
+            compacted = True
+        os.remove(flag)
+    return compacted
+
+
+def compact(user_id):
+    """Rewrites the chunk store and index without tombstoned chunks, renumbering ids from 0."""
+    with user_write_lock(user_id):
+        manifest, index, store = _open_for_write(user_id)
+        note_ids = store.note_ids()
+        live = np.flatnonzero(note_ids != DEAD_NOTE).astype('int64')
+        print(f"🧹 AI: Compacting vault of user {user_id} ({len(note_ids) - len(live)} dead chunks)...")
+
+        reader = store.reader()
+        texts = [reader.get(int(i)) for i in live]
+        del reader  # Release the maps before the old generation is deleted
+        vectors, _ = _live_vectors(index, store)
+
+        # The compacted vault is a new store generation; readers keep the old one until the commit
+        staged = ChunkStore(get_user_base_path(user_id) + '.compact', dim=EMBED_DIM)
+        staged.reset()
+        staged.append(texts, note_ids[live], vectors)
+        # Rebuilding also retrains IVF lists (or drops back to flat) for the new size
+        compacted = build_index(vectors, np.arange(len(live), dtype='int64'))
+        _commit(user_id, manifest, staged, load_meta(user_id)['notes'], compacted)
+
+
+def load_for_rebuild(user_id):
+    """(current index, store, live vectors, live chunk ids, version) for rebuilding a user's index, or None."""
+    with user_write_lock(user_id):
+        manifest = load_manifest(user_id)
+        if not os.path.exists(get_user_index_path(user_id, manifest)):
+            return None
+        manifest, index, store = _open_for_write(user_id)
+        vectors, ids = _live_vectors(index, store)
+        return index, store, vectors, ids, manifest['version'] if manifest else 0
+
+
+class VaultChanged(Exception):
+    """The vault was written to while a replacement index was being built from it."""
+
+
+def replace_index(user_id, index, version):
+    """Atomically swaps in an index rebuilt from `version` of the user's vault."""
+    with user_write_lock(user_id):
+        manifest = load_manifest(user_id)
+        if (manifest['version'] if manifest else 0) != version:
+            raise VaultChanged(f"user {user_id}'s vault changed during the rebuild")
+        _, _, store = _open_for_write(user_id)
+        _commit(user_id, manifest, store, load_meta(user_id)['notes'], index)
+
+
+# --- REINDEX: Rebuild a whole vault next to the live one, then swap it in ---
+class StagedVault:
+    """A replacement vault for one user, built in user_<id>.reindex.* while the live one keeps serving.
+
+    The staged chunk store doubles as the checkpoint: a note whose chunks are in
+    it is done, so an interrupted rebuild resumes where it stopped. `config`
+    (embedding model, chunk sizes) must match for a checkpoint to be resumed.
+    """
+
+    def __init__(self, user_id, config):
+        self.user_id = user_id
+        self.config = config
+        base = get_user_base_path(user_id) + '.reindex'
+        self.store = ChunkStore(base, dim=EMBED_DIM)
+        self.checkpoint_path = base + '.json'
+        self.failed = set()
+        try:
+            with open(self.checkpoint_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            state = None
+        self.resumable = bool(state) and state.get('config') == config and self.store.exists()
+        if self.resumable:
+            self.failed = set(state.get('failed', []))
+
+    def _save_checkpoint(self):
+        tmp_path = self.checkpoint_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'config': self.config, 'failed': sorted(self.failed)}, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def begin(self):
+        """Starts over unless there's a checkpoint for the same config."""
+        if not self.resumable:
+            self.store.reset()
+            self.failed = set()
+            self._save_checkpoint()
+            self.resumable = True
+
+    def done_note_ids(self):
+        """Notes already staged (or given up on) by this rebuild."""
+        if not self.resumable:
+            return set()
+        return {int(n) for n in np.unique(self.store.note_ids())} | self.failed
+
+    def add(self, note_id, chunks, embeddings):
+        self.store.append(chunks, note_id, embeddings)
+
+    def skip(self, note_id):
+        self.failed.add(note_id)
+        self._save_checkpoint()
+
+    def copy_from_live(self, note_ids):
+        """Carries notes over from the live vault unchanged. Returns the ids it had no exact vectors for."""
+        if not note_ids:
+            return set()
+        with user_write_lock(self.user_id):
+            manifest = load_manifest(self.user_id)
+            live = get_user_store(self.user_id, manifest)
+            if not (os.path.exists(get_user_index_path(self.user_id, manifest)) and live.has_vectors()):
+                return set(note_ids)
+            reader = live.reader(manifest['chunks'] if manifest else None)
+            missing = set()
+            for note_id in note_ids:
+                chunk_ids = np.flatnonzero(np.asarray(reader.note_ids) == note_id)
+                if not len(chunk_ids):
+                    missing.add(note_id)
+                    continue
+                self.add(note_id, [reader.get(int(i)) for i in chunk_ids], live.vectors(chunk_ids))
+        return missing
+
+    def commit(self, titles):
+        """Swaps the staged vault in. `titles` ({note id: title}) are the notes that still exist;
+        any of them only in the live vault (uploaded meanwhile) are carried over first."""
+        titles = {int(note_id): title for note_id, title in titles.items()}
+        with user_write_lock(self.user_id):  # No upload can land between the last copy and the swap
+            staged_ids = self.done_note_ids() - self.failed
+            self.copy_from_live(set(titles) - staged_ids - self.failed)
+
+            note_ids = self.store.note_ids()
+            self.store.mark_dead(np.flatnonzero(~np.isin(note_ids, list(titles))))  # Deleted meanwhile
+            ids = np.flatnonzero(self.store.note_ids() != DEAD_NOTE).astype('int64')
+            if len(ids):
+                index = build_index(self.store.vectors(ids), ids)
+            else:
+                index = new_index()
+
+            staged_notes = set(int(n) for n in np.unique(note_ids[ids])) if len(ids) else set()
+            migrate_legacy_chunks(self.user_id)
+            _commit(self.user_id, load_manifest(self.user_id), self.store,
+                    {n: t for n, t in titles.items() if n in staged_notes}, index)
+        self.discard()
+
+    def discard(self):
+        self.store.reset()
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+
+def user_ids_on_disk():
+    ids = set()
+    for name in os.listdir(INDEX_DIR):
+        match = re.match(r"^user_(\d+)\.(manifest\.json|index)$", name)
+        if match:
+            ids.add(int(match.group(1)))
+    return sorted(ids)
+
+
+def user_ids_flagged_for_compaction():
+    return sorted(int(m.group(1)) for m in map(re.compile(r"^user_(\d+)\.needs_compact$").match, os.listdir(INDEX_DIR)) if m)
+
+
+# --- READS ---
+def search(user_vault, q_vectors, k):
+    """Searches one vault. Returns, per query row, a list of (distance, chunk_id) for live chunks.
+
+    Compressed indexes over-fetch and re-rank by exact L2 distance to the
+    memory-mapped vectors, so distances stay exact and comparable across vaults.
+    """
+    q_vectors = np.asarray(q_vectors, dtype='float32')
+    exact = user_vault.chunks.vectors
+    rerank = exact is not None and index_storage(user_vault.index) != 'float32'
+    fetch = k * RERANK_FACTOR if rerank else k
+    if user_vault.dead:
+        # Over-fetch so tombstoned HNSW entries don't crowd out live hits
+        fetch = fetch * 4
+    fetch = max(1, min(user_vault.index.ntotal, fetch))
+    distances, ids = user_vault.index.search(q_vectors, fetch)
+    results = []
+    for q, row_d, row_i in zip(q_vectors, distances, ids):
+        hits = [(float(d), int(i)) for d, i in zip(row_d, row_i) if user_vault.chunks.is_live(int(i))]
+        if rerank and hits:
+            candidates = np.array([i for _, i in hits], dtype='int64')
+            exact_d = ((exact[candidates] - q) ** 2).sum(axis=1)
+            hits = sorted(zip(exact_d.tolist(), candidates.tolist()))
+        results.append(hits[:k])
+    return results
+
+def exact_vectors(user_vault, chunk_ids):
+    """Vectors of the given chunks: exact from disk when stored, else from the index."""
+    if user_vault.chunks.vectors is not None:
+        return np.asarray(user_vault.chunks.vectors[np.asarray(chunk_ids, dtype='int64')])
+    return reconstruct_ids(user_vault.index, chunk_ids)
+
+
+# --- SQUAD VAULTS: one retrieval call over several members' vaults ---
+# FAISS releases the GIL while searching, so shards really run side by side
+_shard_pool = ThreadPoolExecutor(max_workers=getattr(settings, 'VAULT_SHARD_SEARCH_THREADS', 8))
+
+
+def search_shards(shards, q_vector, k):
+    """Searches every (owner_id, Vault) shard at once and merges the global top-k.
+
+    Returns [(distance, owner_id, chunk_id)] sorted by distance. All shards
+    store exact L2 vectors, so distances are comparable across them.
+    """
+    q_vectors = np.asarray(q_vector, dtype='float32').reshape(1, -1)
+
+    def run(shard):
+        owner_id, user_vault = shard
+        return [(d, owner_id, chunk_id) for d, chunk_id in search(user_vault, q_vectors, k)[0]]
+
+    if len(shards) == 1:
+        per_shard = [run(shards[0])]
+    else:
+        per_shard = _shard_pool.map(run, shards)
+    return heapq.nsmallest(k, itertools.chain.from_iterable(per_shard))
+
+
+class ShardSetCache:
+    """Per-squad cache of the resolved shard list [(owner_id, Vault)] of the members sharing their vaults.
+
+    An entry is reused while the squad's sharing members are the same and none
+    of their vaults changed on disk. The asker's own vault is added per call
+    (from VaultCache), so squadmates who don't share can take turns asking
+    without evicting each other's entry. Held Vaults stay alive even if the
+    main VaultCache evicts them, so keep ``max_squads`` modest.
+    """
+
+    def __init__(self, max_squads):
+        self.max_squads = max_squads
+        self._entries = OrderedDict()  # squad_id -> (stamp, shards)
+        self._lock = threading.Lock()
+
+    def get(self, squad_id, owner_ids, asker_id=None):
+        """Shards of `owner_ids` (the sharing members) plus `asker_id`'s own vault."""
+        shards = self._shared(squad_id, owner_ids)
+        if asker_id is None or asker_id in owner_ids:
+            return shards
+        own = vault_cache.get(asker_id)
+        if own is None or not own.index.ntotal:
+            return shards
+        return shards + [(asker_id, own)]
+
+    def _shared(self, squad_id, owner_ids):
+        stamp = tuple((uid, vault_cache.stamp(uid)) for uid in owner_ids)
+        with self._lock:
+            entry = self._entries.get(squad_id)
+            if entry and entry[0] == stamp:
+                self._entries.move_to_end(squad_id)
+                return entry[1]
+
+        shards = []
+        for uid in owner_ids:
+            user_vault = vault_cache.get(uid)
+            if user_vault is not None and user_vault.index.ntotal:
+                shards.append((uid, user_vault))
+
+        with self._lock:
+            self._entries[squad_id] = (stamp, shards)
+            self._entries.move_to_end(squad_id)
+            while len(self._entries) > self.max_squads:
+                self._entries.popitem(last=False)
+        return shards
+
+    def invalidate(self, squad_id):
+        with self._lock:
+            self._entries.pop(squad_id, None)
+
+squad_shard_cache = ShardSetCache(getattr(settings, 'VAULT_SQUAD_CACHE_SIZE', 64))
@@ -1,12 +1,13 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth import login
 from django.contrib.auth.forms import AuthenticationForm
 from django.utils import timezone
 from django.contrib import messages
 from django.views.decorators.http import require_POST
 from django.db.models import Avg, Count, Q
-from .models import Note, Exam, Topic, Profile, Squad, Membership, Transmission
+from .models import Note, Exam, Topic, Profile, Squad, Membership, Transmission, IngestionJob
 from .forms import NoteForm, ExamForm, SquadForm, JoinSquadForm
 import os
 import re
@@ -14,14 +15,16 @@ from datetime import datetime, timedelta
 from collections import Counter
 import json
 from django.contrib.auth import logout
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from . import rag 
+from . import ingestion
+from . import datesheet
+from . import syllabus
+from . import ocr_cache
 
 # --- PDF & OCR LIBRARIES ---
 import pdfplumber
 import pytesseract
-from pdf2image import convert_from_path
-from PIL import Image, ImageEnhance
 
 # ⚠️ CONFIGURATION
 POPPLER_PATH = r"D:\Release-25.12.0-0\poppler-25.12.0\Library\bin" 
@@ -207,73 +210,26 @@ def notes_hub(request):
             note.user = request.user
             note.save()
 
-            filename = note.file.name.lower()
             title = note.title.upper()
 
             # ==========================================
             # 1. DATESHEET LOGIC (OCR)
             # ==========================================
-            if "DATESHEET" in title or "DATESHEET" in filename.upper():
-                extracted_count = 0
+            if note.kind == Note.KIND_DATESHEET:
+                entries = []
                 try:
-                    images = convert_from_path(note.file.path, poppler_path=POPPLER_PATH, dpi=400)
-                    for i, img in enumerate(images):
-                        width, height = img.size
-                        img = img.resize((width * 2, height * 2), Image.Resampling.LANCZOS)
-                        img = img.convert('L') 
-                        enhancer = ImageEnhance.Contrast(img)
-                        img = enhancer.enhance(2.0) 
-
-                        raw_text = pytesseract.image_to_string(img, config='--psm 6')
-                        lines = raw_text.split('\n')
-
-                        for line in lines:
-                            line = line.strip()
-                            if len(line) < 10: continue
-                            clean_line = line.replace('|', ' ').replace('!', ' ').replace(']', '1').upper()
-                            clean_line = clean_line.replace('O', '0').replace('L', '1').replace('I', '1')
-
-                            date_pattern = r'(\d{1,2})[-/\s.]([A-Z]{3}|\d{1,2})[-/\s.](\d{4})'
-                            date_match = re.search(date_pattern, clean_line)
-                            
-                            if date_match:
-                                date_str = date_match.group(0)
-                                sem_label = "Unknown"
-                                sem_match = re.search(r'(\d+)\s*SEM', clean_line)
-                                if sem_match: sem_label = f"Sem {sem_match.group(1)}"
-
-                                temp = clean_line.replace(date_str, '')
-                                temp = re.sub(r'\d+\s*SEM', '', temp)
-                                temp = re.sub(r'\b[A-Z0-9]{5,10}\b', '', temp) 
-                                temp = temp.replace('MORNING', '').replace('EVENING', '').replace('CSE', '').replace('BRANCH', '').replace('SESSION', '')
-                                subject_name = temp.strip()
-
-                                if len(subject_name) > 3 and not subject_name.isdigit():
-                                    try:
-                                        d_str = date_str.replace('.', '-').replace('/', '-')
-                                        try:
-                                            exam_date = datetime.strptime(d_str, "%d-%b-%Y")
-                                        except:
-                                            try:
-                                                exam_date = datetime.strptime(d_str, "%d-%B-%Y")
-                                            except:
-                                                continue 
-
-                                        final_date = timezone.make_aware(datetime(exam_date.year, exam_date.month, exam_date.day, 9, 0))
-                                        
-                                        if not Exam.objects.filter(user=request.user, subject=subject_name.title(), date=final_date).exists():
-                                            Exam.objects.create(
-                                                user=request.user,
-                                                subject=subject_name.title(),
-                                                date=final_date,
-                                                is_datesheet_entry=True,
-                                                details=f"{sem_label} [Extracted]"
-                                            )
-                                            extracted_count += 1
-                                    except Exception: pass
+                    # Text layer first, then OCR at the lowest dpi that reads each line;
+                    # everyone uploads the same datesheet, so each distinct file is read once
+                    pages = datesheet.read_pages(
+                        note.file.path, poppler_path=POPPLER_PATH, cache=ocr_cache.get_page_cache(), digest=note.content_hash or None
+                    )
+                    for page in pages:
+                        entries.extend(datesheet.parse_text(page['text']))
                 except Exception as e:
                     messages.error(request, f"Error: {e}")
 
+                # One bulk insert for the whole datesheet (pages read before an error still count)
+                extracted_count = datesheet.import_exams(request.user, entries)
                 if extracted_count > 0:
                     messages.success(request, f"⚡ SUCCESS: {extracted_count} exams imported.")
                 else:
@@ -282,7 +238,7 @@ def notes_hub(request):
             # ==========================================
             # 2. CHO SYLLABUS LOGIC
             # ==========================================
-            elif title.startswith('CHO') and filename.endswith('.pdf'):
+            elif note.kind == Note.KIND_CHO:
                 target_exam = Exam.objects.create(
                     user=request.user, 
                     subject=title,
@@ -292,27 +248,9 @@ def notes_hub(request):
                 messages.success(request, f"Initialized new protocol: {title}")
                 
                 try:
-                    extracted_count = 0
-                    with pdfplumber.open(note.file.path) as pdf:
-                        for page in pdf.pages:
-                            tables = page.extract_tables()
-                            for table in tables:
-                                for row in table:
-                                    if not row or len(row) < 2: continue
-                                    lec_cell = str(row[0]).strip()
-                                    if re.match(r'^[\d\s\-]+$', lec_cell):
-                                        topic_cell = row[1] if row[1] else max(row, key=lambda x: len(str(x)))
-                                        topic_text = str(topic_cell).replace('\n', ' ').strip()
-                                        if len(topic_text) > 3:
-                                            final_name = f"[Lec {lec_cell}] {topic_text}"
-                                            Topic.objects.create(
-                                                exam=target_exam, 
-                                                name=final_name, 
-                                                source_note=note, 
-                                                is_cho=True
-                                            )
-                                            extracted_count += 1
-                    
+                    # Pages are parsed one at a time and the rows written in one bulk insert
+                    page_tables = syllabus.read_page_tables(note.file.path, cache=ocr_cache.get_page_cache(), digest=note.content_hash or None)
+                    extracted_count = syllabus.import_topics(target_exam, note, syllabus.parse_tables(page_tables))
                     if extracted_count > 0:
                         messages.success(request, f"⚡ MAPPED {extracted_count} MODULES TO {title}.")
                 except Exception:
@@ -322,17 +260,15 @@ def notes_hub(request):
             # 3. RAG / AI BRAIN LOGIC (New Addition)
             # ==========================================
             else:
-                # If it is NOT a Datesheet and NOT a CHO Syllabus, feed it to the AI
-                success = rag.add_note_to_vault(note)
-                if success:
-                    messages.success(request, "✅ Neural Index Updated: Note added to AI knowledge base.")
-                else:
-                    messages.warning(request, "⚠️ Note saved, but AI indexing failed (File might be too short or unreadable).")
+                # If it is NOT a Datesheet and NOT a CHO Syllabus, feed it to the AI.
+                # Indexing runs in the background worker (manage.py ingest_worker).
+                ingestion.enqueue_note(note)
+                messages.success(request, "📡 Note uploaded. Neural indexing queued - track progress on the card.")
 
             return redirect('notes_hub')
     
     # --- GET REQUEST (Display Notes) ---
-    notes = Note.objects.filter(user=request.user).order_by('-uploaded_at')
+    notes = Note.objects.filter(user=request.user).select_related('ingestion').order_by('-uploaded_at')
     if query:
         notes = notes.filter(title__icontains=query)
     
@@ -341,6 +277,7 @@ def notes_hub(request):
 
     context = {
         'notes': notes,
+        'my_squads': Squad.objects.filter(members__user=request.user),
         'query': query if query else '',
         'online_count': online_count,
         'form': NoteForm() # Ensure form is passed for the modal
@@ -398,9 +335,10 @@ def delete_mission(request, exam_id):
 @login_required(login_url='signin')
 def delete_note(request, note_id):
     note = get_object_or_404(Note, id=note_id, user=request.user)
+    rag.remove_note_from_vault(note)
     if note.file:
         try:
-            if os.path.isfile(note.file.path): os.remove(note.file.path)
+            note.file.delete(save=False) # Drops this note's reference; the file goes with the last one
         except Exception: pass
     note.delete()
     messages.success(request, "Node decommissioned.")
@@ -414,6 +352,7 @@ def rename_note(request, note_id):
     if new_title:
         note.title = new_title
         note.save()
+        rag.rename_note_in_vault(note)
         messages.success(request, "Node re-indexed.")
     return redirect('notes_hub')
 
@@ -496,11 +435,24 @@ def squad_detail(request, squad_id):
     context = {
         'squad': squad,
         'members': members,
+        'my_membership': next((m for m in members if m.user_id == request.user.id), None),
         'transmissions': transmissions,
         'online_count': Profile.objects.filter(last_seen__gte=timezone.now() - timezone.timedelta(minutes=5)).exclude(user=request.user).count()
     }
     return render(request, 'squad_detail.html', context)
 
+@login_required(login_url='signin')
+@require_POST
+def toggle_vault_share(request, squad_id):
+    membership = get_object_or_404(Membership, squad_id=squad_id, user=request.user)
+    membership.share_vault = not membership.share_vault
+    membership.save()
+    if membership.share_vault:
+        messages.success(request, "AI Vault shared: squadmates can now query your notes.")
+    else:
+        messages.success(request, "AI Vault access revoked for this squadron.")
+    return redirect('squad_detail', squad_id=squad_id)
+
 @login_required(login_url='signin')
 def get_squad_messages(request, squad_id):
     squad = get_object_or_404(Squad, id=squad_id)
@@ -543,17 +495,62 @@ def delete_topic(request, topic_id):
 
 
 # --- NEW CHAT VIEW ---
+# Async: a chat waiting on Gemini parks on the event loop instead of holding a worker thread (serve with ASGI)
 @login_required
 @require_POST
-def vault_chat(request):
+async def vault_chat(request):
     try:
         data = json.loads(request.body)
         question = data.get('message')
         if not question:
             return JsonResponse({'answer': 'Empty transmission.'})
 
+        user = await request.auser()
+        # Optional squad mode: query every opted-in squadmate's vault in one pass
+        squad = None
+        if data.get('squad_id'):
+            squad = await Squad.objects.filter(id=data.get('squad_id'), members__user=user).afirst()
+            if squad is None:
+                return JsonResponse({'answer': 'Access Denied: You are not an operative of this squadron.'}, status=403)
+
+        # Streaming mode: relay the answer as server-sent events while the model writes it
+        if data.get('stream'):
+            pieces = rag.astream_vault_answer(user, question, squad=squad)
+            response = StreamingHttpResponse(sse_answer_events(pieces), content_type='text/event-stream')
+            response['Cache-Control'] = 'no-cache'
+            response['X-Accel-Buffering'] = 'no'  # Stop nginx from holding the stream back
+            return response
+
         # Ask the brain
-        answer = rag.ask_vault(request.user, question)
+        answer = await rag.aask_vault(user, question, squad=squad)
         return JsonResponse({'answer': answer})
     except Exception as e:
-        return JsonResponse({'answer': f"System Error: {str(e)}"})
\ No newline at end of file
+        return JsonResponse({'answer': f"System Error: {str(e)}"})
+
+async def sse_answer_events(pieces):
+    """`data: {"delta": ...}` per piece, then an `event: done` carrying the full answer."""
+    answer = ""
+    try:
+        async for piece in pieces:
+            answer += piece
+            yield f"data: {json.dumps({'delta': piece})}\n\n"
+    except Exception as e:
+        piece = f"System Error: {str(e)}"
+        answer += piece
+        yield f"data: {json.dumps({'delta': piece})}\n\n"
+    yield f"event: done\ndata: {json.dumps({'answer': answer})}\n\n"
+
+@login_required
+async def ingestion_status(request):
+    # Polled by the notes hub: ?ids=1,2,3 limits the response to those notes
+    user = await request.auser()
+    jobs = IngestionJob.objects.filter(note__user=user)
+    ids = request.GET.get('ids')
+    if ids:
+        jobs = jobs.filter(note_id__in=[int(i) for i in ids.split(',') if i.strip().isdigit()])
+    return JsonResponse({'jobs': [job.as_dict() async for job in jobs]})
+
+@staff_member_required
+def vault_cache_stats(request):
+    # Hit/miss counters of this process's chat caches, for tuning VAULT_ANSWER_CACHE_THRESHOLD
+    return JsonResponse(rag.cache_stats())
@@ -172,4 +172,78 @@ SESSION_COOKIE_AGE = 86400
 SESSION_SAVE_EVERY_REQUEST = True 
 
 # Security (Optional but good)
-SESSION_EXPIRE_AT_BROWSER_CLOSE = False # True = logout on close, False = remember for 24h
\ No newline at end of file
+SESSION_EXPIRE_AT_BROWSER_CLOSE = False # True = logout on close, False = remember for 24h
+
+# --- VAULT AI (RAG) ---
+# Memory budget for the per-process cache of loaded user vaults (index + chunks)
+VAULT_CACHE_MAX_BYTES = int(os.getenv('VAULT_CACHE_MAX_MB', '256')) * 1024 * 1024
+# Compact a vault's flat files (in the ingestion worker) once this share of its chunks belongs to deleted notes
+VAULT_COMPACT_DEAD_RATIO = 0.25
+# Switch a vault from brute force to an ANN index ('ivf' or 'hnsw') past this many chunks.
+# Tune nprobe / efSearch with: python manage.py vault_benchmark
+VAULT_ANN_THRESHOLD = int(os.getenv('VAULT_ANN_THRESHOLD', '20000'))
+VAULT_ANN_KIND = os.getenv('VAULT_ANN_KIND', 'ivf')
+VAULT_IVF_NPROBE = 16
+VAULT_HNSW_M = 32
+VAULT_HNSW_EF_SEARCH = 64
+# Squad vault queries: parallel shard searches and how many squads keep a resolved shard set
+VAULT_SHARD_SEARCH_THREADS = 8
+VAULT_SQUAD_CACHE_SIZE = 64
+# Embedder for chunks and questions: 'gemini' (API) or 'local' (offline hashing, for staging/benchmarks).
+# Vaults built with one backend must be re-indexed before switching to the other.
+VAULT_EMBEDDING_BACKEND = os.getenv('VAULT_EMBEDDING_BACKEND', 'gemini')
+# Chunking (characters) and prompt assembly: search fetches CANDIDATES chunks, MMR drops
+# near-duplicates and keeps the most relevant distinct ones that fit the token budget.
+# Chunks less than MIN_RELEVANCE times as similar to the question as the best hit are left out.
+VAULT_CHUNK_SIZE = 1000
+VAULT_CHUNK_OVERLAP = 150
+VAULT_CONTEXT_CANDIDATES = 20
+VAULT_CONTEXT_TOKEN_BUDGET = 1200
+VAULT_MMR_RELEVANCE_WEIGHT = 0.7
+VAULT_CONTEXT_MIN_RELEVANCE = 0.5
+# Model that writes chat answers: 'gemini' or 'local' (offline stand-in that quotes the retrieved notes)
+VAULT_CHAT_MODEL = os.getenv('VAULT_CHAT_MODEL', 'gemini')
+VAULT_LOCAL_CHAT_DELAY = 0.0  # Seconds per word the local model waits while streaming
+# Chat caches (per process): exact question -> embedding, and similar question on an
+# unchanged vault that retrieves the same chunks -> earlier answer. Stats for tuning at
+# /api/vault-cache-stats/ (staff only).
+VAULT_QUESTION_CACHE_SIZE = 2048
+VAULT_ANSWER_CACHE_SCOPES = 1024
+VAULT_ANSWER_CACHE_PER_SCOPE = 64
+VAULT_ANSWER_CACHE_THRESHOLD = float(os.getenv('VAULT_ANSWER_CACHE_THRESHOLD', '0.95'))
+# Embedding requests in flight at once per note being ingested (still within the rate limits below)
+VAULT_EMBED_CONCURRENCY = int(os.getenv('VAULT_EMBED_CONCURRENCY', '4'))
+# How vault indexes store vectors: 'float32', 'fp16' or 'int8' (scalar quantised) or 'pq'
+# (product quantised, ~32x smaller). Compressed results are re-ranked against exact vectors
+# kept on disk; run `manage.py vault_compress` to convert existing vaults and compare recall.
+VAULT_VECTOR_STORAGE = os.getenv('VAULT_VECTOR_STORAGE', 'float32')
+VAULT_PQ_M = 96
+VAULT_RERANK_FACTOR = 4
+# Users rebuilt in parallel by `manage.py reindex_vault` (re-embeds every note after a chunking or model change)
+VAULT_REINDEX_WORKERS = 2
+# Gemini quotas (requests per minute; each text in an embedding batch counts as one), shared
+# by all web and worker processes through one SQLite token bucket each. The live rate halves
+# on a 429 and recovers as calls succeed.
+GEMINI_RATE_LIMITS = {
+    'gemini-embed': {'per_minute': int(os.getenv('GEMINI_EMBED_RPM', '1500'))},
+    'gemini-generate': {'per_minute': int(os.getenv('GEMINI_GENERATE_RPM', '10'))},
+}
+
+
+# Background ingestion pool (manage.py ingest_worker), sized separately from web workers
+INGESTION_WORKERS = int(os.getenv('INGESTION_WORKERS', '2'))
+INGESTION_MAX_ATTEMPTS = 3
+INGESTION_STALE_SECONDS = 1800
+INGESTION_RETRY_SECONDS = 60  # First retry delay; doubles with each attempt
+
+# OCR process pool: max pages recognised at once, and per-page render/recognise timeout (s)
+OCR_MAX_WORKERS = int(os.getenv('OCR_MAX_WORKERS', str(min(4, os.cpu_count() or 1))))
+OCR_PAGE_TIMEOUT = 120
+# Shared cache of extraction results keyed by file content + settings (the same datesheet
+# uploaded by a whole class is OCR'd once). Least recently used files are evicted past the budget.
+OCR_CACHE_MAX_BYTES = int(os.getenv('OCR_CACHE_MAX_MB', '256')) * 1024 * 1024
+# Datesheet OCR: pages are read at the first dpi and only low-confidence lines (Tesseract's
+# 0-100 score) are re-read at the next. Per-page dpi/confidence stats are appended to
+# MEDIA_ROOT/vectors/datesheet_ocr_stats.jsonl (or DATESHEET_OCR_STATS_PATH) for tuning.
+DATESHEET_OCR_DPIS = (150, 300, 600)
+DATESHEET_OCR_MIN_CONFIDENCE = 75
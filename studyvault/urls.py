@@ -27,11 +27,14 @@ urlpatterns = [
     path('squads/', views.squad_hub, name='squad_hub'),
     path('squads/<int:squad_id>/', views.squad_detail, name='squad_detail'),
     path('squads/<int:squad_id>/messages/', views.get_squad_messages, name='get_squad_messages'),
+    path('squads/<int:squad_id>/share-vault/', views.toggle_vault_share, name='toggle_vault_share'),
     
     # NEW: Refresh-Free Logic & Delete Topic
     path('api/toggle-topic/', views.toggle_topic_status, name='toggle_topic_status'),
     path('syllabus/delete/<int:topic_id>/', views.delete_topic, name='delete_topic'),
     path('api/vault-chat/', views.vault_chat, name='vault_chat'),
+    path('api/ingestion-status/', views.ingestion_status, name='ingestion_status'),
+    path('api/vault-cache-stats/', views.vault_cache_stats, name='vault_cache_stats'),
 
     # Auth
     path('accounts/', include('allauth.urls')),